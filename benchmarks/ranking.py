@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+#
+#    Copyright (C) 2008  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+ranking.py - Benchmark the ranking pipeline on the 24h relay event of the
+             test suite.
+
+The event is loaded with the EventTest fixture of tests/conftest.py (teams,
+courses and runs imported from the test files) into an empty database and
+removed again afterwards. The benchmark refuses to run on a database which
+already contains runs. Two timings are reported:
+  - cold: validate, score and rank all rankings of the event with an
+          empty cache
+  - warm: recompute all rankings with all validation and scoreing
+          results in the cache (sorting, ranking and behind times only)
+
+With --baseline the benchmark is run a second time with the bosco package
+of another source tree (e.g. a git worktree of an older commit) and both
+results are compared.
+
+Example: python3 benchmarks/ranking.py -d bosco_test -b /tmp/baseline
+"""
+
+import sys
+import os
+import json
+from optparse import OptionParser
+from os.path import join, dirname, abspath
+from subprocess import check_output
+from time import perf_counter
+
+# The source tree of the bosco package to benchmark, see --baseline
+_ROOT = join(dirname(abspath(__file__)), '..')
+sys.path.insert(0, os.environ.get('BOSCO_SOURCE', _ROOT))
+sys.path.insert(1, join(_ROOT, 'tests'))
+
+from storm.locals import Store, create_database
+
+from bosco.ranking import UnscoreableException
+from bosco.run import Run
+from conftest import EventTest
+
+def load_event(database):
+    """Load the test event into an empty database.
+    @return: EventTest fixture, call its __exit__ method to remove the data
+    """
+    store = Store(create_database('postgres:%s' % database))
+    if store.find(Run).count() > 0:
+        raise RuntimeError("Database '%s' is not empty." % database)
+    fixture = EventTest(store)
+    fixture.__enter__()
+    return fixture
+
+def rank_all(event):
+    """Compute all rankings of the event. Rankings which can not be computed
+    are skipped.
+    @return: tuple (number of ranked items, number of skipped rankings)
+    """
+    count = 0
+    skipped = 0
+    for desc, ranking in event.list_rankings():
+        try:
+            ranking.update()
+        except UnscoreableException:
+            skipped += 1
+            continue
+        count += ranking.member_count
+    return count, skipped
+
+def benchmark(event, repeat):
+    """
+    @return: dict with the best cold and warm time in seconds, the number
+             of ranked items and the number of skipped rankings
+    """
+    cold = []
+    warm = []
+    for i in range(repeat):
+        event._cache.clear()
+        start = perf_counter()
+        count, skipped = rank_all(event)
+        cold.append(perf_counter() - start)
+
+        start = perf_counter()
+        rank_all(event)
+        warm.append(perf_counter() - start)
+
+    return {'cold': min(cold), 'warm': min(warm), 'items': count,
+            'skipped': skipped}
+
+def run(database, repeat):
+    """Load the event, run the benchmark and remove the event again."""
+    fixture = load_event(database)
+    try:
+        return benchmark(fixture._event, repeat)
+    finally:
+        fixture.__exit__()
+
+def run_baseline(source, database, repeat):
+    """Run the benchmark with the bosco package from another source tree."""
+    env = dict(os.environ, BOSCO_SOURCE=abspath(source))
+    output = check_output([sys.executable, abspath(__file__), '-d', database,
+                           '-n', str(repeat), '--json'], env=env)
+    # the importers print warnings, the result is on the last line
+    return json.loads(output.splitlines()[-1])
+
+if __name__ == '__main__':
+
+    opt = OptionParser(usage='usage: %prog [options]')
+    opt.add_option('-d', '--database', action='store', default='bosco_test',
+                   help='Empty database to load the event into.')
+    opt.add_option('-n', '--repeat', action='store', type='int', default=3,
+                   help='Number of repetitions, the best time is reported.')
+    opt.add_option('-b', '--baseline', action='store', default=None,
+                   help='Source tree to compare with.')
+    opt.add_option('--json', action='store_true', default=False,
+                   help='Print the result as JSON.')
+    (options, args) = opt.parse_args()
+
+    result = run(options.database, options.repeat)
+    if options.json:
+        print(json.dumps(result))
+        sys.exit()
+
+    results = [('current', result)]
+    if options.baseline:
+        results.insert(0, ('baseline', run_baseline(options.baseline,
+                                                    options.database,
+                                                    options.repeat)))
+    for name, r in results:
+        print('%-8s: %d ranked items, cold %.3fs, warm %.3fs'
+              % (name, r['items'], r['cold'], r['warm']))
+        if r['skipped']:
+            print('%-8s  %d rankings skipped because they could not be scored.'
+                  % ('', r['skipped']))
+    if options.baseline:
+        base = results[0][1]
+        print('speedup : cold %.2fx, warm %.2fx'
+              % (base['cold'] / result['cold'], base['warm'] / result['warm']))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+readout.py - Benchmark reading out SI-Cards with the run editor.
+
+The cards are read from a FakeReadout station (see
+bosco.test.fakestation) by RunEditor.poll_reader and
+RunEditor.load_run_from_card like in the GUI. The cards are read from a
+backup file in the format of SIRunImporter (e.g. the backup written during
+an event) or generated for the courses of the event. The test event is
+loaded into an empty database like in ranking.py.
+
+The number of cards read per minute and the latency of every stage of
+the readout are reported:
+  - read:     read the card data from the station (no time with a fake
+              station, a real station takes about half a second)
+  - find:     search for a run already read and for the open run of the card
+  - create:   create the run or add the punches to the open run
+  - course:   find the course of new runs
+  - commit:   commit the run to the database
+  - validate: validate and score the run for the display
+
+Example: python3 benchmarks/readout.py -d bosco_test -n 200
+         python3 benchmarks/readout.py -d bosco_test -f tests/import_24h_run.csv
+"""
+
+import gettext
+import json
+import sys
+from optparse import OptionParser
+from statistics import median
+from time import perf_counter
+
+from ranking import load_event
+
+from bosco.editor import RunEditor
+from bosco.importer import SIRunImporter
+from bosco.test.fakestation import FakeReadout, synthetic_cards
+
+STAGES = ('read', 'find', 'create', 'course', 'commit', 'validate')
+
+# stage starting with a progress message of the run editor
+PROGRESS_STAGES = {'Reading card data...': 'read',
+                   'Searching for matching run...': 'find',
+                   'Searching for open run...': 'find',
+                   'Creating new run and adding punches...': 'create',
+                   'Adding punches to existing run...': 'create',
+                   'Searching matching course ...': 'course',
+                   'Course already set.': 'course',
+                   'Updating validation...': 'validate',
+                   'Commiting run to database...': 'commit',
+                   }
+
+class StageTimer:
+    """Observer of the run editor which adds the time between progress
+    messages to the stage of the message."""
+
+    def __init__(self):
+        self.card = None
+        self._stage = None
+        self._start = None
+
+    def start(self):
+        self.card = dict.fromkeys(STAGES, 0.0)
+
+    def update(self, editor, event, message=None):
+        if event != 'progress' or self.card is None:
+            return
+        self.stop()
+        self._stage = PROGRESS_STAGES.get(editor.progress[1])
+        self._start = perf_counter()
+
+    def stop(self):
+        if self._stage is not None:
+            self.card[self._stage] += perf_counter() - self._start
+            self._stage = None
+
+def benchmark(event, store, cards):
+    """Read all cards with the run editor.
+    @return: dict with the number of cards, the cards read per minute and
+             the median, 95th percentile and maximum latency of every stage
+             in milliseconds
+    """
+    reader = FakeReadout(cards)
+    editor = RunEditor(store, event)
+    editor.connect_reader(reader=reader)
+    timer = StageTimer()
+    editor.add_observer(timer)
+
+    latencies = []
+    start = perf_counter()
+    while not reader.empty:
+        editor.poll_reader()
+        if editor.sicard is None:
+            continue
+        timer.start()
+        editor.load_run_from_card()
+        timer.stop()
+        # the GUI shows the validation and score of the run
+        validate = perf_counter()
+        editor.run_validation
+        editor.run_score
+        timer.card['validate'] += perf_counter() - validate
+        latencies.append(timer.card)
+    total = perf_counter() - start
+    editor.remove_observer(timer)
+
+    result = {'cards': len(latencies),
+              'cards_per_minute': len(latencies) / total * 60,
+              'stages': {}}
+    for stage in STAGES + ('total', ):
+        if stage == 'total':
+            values = sorted(sum(c.values()) for c in latencies)
+        else:
+            values = sorted(c[stage] for c in latencies)
+        result['stages'][stage] = {
+            'median': median(values) * 1000,
+            'p95': values[int(len(values) * 0.95)] * 1000,
+            'max': values[-1] * 1000,
+            }
+    return result
+
+def run(database, count, backup):
+    """Load the event, run the benchmark and remove the event again."""
+    fixture = load_event(database)
+    try:
+        if backup is not None:
+            cards = SIRunImporter(backup).card_data()
+        else:
+            cards = list(synthetic_cards(fixture._store, count))
+        return benchmark(fixture._event, fixture._store, cards)
+    finally:
+        fixture.__exit__()
+
+if __name__ == '__main__':
+
+    opt = OptionParser(usage='usage: %prog [options]')
+    opt.add_option('-d', '--database', action='store', default='bosco_test',
+                   help='Empty database to load the event into.')
+    opt.add_option('-n', '--count', action='store', type='int', default=200,
+                   help='Number of cards generated for the courses of the event.')
+    opt.add_option('-f', '--file', action='store', default=None,
+                   help='Read the cards from this backup file instead of '
+                        'generating them.')
+    opt.add_option('--json', action='store_true', default=False,
+                   help='Print the result as JSON.')
+    (options, args) = opt.parse_args()
+
+    # the run editor needs the gettext functions installed by load_config
+    gettext.install('bosco', 'locale')
+
+    result = run(options.database, options.count, options.file)
+    if options.json:
+        print(json.dumps(result))
+        sys.exit()
+
+    print('%d cards, %.0f cards per minute' % (result['cards'],
+                                               result['cards_per_minute']))
+    print('%-9s %9s %9s %9s' % ('stage', 'median', 'p95', 'max'))
+    for stage, r in result['stages'].items():
+        print('%-9s %7.1fms %7.1fms %7.1fms' % (stage, r['median'], r['p95'],
+                                                 r['max']))
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+suite.py - Benchmark suite for the hot paths of bosco with machine readable
+           results.
+
+The benchmarks are run on datasets of different sizes (levels):
+  - test:   the 24h relay event of the test suite (Relay24hEvent)
+  - small, medium, large: synthetic relay events generated with
+            bosco.test.generator (RelayEvent), large has 20000 runners
+            and 500000 punches
+
+For every dataset and event type these cases are measured:
+  - ranking:    compute all rankings with an empty cache (full) and after
+                a change of a single run (incremental, the run is
+                invalidated like by the EventObserver)
+  - validation: validate every run with an empty cache
+  - export:     render the course rankings and run pages as HTML with the
+                bootstrap templates (like ranking_export) and the course and
+                category rankings in the SOLV format
+  - observer:   latency from committing a new punch in another connection
+                until the observer invalidated the cache and all rankings
+                are up to date
+The import case imports the bundled course, team and run files and a
+generated SOLV runner file into the empty database.
+
+Every dataset is loaded into an empty database and removed afterwards.
+The results are printed as a table or written as JSON (-o). Times are
+in seconds (keys ending in _s), rates in items per second (_per_s). JSON
+results of different versions are compared with --compare.
+
+Example: python3 benchmarks/suite.py -d bosco_test -l test,small -o new.json
+         python3 benchmarks/suite.py --compare old.json new.json
+"""
+
+import gettext
+import json
+import platform
+import sys
+from datetime import datetime, timedelta
+from optparse import OptionParser
+from os.path import join
+from subprocess import check_output, CalledProcessError
+from statistics import mean
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from types import SimpleNamespace
+
+from ranking import rank_all, _ROOT
+
+from storm.locals import Store, create_database
+
+from bosco.course import BaseCourse, Course
+from bosco.event import RelayEvent
+from bosco.export import format_solv, render_ranking
+from bosco.importer import (OCADXMLCourseImporter, SIRunImporter,
+                            SOLVDBImporter, Team24hImporter)
+from bosco.observer import EventObserver
+from bosco.ranking import Cache, RelayRanking
+from bosco.run import Run
+from bosco.test.generator import EventGenerator, clear
+from conftest import EventTest
+
+# arguments of EventGenerator for the synthetic levels
+LEVELS = {'small': dict(categories=2, teams=50, legs=3, variants=2,
+                        controls=12),
+          'medium': dict(categories=10, teams=100, legs=5, variants=4,
+                         controls=20),
+          'large': dict(categories=10, teams=400, legs=5, variants=4,
+                        controls=25),
+          }
+
+# header of the HTML pages
+HEADER = {'event': 'Benchmark', 'map': 'Map', 'place': 'Place',
+          'date': '1. June 2014', 'organiser': 'Organiser', 'rankings': []}
+
+# number of runs changed for the incremental ranking and observer cases
+CHANGES = 5
+
+# time of the punches added in the observer case
+PUNCHTIME = datetime(2014, 6, 1, 12, 0)
+
+def load_dataset(store, level):
+    """Load a dataset into the empty database.
+    @return: tuple (dict of event type name to event, cleanup function)
+    """
+    if store.find(Run).count() > 0:
+        raise RuntimeError('Database is not empty.')
+
+    if level == 'test':
+        fixture = EventTest(store)
+        fixture.__enter__()
+        # the test event has no header and no template for the run pages
+        fixture._event._header = HEADER
+        fixture._event._template_dir = 'bootstrap_templates'
+        fixture._event._template['html'] = 'ranking.html'
+        fixture._event._run_template['html'] = 'run.html'
+        return {'Relay24hEvent': fixture._event}, fixture.__exit__
+
+    generator = EventGenerator(store, **LEVELS[level])
+    generator.generate()
+    event = RelayEvent(generator.legs(), cache=Cache(), store=store,
+                       header=HEADER, template_dir='bootstrap_templates',
+                       html_template='ranking.html')
+    return {'RelayEvent': event}, lambda: clear(store)
+
+def changed_runs(store):
+    """Runs used for the incremental cases, spread over all runs."""
+    ids = sorted(store.find(Run).values(Run.id))
+    return [store.get(Run, ids[i * len(ids) // CHANGES]) for i in range(CHANGES)]
+
+def bench_ranking(event, store):
+    event._cache.clear()
+    start = perf_counter()
+    items, skipped = rank_all(event)
+    full = perf_counter() - start
+
+    observer = EventObserver(store, interval=None, rollback=False)
+    event._cache.set_observer(observer)
+    times = []
+    try:
+        for run in changed_runs(store):
+            start = perf_counter()
+            observer._run_notify(run)
+            rank_all(event)
+            times.append(perf_counter() - start)
+    finally:
+        event._cache.remove_observer()
+    return {'items': items, 'skipped_rankings': skipped, 'full_s': full,
+            'incremental_s': mean(times)}
+
+def bench_validation(event, store):
+    event._cache.clear()
+    runs = list(store.find(Run))
+    times = []
+    for run in runs:
+        start = perf_counter()
+        event.validate(run)
+        times.append(perf_counter() - start)
+    times.sort()
+    total = sum(times)
+    return {'runs': len(runs), 'total_s': total,
+            'runs_per_s': len(runs) / total,
+            'p95_s': times[int(len(times) * 0.95)]}
+
+def bench_export(event, store):
+    rankings = event.list_rankings()
+    # the bootstrap templates only format course rankings
+    courses = [(desc, r) for desc, r in rankings
+               if isinstance(r.rankable, BaseCourse)]
+    # compute the rankings first, only formatting is measured
+    rank_all(event)
+    start = perf_counter()
+    size = 0
+    pages = 0
+    for desc, ranking in courses:
+        files, completed = render_ranking(event, desc, ranking, 'utf-8')
+        size += sum(len(content) for name, content in files)
+        pages += len(files)
+    html = perf_counter() - start
+
+    conf = SimpleNamespace(starttime=datetime(2008, 4, 14, 19, 0),
+                           control_replacements=None, control_exclude=None)
+    # the SOLV category format is only defined for relay rankings
+    solv = [(desc, r) for desc, r in rankings
+            if isinstance(r.rankable, BaseCourse) or isinstance(r, RelayRanking)]
+    start = perf_counter()
+    for desc, ranking in solv:
+        format_solv(conf, desc, ranking)
+    solv_time = perf_counter() - start
+    return {'html_rankings': len(courses), 'html_pages': pages,
+            'html_bytes': size, 'html_s': html,
+            'html_pages_per_s': pages / html if pages else 0,
+            'solv_rankings': len(solv), 'solv_s': solv_time,
+            'solv_rankings_per_s': len(solv) / solv_time if solv else 0}
+
+def bench_observer(event, store, database):
+    rank_all(event)
+    other = Store(create_database('postgres:%s' % database))
+    observer = EventObserver(store, interval=None)
+    event._cache.set_observer(observer)
+    observe = []
+    refresh = []
+    try:
+        for i, run in enumerate(changed_runs(store)):
+            # a punch of a radio control stored by autoreader
+            other_run = other.get(Run, run.id)
+            other_run.add_punch((31, PUNCHTIME + timedelta(seconds=i)))
+            other.commit()
+
+            start = perf_counter()
+            observer.observe()
+            observed = perf_counter()
+            rank_all(event)
+            observe.append(observed - start)
+            refresh.append(perf_counter() - observed)
+    finally:
+        event._cache.remove_observer()
+        other.close()
+    return {'observe_s': mean(observe), 'refresh_s': mean(refresh),
+            'latency_s': mean(observe) + mean(refresh)}
+
+def solv_file(path, store, count):
+    """Write a SOLV runner file with count runners on the courses in store."""
+    courses = [c.code for c in store.find(Course).order_by(Course.code)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('SOLV-Nr;Vorname;Name;Jahrgang;Verein;SI_Karte;'
+                'Angemeldete_Kategorie;Bahn\n')
+        for i in range(count):
+            f.write('%d;Given%d;Runner%d;1980;Club %d;%d;HAM;%s\n'
+                    % (100000 + i, i, i, i % 50, 2000001 + i,
+                       courses[i % len(courses)]))
+
+def bench_import(store, count):
+    """Import the test files and a SOLV file with count runners."""
+    if store.find(Run).count() > 0:
+        raise RuntimeError('Database is not empty.')
+    tests = join(_ROOT, 'tests')
+    result = {}
+    try:
+        start = perf_counter()
+        OCADXMLCourseImporter(join(tests, 'import_24h_course.xml'),
+                              finish=True, start=False).import_data(store)
+        Team24hImporter(join(tests, 'import_24h_team.csv'),
+                        'iso-8859-1').import_data(store)
+        store.commit()
+        result['courses_teams_s'] = perf_counter() - start
+
+        importer = SIRunImporter(join(tests, 'import_24h_run.csv'))
+        start = perf_counter()
+        importer.import_data(store)
+        store.commit()
+        runs = perf_counter() - start
+        result.update({'sirun_runs': len(importer.card_data()),
+                       'sirun_s': runs,
+                       'sirun_runs_per_s': len(importer.card_data()) / runs})
+
+        with TemporaryDirectory() as tmp:
+            solv_file(join(tmp, 'solv.csv'), store, count)
+            importer = SOLVDBImporter(join(tmp, 'solv.csv'), 'utf-8')
+            start = perf_counter()
+            importer.import_data(store)
+            store.commit()
+            solv = perf_counter() - start
+        result.update({'solv_runners': count, 'solv_s': solv,
+                       'solv_runners_per_s': count / solv})
+    finally:
+        clear(store)
+    return result
+
+CASES = ('ranking', 'validation', 'export', 'observer')
+
+def run(database, levels, cases, solv_count):
+    """Run the benchmarks.
+    @return: dict with the results, see the module documentation
+    """
+    store = Store(create_database('postgres:%s' % database))
+    results = {}
+    if 'import' in cases:
+        results['import'] = bench_import(store, solv_count)
+
+    for level in levels:
+        events, cleanup = load_dataset(store, level)
+        try:
+            for name, event in events.items():
+                key = '%s/%s' % (level, name)
+                results[key] = {}
+                for case in CASES:
+                    if case not in cases:
+                        continue
+                    if case == 'observer':
+                        r = bench_observer(event, store, database)
+                    else:
+                        r = globals()['bench_%s' % case](event, store)
+                    results[key][case] = r
+                    print('%s %s done' % (key, case), file=sys.stderr)
+        finally:
+            cleanup()
+    return results
+
+def version():
+    try:
+        return check_output(['git', 'describe', '--always', '--dirty'], cwd=_ROOT,
+                            universal_newlines=True).strip()
+    except (CalledProcessError, OSError):
+        return None
+
+def flatten(results):
+    """
+    @return: dict of 'dataset case metric' to value
+    """
+    flat = {}
+    for dataset, cases in results.items():
+        if 'import' == dataset:
+            cases = {'import': cases}
+        for case, metrics in cases.items():
+            for metric, value in metrics.items():
+                flat['%s %s %s' % (dataset, case, metric)] = value
+    return flat
+
+def compare(old, new):
+    """Print the metrics of two result files side by side."""
+    old_flat = flatten(old['results'])
+    print('%-52s %10s %10s %7s' % ('%s -> %s' % (old['version'], new['version']),
+                                   'old', 'new', 'ratio'))
+    for key, value in flatten(new['results']).items():
+        before = old_flat.get(key)
+        ratio = ''
+        if before and (key.endswith('_s') or key.endswith('_per_s')):
+            ratio = '%6.2fx' % (value / before)
+        print('%-52s %10s %10s %7s' % (key, format_value(before),
+                                       format_value(value), ratio))
+
+def format_value(value):
+    if isinstance(value, float):
+        return '%.4f' % value
+    return '' if value is None else str(value)
+
+if __name__ == '__main__':
+
+    opt = OptionParser(usage='usage: %prog [options]\n'
+                             '       %prog --compare old.json new.json')
+    opt.add_option('-d', '--database', action='store', default='bosco_test',
+                   help='Empty database to load the datasets into.')
+    opt.add_option('-l', '--levels', action='store', default='test,small',
+                   help='Comma separated list of datasets: test, %s.'
+                        % ', '.join(LEVELS))
+    opt.add_option('-c', '--cases', action='store',
+                   default=','.join(('import', ) + CASES),
+                   help='Comma separated list of benchmark cases.')
+    opt.add_option('--solv-runners', action='store', type='int', default=2000,
+                   help='Number of runners in the SOLV file of the import case.')
+    opt.add_option('-o', '--output', action='store', default=None,
+                   help='Write the results as JSON to this file.')
+    opt.add_option('--compare', action='store_true', default=False,
+                   help='Compare two JSON result files.')
+    (options, args) = opt.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            opt.error('--compare needs two result files.')
+        compare(*[json.load(open(f)) for f in args])
+        sys.exit()
+
+    # the formatters need the gettext functions installed by load_config
+    gettext.install('bosco', 'locale')
+
+    results = {'version': version(),
+               'python': platform.python_version(),
+               'date': datetime.now().isoformat(),
+               'results': run(options.database, options.levels.split(','),
+                              options.cases.split(','), options.solv_runners)}
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        for key, value in flatten(results['results']).items():
+            print('%-52s %s' % (key, format_value(value)))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+templates.py - Benchmark template compilation and rendering.
+
+Three timings are reported:
+  - startup: compile all templates in templates/ and bootstrap_templates/,
+             from source and from the compiled modules of a module directory
+             (see bosco.formatter.set_template_module_directory)
+  - render:  render all course rankings and run pages of the test event
+             (like ranking_export) with one template lookup per formatter
+             (the behaviour before the shared template registry) and with
+             the shared registry
+
+The test event is loaded into an empty database like in ranking.py.
+
+Example: python3 benchmarks/templates.py -d bosco_test
+"""
+
+import gettext
+import json
+import sys
+from optparse import OptionParser
+from os import listdir
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from ranking import load_event
+
+from mako.lookup import TemplateLookup
+from pkg_resources import resource_filename
+
+import bosco.formatter
+from bosco.event import Event
+from bosco.export import render_ranking
+from bosco.formatter import get_template, set_template_module_directory
+
+TEMPLATE_DIRS = ('templates', 'bootstrap_templates')
+
+def load_all():
+    """Compile or load all templates with a new registry.
+    @return: time in seconds
+    """
+    set_template_module_directory(bosco.formatter._template_module_directory)
+    start = perf_counter()
+    for d in TEMPLATE_DIRS:
+        for f in listdir(resource_filename('bosco', d)):
+            get_template(d, f)
+    return perf_counter() - start
+
+def startup(repeat):
+    """
+    @return: dict with the best times to compile all templates from source
+             and to load them from the module directory
+    """
+    source = []
+    cached = []
+    with TemporaryDirectory() as tmp:
+        for i in range(repeat):
+            set_template_module_directory(None)
+            source.append(load_all())
+
+            set_template_module_directory('%s/%d' % (tmp, i))
+            # the first run compiles the modules
+            load_all()
+            cached.append(load_all())
+    set_template_module_directory(None)
+    return {'compile': min(source), 'load_cached': min(cached)}
+
+def _uncached_template(template_dir, template_file):
+    lookup = TemplateLookup(directories=[resource_filename('bosco', template_dir)])
+    return lookup.get_template(template_file)
+
+def render_all(event, rankings):
+    """
+    @return: tuple (time in seconds, number of rendered pages)
+    """
+    start = perf_counter()
+    pages = 0
+    for desc, ranking in rankings:
+        files, completed = render_ranking(event, desc, ranking, 'utf-8')
+        pages += len(files)
+    return perf_counter() - start, pages
+
+def render(store, repeat):
+    """
+    @return: dict with the best render times per page with one lookup per
+             formatter and with the shared registry
+    """
+    header = {'event': 'Benchmark', 'rankings': [], 'organiser': '',
+              'map': '', 'place': '', 'date': ''}
+    event = Event(header, template_dir='bootstrap_templates',
+                  html_template='ranking.html', store=store)
+    rankings = [(c.code, event.ranking(c)) for c in event.list_courses()]
+    # compute rankings and fill the caches first
+    render_all(event, rankings)
+
+    per_formatter = []
+    shared = []
+    for i in range(repeat):
+        bosco.formatter.get_template = _uncached_template
+        try:
+            t, pages = render_all(event, rankings)
+        finally:
+            bosco.formatter.get_template = get_template
+        per_formatter.append(t / pages)
+
+        t, pages = render_all(event, rankings)
+        shared.append(t / pages)
+    return {'pages': pages, 'per_formatter': min(per_formatter),
+            'shared': min(shared)}
+
+if __name__ == '__main__':
+
+    opt = OptionParser(usage='usage: %prog [options]')
+    opt.add_option('-d', '--database', action='store', default='bosco_test',
+                   help='Empty database to load the event into.')
+    opt.add_option('-n', '--repeat', action='store', type='int', default=3,
+                   help='Number of repetitions, the best time is reported.')
+    opt.add_option('--json', action='store_true', default=False,
+                   help='Print the result as JSON.')
+    (options, args) = opt.parse_args()
+
+    # the formatters need the gettext functions installed by load_config
+    gettext.install('bosco', 'locale')
+
+    result = startup(options.repeat)
+    fixture = load_event(options.database)
+    try:
+        result.update(render(fixture._store, options.repeat))
+    finally:
+        fixture.__exit__()
+
+    if options.json:
+        print(json.dumps(result))
+        sys.exit()
+
+    print('startup : compile %.3fs, load compiled modules %.3fs'
+          % (result['compile'], result['load_cached']))
+    print('render  : %d pages, %.2fms/page with a lookup per formatter, '
+          '%.2fms/page with the shared registry'
+          % (result['pages'], result['per_formatter'] * 1000,
+             result['shared'] * 1000))
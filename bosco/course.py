@@ -23,6 +23,7 @@ course.py - Classes for orienteering courses. Everything here is
 
 from storm.locals import *
 
+from collections import Counter
 from datetime import timedelta
 
 from .ranking import Rankable, ValidationError, UnscoreableException
@@ -265,6 +266,112 @@ class Course(MyStorm, BaseCourse):
         return self.code
 
 
+class CourseIndex:
+    """Index of the controls of all courses to find the courses matching the
+    punches of a run without validating the run against every course.
+
+    The index is a snapshot of the courses in the store at the time it is
+    created. It maps SI stations to their control and controls to the courses
+    containing them and stores the controls of every course (the course
+    signature) and their sequence. Only controls
+    which are relevant for validation (see Course.controllist) are indexed.
+    """
+
+    def __init__(self, store):
+        """
+        @param store: Storm store with the courses, the index is built with
+                      two queries
+        """
+        self._store = store
+        # course id -> Counter of control ids
+        self._signatures = {i: Counter() for i in store.find(Course).values(Course.id)}
+        # sistation id -> control id
+        self._stations = {}
+        # control id -> set of course ids
+        self._courses = {}
+        # course id -> list of control ids of the controls with a sequence
+        # number in the order of the course
+        self._sequences = {i: [] for i in self._signatures}
+
+        rows = store.using(ControlSequence,
+                           Join(Control, ControlSequence._control_id == Control.id),
+                           Join(SIStation, SIStation._control_id == Control.id),
+                           ).find((ControlSequence.id, ControlSequence._course_id,
+                                   ControlSequence.sequence_number,
+                                   Control.id, SIStation.id),
+                                  Or(Control.override == None,
+                                     Control.override == False))
+        sequences = {}
+        for sequence_id, course_id, number, control_id, station_id in rows:
+            self._stations[station_id] = control_id
+            self._courses.setdefault(control_id, set()).add(course_id)
+            # controls with several sistations are returned once per sistation
+            if sequence_id not in sequences:
+                sequences[sequence_id] = (course_id, number, control_id)
+                self._signatures[course_id][control_id] += 1
+        for number, sequence_id, course_id, control_id in sorted(
+                (n, s, c, k) for s, (c, n, k) in sequences.items() if n is not None):
+            self._sequences[course_id].append(control_id)
+
+    @staticmethod
+    def _common(sequence, punched):
+        """
+        @return: length of the longest common subsequence of sequence and
+                 punched
+        """
+        lengths = [0] * (len(punched) + 1)
+        for control in sequence:
+            previous = 0
+            for i, punch in enumerate(punched):
+                current = lengths[i + 1]
+                if control == punch:
+                    lengths[i + 1] = previous + 1
+                elif lengths[i] > current:
+                    lengths[i + 1] = lengths[i]
+                previous = current
+        return lengths[-1]
+
+    def rank(self, stations):
+        """Rank the courses by how well they match the punched stations.
+        @param stations: list of the SI station ids punched by a run
+        @return:         list of (missing, additional, unordered, course id)
+                         tuples of all courses, best match first. missing is
+                         the number of controls of the course not punched,
+                         additional the number of punched controls which are
+                         part of other courses but not of this course and
+                         unordered the number of controls of the course not
+                         punched in the sequence of the course (e.g. on
+                         courses with the same controls in a different order).
+        """
+        controls = [self._stations[s] for s in stations if s in self._stations]
+        punched = Counter(controls)
+        matched = Counter()
+        for control in punched:
+            for course in self._courses[control]:
+                matched[course] += min(punched[control],
+                                       self._signatures[course][control])
+
+        total = sum(punched.values())
+        return sorted((sum(signature.values()) - matched[course],
+                       total - matched[course],
+                       len(self._sequences[course])
+                       - (matched[course] and self._common(self._sequences[course], controls)),
+                       course)
+                      for course, signature in self._signatures.items())
+
+    def candidates(self, stations, limit=None):
+        """
+        @param stations: list of the SI station ids punched by a run
+        @param limit:    maximum number of courses to return, None for all
+        @return:         list of courses, best match first
+        """
+        ranked = [course for missing, additional, unordered, course
+                  in self.rank(stations)[:limit]]
+        # load all courses with one query
+        courses = dict((c.id, c) for c in
+                       self._store.find(Course, Course.id.is_in(ranked)))
+        return [courses[course] for course in ranked]
+
 class CombinedCourse(BaseCourse):
     """
     This class combines several courses to generate a joint ranking of all runns of
@@ -19,7 +19,10 @@ editor.py - High level editing classes.
 import sys
 
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
+from queue import Queue, Empty
+from threading import Thread, Event, Lock
 from time import sleep
 from subprocess import Popen, PIPE
 from traceback import print_exc
@@ -32,9 +35,12 @@ from sireader import SIReaderReadout, SIReaderException, SIReader
 
 from .runner import Team, Runner, SICard, Category, Club
 from .run import Run, Punch, RunException
-from .course import Control, SIStation, Course
+from .course import Control, SIStation, Course, CourseIndex
 from .formatter import AbstractFormatter, ReportlabRunFormatter
 from .ranking import ValidationError, UnscoreableException, Validator, OpenRuns
+from .journal import TRANSIENT_ERRORS
+from .metrics import timer
+from .util import load_config
 
 class Observable:
 
@@ -255,6 +261,18 @@ class Singleton(type):
         return cls._instances[cls]
 
 
+def _clear_cache(event, run):
+    """Clear the cached results of run and its team in event."""
+    try:
+        event.clear_cache(run)
+    except KeyError:
+        pass
+    try:
+        if run.sicard.runner.team is not None:
+            event.clear_cache(run.sicard.runner.team)
+    except (AttributeError, KeyError):
+        pass
+
 class RunEditorException(Exception):
     pass
 
@@ -293,8 +311,11 @@ class RunEditor(Observable, metaclass=Singleton):
         self._is_changed = False
 
         self._sireader = None
+        self._readout = None
+        self._journal = None
 
         self._print_command = "lp -o media=A5"
+        self._printer = None
 
         self.__initialized = True
 
@@ -440,7 +461,8 @@ class RunEditor(Observable, metaclass=Singleton):
 
     def _raw_punchlist(self):
         try:
-            punchlist = self._event.validate(self._run)['punchlist']
+            # copy the punchlist, the validation result is cached
+            punchlist = list(self._event.validate(self._run)['punchlist'])
         except ValidationError:
             if self._run is None:
                 return []
@@ -494,15 +516,7 @@ class RunEditor(Observable, metaclass=Singleton):
     print_command = property(lambda x:x._print_command)
 
     def _clear_cache(self):
-        try:
-            self._event.clear_cache(self._run)
-        except KeyError:
-            pass
-        try:
-            if self._run.sicard.runner.team is not None:
-                self._event.clear_cache(self._run.sicard.runner.team)
-        except (AttributeError, KeyError):
-            pass
+        _clear_cache(self._event, self._run)
 
     def get_runnerlist(self):
         runners = [(None, '')]
@@ -906,17 +920,36 @@ class RunEditor(Observable, metaclass=Singleton):
     sicard_runner = property(_get_sicard_runner)
 
     def print_run(self):
+        """Print the current run. The print command runs in a background
+        thread, print_run returns as soon as the run is formatted."""
         f = ReportlabRunFormatter(self._run, self._event._header, self._event)
-        Popen(self._print_command, shell=True, stdin=PIPE).communicate(input=str(f))
+        if self._printer is None:
+            self._printer = ThreadPoolExecutor(1)
+        self._printer.submit(RunEditor._print, self._print_command, str(f))
 
-    def connect_reader(self, port = None):
+    @staticmethod
+    def _print(command, data):
+        try:
+            Popen(command, shell=True, stdin=PIPE).communicate(input=data)
+        except Exception:
+            print_exc(file=sys.stderr)
+
+    def connect_reader(self, port = None, reader = None):
         """
         Connect an SI-Reader
-        @param port: serial port name, default autodetected
+        @param port:   serial port name, default autodetected
+        @param reader: connected object with the interface of SIReaderReadout
+                       to use instead of opening port (e.g.
+                       bosco.test.fakestation.FakeReadout)
         """
+        # the readout worker uses the old reader
+        self.stop_readout()
+
         fail_reasons = []
         try:
-            self._sireader = SIReaderReadout(port)
+            if reader is None:
+                reader = SIReaderReadout(port)
+            self._sireader = reader
         except SIReaderException as e:
             fail_reasons.append(str(e))
         else:
@@ -940,8 +973,11 @@ class RunEditor(Observable, metaclass=Singleton):
             raise RunEditorException("\n".join(fail_reasons))
 
     def poll_reader(self):
-        """Polls the sireader for changes."""
-        if self._sireader is not None:
+        """Polls the sireader for changes. Processes the results of the
+        background readout instead if it is running."""
+        if self._readout is not None:
+            self._poll_readout()
+        elif self._sireader is not None:
             try:
                 if self._sireader.poll_sicard():
                     self._notify_observers('reader')
@@ -956,7 +992,13 @@ class RunEditor(Observable, metaclass=Singleton):
                     raise
 
     def load_run_from_card(self):
-        """Read out card data and create or load a run based on this data."""
+        """Read out card data and create or load a run based on this data.
+
+        If a journal is set, the card data is written to the journal and the
+        card is acknowledged before the run is stored. If the database is
+        not available, the card data stays in the journal and is stored with
+        the next card read.
+        """
 
         if self.sicard is None:
             return
@@ -971,74 +1013,38 @@ class RunEditor(Observable, metaclass=Singleton):
             self.progress = None
             self.progress = 'Reading card data...'
 
-            card_data = self._sireader.read_sicard()
-
-            # find complete runs with this sicard
-            self.progress = 'Searching for matching run...'
-            runs = self._store.find(Run,
-                                    Run.sicard == card_data['card_number'],
-                                    Run.complete == True)
-
-            for r in runs:
-                if self._compare_run(r, card_data):
-                    self._run = r
-                    self._sireader.ack_sicard()
-                    return
-
-            # search for incomplete run with this sicard
-            self.progress = 'Searching for open run...'
-            try:
-                self._run = self._store.find(Run,
-                                             Run.sicard == card_data['card_number'],
-                                             Run.complete == False).one()
-            except NotOneError:
-                self._run = None
-
-            if self._run is None:
-                # Create new run
-                self.progress = 'Creating new run and adding punches...'
-                self._run = Run(card_data['card_number'],
-                                punches = card_data['punches'],
-                                card_start_time = card_data['start'],
-                                check_time = card_data['check'],
-                                clear_time = card_data['clear'],
-                                card_finish_time = card_data['finish'],
-                                readout_time = datetime.now(),
-                                store = self._store)
+            with timer('readout_read'):
+                card_data = self._sireader.read_sicard()
+            if self._journal is None:
+                cards = [card_data]
             else:
-                self.progress = 'Adding punches to existing run...'
-                self._run.card_start_time = card_data['start']
-                self._run.card_finish_time = card_data['finish']
-                self._run.card_check_time = card_data['check']
-                self._run.card_clear_time = card_data['clear']
-                if not self._run.readout_time:
-                    self._run.readout_time = datetime.now()
-                self._run.add_punchlist(card_data['punches'])
-
-            # mark run as complete
-            self._run.complete = True
-
-            if self._run.course is None:
-                self.progress = 'Searching matching course ...'
-                # Search Course for this run
-                courses = self._store.find(Course)
-                self._clear_cache()
-                for c in courses:
-                    self._run.course = c
-                    valid = self._event.validate(self._run)
-                    if  valid['status'] == Validator.OK:
-                        break
-                    else:
-                        self._run.course = None
-                        self._clear_cache()
-            else:
-                self.progress = 'Course already set.'
-
-            self.progress = 'Updating validation...'
-            self.progress = 'Commiting run to database...'
-            self.commit()
-            self._sireader.ack_sicard()
-
+                self._journal.append('card', card_data, sync=True)
+                self._sireader.ack_sicard()
+                # cards not stored before and this card
+                records = self._journal.replay()
+                cards = [d for kind, d, offset in records if kind == 'card']
+
+            with timer('readout_store'):
+                loader = RunLoader(self._store, self._event)
+                for data in cards:
+                    self._run = loader.load(data, self._set_progress)
+
+                self.progress = 'Commiting run to database...'
+                if self._journal is None:
+                    self.commit()
+                    self._sireader.ack_sicard()
+                else:
+                    self._store.commit()
+                    self._journal.checkpoint(records[-1][2])
+                    self.commit()
+
+        except TRANSIENT_ERRORS as e:
+            if self._journal is None:
+                raise
+            self._run = None
+            self._notify_observers('error',
+                                   'Database not available, the SI-Card %s is '
+                                   'stored later: %s' % (card_data['card_number'], e))
         finally:
             # roll back and re-raise the exception
             self.rollback()
@@ -1046,8 +1052,77 @@ class RunEditor(Observable, metaclass=Singleton):
 
         self.progress = None
 
+    def start_readout(self, config='conf'):
+        """Read out SI-Cards in background threads with a ReadoutWorker.
+        The results are processed by poll_reader. Observers are notified
+        with the event 'readout' and the id of the run as message for
+        every card read. Cards are not read by load_run_from_card while the
+        worker is running.
+        @param config: name of the configuration module, the worker loads
+                       its own instance to get its own store and event
+        """
+        if self._sireader is None:
+            raise RunEditorException('SI-Reader is not connected.')
+        self.stop_readout()
+        self._readout = ReadoutWorker(self._sireader, config,
+                                      journal=self._journal)
+        self._readout.start()
+
+    def stop_readout(self):
+        """Stop the background readout started with start_readout."""
+        if self._readout is not None:
+            self._readout.stop()
+            self._readout = None
+
+    readout_running = property(lambda obj: obj._readout is not None)
+
+    def _poll_readout(self):
+        """Process the results of the background readout worker."""
+        readout = self._readout
+        results = readout.results()
+        if ('stopped', None) in results:
+            # the SI-Reader is not available, cards are read out manually
+            # after reconnecting it
+            self.stop_readout()
+            results.extend(readout.results())
+            results.append(('reader', None))
+        for result in results:
+            if result[0] == 'reader':
+                self._notify_observers('reader')
+            elif result[0] == 'run':
+                self._notify_observers('readout', result[1])
+            elif result[0] == 'failed':
+                # the card stays in the journal until the error was shown
+                self._notify_observers('error', result[1])
+                readout.acknowledge()
+            elif result[0] == 'error':
+                self._notify_observers('error', result[1])
 
-    def _compare_run(self, run, card_data):
+    def set_print_command(self, command):
+        self._print_command = command
+
+    def set_journal(self, journal):
+        """Write the data of all cards read to a journal before storing it.
+        @param journal: bosco.journal.Journal object or None
+        """
+        self._journal = journal
+
+class RunLoader:
+    """Creates or loads the run for the data read from an SI-Card. This is
+    the database part of reading out a card, the reader is not accessed.
+    """
+
+    def __init__(self, store, event):
+        """
+        @param store: Storm store of the runs
+        @param event: object of class (or subclass of) Event used to find the
+                      course of new runs, must use store
+        """
+        self._store = store
+        self._event = event
+
+    @staticmethod
+    def _compare_run(run, card_data):
         """
         Compares run to card_data
         @return: True if card_data matches run, False otherwise
@@ -1074,8 +1149,271 @@ class RunEditor(Observable, metaclass=Singleton):
 
         return True
 
-    def set_print_command(self, command):
-        self._print_command = command
+    def load(self, card_data, progress=None):
+        """Find the run of a card which was already read, complete the open
+        run of the card or create a new run. The course of new runs is
+        searched by validating the run.
+        @param card_data: card data as returned by SIReaderReadout.read_sicard
+        @param progress:  function called with a message before every step
+        @return:          the run, changes are not committed
+        """
+        if progress is None:
+            progress = lambda msg: None
+
+        fingerprint = Run.card_fingerprint(card_data)
+
+        # find complete runs with this sicard
+        progress('Searching for matching run...')
+        run = self._store.find(Run,
+                               Run.fingerprint == fingerprint,
+                               Run.sicard == card_data['card_number'],
+                               Run.complete == True).any()
+        if run is not None:
+            return run
+
+        # runs created before fingerprints were stored or by other
+        # programs have no fingerprint, compare their punches
+        runs = self._store.find(Run,
+                                Run.sicard == card_data['card_number'],
+                                Run.complete == True,
+                                Run.fingerprint == None)
+        for r in runs:
+            if self._compare_run(r, card_data):
+                r.fingerprint = fingerprint
+                return r
+
+        # search for incomplete run with this sicard
+        progress('Searching for open run...')
+        try:
+            run = self._store.find(Run,
+                                   Run.sicard == card_data['card_number'],
+                                   Run.complete == False).one()
+        except NotOneError:
+            run = None
+
+        if run is None:
+            # Create new run
+            progress('Creating new run and adding punches...')
+            run = Run(card_data['card_number'],
+                      punches = card_data['punches'],
+                      card_start_time = card_data['start'],
+                      check_time = card_data['check'],
+                      clear_time = card_data['clear'],
+                      card_finish_time = card_data['finish'],
+                      readout_time = datetime.now(),
+                      store = self._store)
+        else:
+            progress('Adding punches to existing run...')
+            run.card_start_time = card_data['start']
+            run.card_finish_time = card_data['finish']
+            run.check_time = card_data['check']
+            run.clear_time = card_data['clear']
+            if not run.readout_time:
+                run.readout_time = datetime.now()
+            run.add_punchlist(card_data['punches'])
+
+        # mark run as complete
+        run.complete = True
+        run.fingerprint = fingerprint
+
+        if run.course is None:
+            progress('Searching matching course ...')
+            # Search Course for this run, validate the courses in the order
+            # they match the punches, usually the first course is valid
+            stations = [p._sistation_id for p, c in run.punchlist()]
+            courses = CourseIndex(self._store).candidates(stations)
+            _clear_cache(self._event, run)
+            for c in courses:
+                run.course = c
+                valid = self._event.validate(run)
+                if  valid['status'] == Validator.OK:
+                    break
+                else:
+                    run.course = None
+                    _clear_cache(self._event, run)
+        else:
+            progress('Course already set.')
+
+        progress('Updating validation...')
+        return run
+
+class ReadoutWorker:
+    """Reads out SI-Cards in background threads.
+
+    A reader thread polls the station, reads every inserted card and puts
+    the card data into a queue. Cards are acknowledged as soon as their data
+    is read, the next runner does not have to wait until the previous run is
+    stored. A database thread loads its own instance of the configuration
+    module (with its own store and event) and stores the runs with
+    RunLoader. Storm stores must only be used by one thread.
+
+    The results are fetched with results(), e.g. periodically by the GUI
+    thread.
+
+    With a journal the card data is written to the journal before the card
+    is acknowledged. If the database is not available, reading cards
+    continues and the runs are stored as soon as the database is available
+    again. Cards not stored when the worker is stopped are stored the next
+    time it is started. The journal checkpoint does not move past a card
+    which could not be stored because of another error until the error is
+    acknowledged (see acknowledge), the card is stored again the next time
+    the worker is started.
+    """
+
+    # time in seconds between attempts to store a run if the database is
+    # not available
+    retry_interval = 1
+
+    def __init__(self, reader, config='conf', interval=0.1, journal=None):
+        """
+        @param reader:   connected SIReaderReadout object, it must not be used
+                         by other threads while the worker is running
+        @param config:   name of the configuration module
+        @param interval: time in seconds between polls of the reader
+        @param journal:  bosco.journal.Journal object or None
+        """
+        self._reader = reader
+        self._config = config
+        self._interval = interval
+        self._journal = journal
+        self._cards = Queue()
+        self._results = Queue()
+        self._stopped = Event()
+        self._threads = []
+        # number of cards not stored and not acknowledged and journal offset
+        # after the last card processed
+        self._lock = Lock()
+        self._failed = 0
+        self._offset = None
+
+    def start(self):
+        self._stopped.clear()
+        if self._journal is not None:
+            for kind, card_data, offset in self._journal.replay():
+                if kind == 'card':
+                    self._cards.put((card_data, offset))
+        self._threads = [Thread(target=self._read, daemon=True),
+                         Thread(target=self._process, daemon=True)]
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        """Stop reading cards and wait until all read cards are stored. If
+        the database is not available, the cards not yet stored are left in
+        the journal."""
+        if not self._threads:
+            return
+        self._stopped.set()
+        reader, processor = self._threads
+        reader.join()
+        self._cards.put(None)
+        processor.join()
+        self._threads = []
+
+    def results(self):
+        """
+        @return: list of the results since the last call, tuples
+                 ('reader', card number) when a card was inserted or
+                 removed, ('run', run id) for every stored run,
+                 ('failed', message) for cards which could not be stored
+                 (see acknowledge), ('error', message) for other errors
+                 and ('stopped', None) if reading cards stopped because
+                 the SI-Reader is not available
+        """
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except Empty:
+                return results
+
+    def acknowledge(self):
+        """Acknowledge a card which could not be stored (result 'failed').
+        The card is removed from the journal once all failed cards are
+        acknowledged."""
+        with self._lock:
+            self._failed -= 1
+            if self._failed == 0 and self._offset is not None:
+                self._journal.checkpoint(self._offset)
+
+    def _read(self):
+        while not self._stopped.is_set():
+            try:
+                if not self._reader.poll_sicard():
+                    self._stopped.wait(self._interval)
+                    continue
+                self._results.put(('reader', self._reader.sicard))
+                if self._reader.sicard is not None:
+                    with timer('readout_read'):
+                        card_data = self._reader.read_sicard()
+                    offset = None
+                    if self._journal is not None:
+                        offset = self._journal.append('card', card_data, sync=True)
+                    self._cards.put((card_data, offset))
+                    self._reader.ack_sicard()
+            except (SIReaderException, IOError) as e:
+                self._results.put(('error', 'Error reading SI-Card: %s' % e))
+                try:
+                    self._reader.reconnect()
+                except SIReaderException as e:
+                    self._results.put(('error', 'Reconnecting the SI-Reader failed, '
+                                       'stopped reading SI-Cards: %s' % e))
+                    self._results.put(('stopped', None))
+                    return
+
+    def _process(self):
+        conf = load_config(self._config, new=True)
+        loader = RunLoader(conf.store, conf.event)
+        while True:
+            item = self._cards.get()
+            if item is None:
+                break
+            card_data, offset = item
+            try:
+                if not self._store_card(conf.store, loader, card_data):
+                    # stopped while the database is not available
+                    break
+            except Exception as e:
+                print_exc(file=sys.stderr)
+                conf.store.rollback()
+                with self._lock:
+                    self._failed += 1
+                self._results.put(('failed', 'Could not store SI-Card %s: %s'
+                                   % (card_data['card_number'], e)))
+            if offset is not None:
+                with self._lock:
+                    self._offset = offset
+                    if self._failed == 0:
+                        self._journal.checkpoint(offset)
+        conf.store.close()
+
+    def _store_card(self, store, loader, card_data):
+        """Store the run of a card. With a journal, storing is retried until
+        the database is available again.
+        @return: False if the worker was stopped before the run was stored
+        @raises: other errors than TRANSIENT_ERRORS
+        """
+        reported = False
+        while True:
+            try:
+                with timer('readout_store'):
+                    run = loader.load(card_data)
+                    store.commit()
+                self._results.put(('run', run.id))
+                return True
+            except TRANSIENT_ERRORS as e:
+                store.rollback()
+                if self._journal is None:
+                    self._results.put(('error', 'Could not store SI-Card %s: %s'
+                                       % (card_data['card_number'], e)))
+                    return True
+                if not reported:
+                    self._results.put(('error', 'Database not available, the '
+                                       'SI-Card %s is stored later: %s'
+                                       % (card_data['card_number'], e)))
+                    reported = True
+                if self._stopped.wait(self.retry_interval):
+                    return False
 
 class RunListFormatter:
 
@@ -218,22 +218,28 @@ class Event:
         return Ranking(obj, self, scoreing_class, validation_class,
                        scoreing_args, validation_args, reverse)
 
-    def format_ranking(self, rankings, type = 'html'):
+    def format_ranking(self, rankings, type = 'html', limit = None, now = None):
         """
         @param ranking: Rankings to format
         @type ranking:  list of objects of class Ranking
         @param type:    'html' (default) or 'print'
+        @param limit:   only format the first limit entries of each ranking
+        @param now:     update time shown in the ranking, defaults to the
+                        current time
         @return:        RankingFormatter object for the ranking
         """
 
         return MakoRankingFormatter(rankings, self._header,
-                                    self._template[type], self._template_dir)
+                                    self._template[type], self._template_dir,
+                                    limit, now)
 
-    def format_run(self, run, output_type = 'html'):
+    def format_run(self, run, output_type = 'html', splits = None):
         """
         @param run:     Run to format
         @type run:      objects of class Run
         @param type:    'html' (default) or 'print'
+        @param splits:  split time analysis for this run
+        @type splits:   dict as returned by SplitTimes.info or None
         @return:        RunFormatter object for the run
         """
 
@@ -243,6 +249,7 @@ class Event:
             self,
             self._run_template[output_type],
             self._template_dir,
+            splits,
         )
 
     def list_rankings(self):
@@ -568,9 +575,14 @@ class Relay24hEvent(Event):
             return (None, args)
 
         if 'starttime_strategy' not in args:
-            args['starttime_strategy'] = RelayStarttime(self._starttime[cat],
-                                                        ordered = False,
-                                                        cache = self._cache)
+            # reuse the start time strategy of the category, a new strategy
+            # object would create a new scoreing strategy with an empty cache
+            key = self._key(RelayStarttime, {'category': cat})
+            if key not in self._strategies:
+                self._strategies[key] = RelayStarttime(self._starttime[cat],
+                                                       ordered = False,
+                                                       cache = self._cache)
+            args['starttime_strategy'] = self._strategies[key]
         return (TimeScoreing, args)
 
     def validate(self, obj, validator_class = None, args = None):
@@ -0,0 +1,341 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+export.py - Rendering of rankings for export, optionally in parallel worker
+            processes. Every worker process loads its own configuration and
+            therefore uses its own Storm store, cache and observer. Workers
+            only return the rendered files, all file I/O is left to the
+            caller.
+"""
+
+import multiprocessing
+import os
+import sys
+
+from functools import partial
+from io import BytesIO, StringIO, TextIOWrapper
+from queue import Empty
+from traceback import format_exc
+
+from .course import BaseCourse, Course, CombinedCourse
+from .formatter import get_template, set_template_module_directory
+from .formatter import CourseSOLVRankingFormatter, RelayCategorySOLVRankingFormatter
+from .jsonfeed import JSONFeed
+from .metrics import timer
+from .observer import TriggerEventObserver
+from .ranking import Validator
+from .runner import Category, CombinedCategory
+from .splits import SplitTimes
+from .util import load_config
+
+def ranking_filename(desc, extension='.html'):
+    """
+    @param desc: description of the ranking as returned by
+                 Event.list_rankings
+    @return:     file name of the exported ranking
+    """
+    return desc.lower().replace(' ', '_') + extension
+
+def render_feed(feed, desc, ranking):
+    """Render the JSON snapshot and delta of a ranking.
+    @param feed: bosco.jsonfeed.JSONFeed
+    @return:     tuple (files, appends), lists of (file name, encoded
+                 content) tuples to write and to append
+    """
+    snapshot, delta = feed.render(desc, ranking)
+    files = [(ranking_filename(desc, '.json'), snapshot)]
+    appends = delta is not None and [(ranking_filename(desc, '.ndjson'), delta)] or []
+    return files, appends
+
+@timer('render')
+def encode(formatter, encoding):
+    """Format directly into an encoded buffer.
+    @param formatter: ranking or run formatter
+    @return:          encoded output
+    """
+    buf = BytesIO()
+    f = TextIOWrapper(buf, encoding=encoding, newline='')
+    formatter.write_to(f)
+    f.flush()
+    return buf.getvalue()
+
+# placeholder for the update time in formatted rankings
+_UPDATE_TIME = '@@bosco-update-time@@'
+
+def render_ranking(event, desc, ranking, encoding):
+    """Compute and render a ranking and the run pages of course rankings.
+    The update time shown in the ranking is the time of the last change of
+    the ranking, unchanged rankings are rendered to identical files.
+    @param event:    event used to format the ranking
+    @param desc:     description of the ranking
+    @param ranking:  ranking to render
+    @param encoding: output encoding
+    @return:         tuple (files, completed):
+                     * files:     list of (file name, encoded content) tuples
+                     * completed: tuple (completed count, member count)
+    """
+    # the ranking is updated while it is formatted, the time of the last
+    # change is only known afterwards
+    content = encode(event.format_ranking([ranking], now=_UPDATE_TIME), encoding)
+    content = content.replace(_UPDATE_TIME.encode(encoding),
+                              ranking.changed.strftime('%c').encode(encoding))
+    files = [(ranking_filename(desc), content)]
+    if isinstance(ranking.rankable, BaseCourse):
+        splits = SplitTimes(ranking)
+        for run in splits:
+            files.append(('%s.html' % run['item'].id,
+                          encode(event.format_run(run['item'], splits=run), encoding)))
+
+    return files, (ranking.completed_count, ranking.member_count)
+
+def render_index(event, completed, encoding):
+    """Render the index page of an export.
+    @param completed: dict of ranking description to (completed count,
+                      member count) tuples of all rankings on the page
+    @return:          encoded content
+    """
+    template = get_template(event._template_dir, 'index.html')
+    return str(template.render_unicode(header=event._header,
+                                       completed=completed)).encode(encoding)
+
+def ranking_winner(ranking):
+    """
+    @param ranking: initialized ranking
+    @return:        first item with rank 1 or None if nobody has a valid
+                    result
+    """
+    for entry in ranking[:1]:
+        if entry['validation']['status'] == Validator.OK and entry['rank'] == 1:
+            return entry['item']
+    return None
+
+def new_leader(desc, ranking, versions):
+    """Find a new winner of a ranking since the last export.
+    @param versions: dict of ranking descriptions to the version of the
+                     last export, updated with the current version
+    @return:         new winner or None if the winner did not change
+    """
+    leader = None
+    if desc in versions:
+        try:
+            leader = ranking.changes_since(versions[desc])['leader']
+        except KeyError:
+            # too many updates since the last export
+            pass
+    versions[desc] = ranking.version
+    return leader
+
+def _worker_main(config, directory, json, template_cache, tasks, results):
+    """Main function of a worker process. Loads the configuration and
+    renders the rankings sent through the tasks queue. The cache of the
+    worker is connected to an observer which is polled at the start of each
+    refresh cycle, so only changed objects are scored and validated again.
+    @param json:    also render the JSON feed?
+    @param template_cache: directory for compiled templates or None
+    @param tasks:   queue of (list of descs, encoding) tuples, None stops the
+                    worker
+    @param results: queue for (desc, result, error) tuples, result is a
+                    (files, completed, leader, appends) tuple, leader is the
+                    string representation of a new winner (see new_leader),
+                    error is None or the formatted exception
+    """
+    os.chdir(directory)
+    set_template_module_directory(template_cache)
+    conf = load_config(config)
+    observer = TriggerEventObserver(conf.store, interval=None, rollback=True)
+    conf.cache.set_observer(observer)
+    rankings = dict(conf.event.list_rankings())
+    feed = json and JSONFeed() or None
+    versions = {}
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        descs, encoding = task
+        observer.observe()
+        for desc in descs:
+            try:
+                ranking = rankings[desc]
+                files, completed = render_ranking(conf.event, desc, ranking,
+                                                  encoding)
+                leader = new_leader(desc, ranking, versions)
+                leader = leader is not None and str(leader) or None
+                appends = []
+                if feed is not None:
+                    feed_files, appends = render_feed(feed, desc, ranking)
+                    files.extend(feed_files)
+                results.put((desc, (files, completed, leader, appends), None))
+            except Exception:
+                results.put((desc, None, format_exc()))
+
+class ParallelRenderer:
+    """Render rankings in worker processes.
+
+    Each worker loads the configuration module itself (see
+    bosco.util.load_config) and thus owns its own Storm store, cache and
+    ranking objects. Every ranking is always rendered by the same worker,
+    so the caches stay filled between refresh cycles. Changed objects are
+    removed from the caches with an observer like in a single process. The
+    workers are started with the 'spawn' method because Storm stores and
+    database connections must not be shared between processes.
+
+    Rankings which fail to render are reported on stderr and skipped. A
+    worker which died (e.g. killed because it ran out of memory) is
+    restarted, the rankings it did not render are skipped.
+    """
+
+    # time in seconds between checks whether the workers are alive
+    poll_interval = 1
+
+    def __init__(self, jobs, config='conf', directory=None, json=False,
+                 template_cache=None):
+        """
+        @param jobs:      number of worker processes
+        @param config:    name of the configuration module
+        @param directory: directory of the configuration module, defaults to
+                          the current directory
+        @param json:      also render the JSON feed, see render_feed
+        @param template_cache: directory for compiled templates shared by
+                          the workers, see
+                          bosco.formatter.set_template_module_directory
+        """
+        self._context = multiprocessing.get_context('spawn')
+        self._args = (config, directory or os.getcwd(), json, template_cache)
+        self._results = self._context.Queue()
+        self._workers = [self._start_worker() for i in range(jobs)]
+        # worker of each ranking
+        self._shards = {}
+
+    def _start_worker(self):
+        tasks = self._context.Queue()
+        process = self._context.Process(target=_worker_main,
+                                        args=self._args + (tasks, self._results),
+                                        daemon=True)
+        process.start()
+        return process, tasks
+
+    def render(self, descs, encoding):
+        """Render rankings. Results are yielded as soon as they are
+        available and not in the order of descs.
+        @param descs:    descriptions of the rankings to render
+        @param encoding: output encoding
+        @return:         iterator over (desc, files, completed, leader,
+                         appends) tuples of the rankings rendered, leader is
+                         the string representation of a new winner or None
+        @see:            render_ranking, new_leader, render_feed
+        """
+        shards = [[] for w in self._workers]
+        for desc in descs:
+            if desc not in self._shards:
+                self._shards[desc] = len(self._shards) % len(self._workers)
+            shards[self._shards[desc]].append(desc)
+        for (process, tasks), shard in zip(self._workers, shards):
+            if len(shard) > 0:
+                tasks.put((shard, encoding))
+
+        # rankings not yet rendered and their worker
+        pending = {desc: self._shards[desc] for desc in descs}
+        while len(pending) > 0:
+            try:
+                desc, result, error = self._results.get(timeout=self.poll_interval)
+            except Empty:
+                self._check_workers(pending)
+                continue
+            if pending.pop(desc, None) is None:
+                # late result of a worker considered dead
+                continue
+            if error is not None:
+                print('Rendering %s failed in worker process:\n%s' % (desc, error),
+                      file=sys.stderr)
+            else:
+                yield (desc, ) + result
+
+    def _check_workers(self, pending):
+        """Restart dead workers and skip the rankings they did not render."""
+        for i, (process, tasks) in enumerate(self._workers):
+            if process.is_alive():
+                continue
+            lost = [desc for desc, worker in pending.items() if worker == i]
+            print('Worker process %d died with exit code %s, skipped rankings: %s'
+                  % (process.pid, process.exitcode, ', '.join(lost)), file=sys.stderr)
+            for desc in lost:
+                del pending[desc]
+            self._workers[i] = self._start_worker()
+
+    def close(self):
+        """Stop all worker processes."""
+        for process, tasks in self._workers:
+            tasks.put(None)
+        for process, tasks in self._workers:
+            process.join()
+        self._workers = []
+
+# SOLV formatter for each rankable class
+SOLV_FORMATTERS = {Category:         RelayCategorySOLVRankingFormatter,
+                   CombinedCategory: RelayCategorySOLVRankingFormatter,
+                   Course:           CourseSOLVRankingFormatter,
+                   CombinedCourse:   CourseSOLVRankingFormatter,
+                   }
+
+def solv_formatter(conf, ranking):
+    """
+    @param conf: configuration module with the SOLV export settings
+                 (starttime, control_replacements, control_exclude)
+    @return:     SOLV formatter for ranking
+    """
+    return SOLV_FORMATTERS[type(ranking.rankable)]([ranking], conf.starttime,
+                                                  conf.control_replacements,
+                                                  conf.control_exclude)
+
+def format_solv(conf, desc, ranking):
+    """
+    @return: ranking in the SOLV format
+    @see:    map_rankings
+    """
+    f = StringIO()
+    solv_formatter(conf, ranking).write_to(f)
+    return f.getvalue()
+
+# Per process state of the map_rankings worker processes
+_map_worker = None
+
+def _init_map_worker(config, directory):
+    global _map_worker
+    os.chdir(directory)
+    conf = load_config(config)
+    _map_worker = (conf, dict(conf.event.list_rankings()))
+
+def _map_ranking(func, desc):
+    conf, rankings = _map_worker
+    return func(conf, desc, rankings[desc])
+
+def map_rankings(func, descs, jobs, config='conf', directory=None):
+    """Compute func(conf, desc, ranking) for each ranking in worker
+    processes. Every worker loads the configuration module and computes the
+    rankings with its own store.
+    @param func:      module level function (it is pickled by name)
+    @param descs:     descriptions of the rankings
+    @param jobs:      number of worker processes
+    @param config:    name of the configuration module
+    @param directory: directory of the configuration module, defaults to
+                      the current directory
+    @return:          iterator over the results in the order of descs
+    """
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(jobs, _init_map_worker,
+                      (config, directory or os.getcwd())) as pool:
+        yield from pool.imap(partial(_map_ranking, func), descs)
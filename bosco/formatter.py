@@ -21,6 +21,7 @@ import pkg_resources
 import json
 
 from mako.lookup import TemplateLookup
+from mako.runtime import Context
 
 from reportlab.lib import colors, pagesizes
 from reportlab.platypus import *
@@ -30,9 +31,13 @@ from datetime import datetime
 from io import StringIO
 from csv import writer
 
-from .ranking import Validator, ValidationError, UnscoreableException
+from storm.locals import Store, In
+
+from .ranking import Validator, ValidationError, UnscoreableException, PartialRanking
 from .course import SIStation, Control
-from .run import Punch, Run
+from .result import PunchList
+from .run import Punch, ShiftedPunch, Run
+from .runner import SICard, Runner, Team
 
 def format_timedelta(delta):
     (hours, seconds) = divmod(delta.seconds, 3600)
@@ -42,6 +47,78 @@ def format_timedelta(delta):
     else:
         return "%i:%02i" % (minutes, seconds)
 
+# Template lookups of the template directories shared by all formatters,
+# Mako keeps the compiled templates in the lookup.
+_template_lookups = {}
+_template_module_directory = None
+
+def set_template_module_directory(directory):
+    """Store the compiled templates as Python modules in directory. Other
+    processes (e.g. the worker processes of ranking_export) then load the
+    compiled modules instead of compiling the templates again. Call this
+    before the first template is loaded.
+    @param directory: directory for the compiled modules, None to only keep
+                      the compiled templates in memory
+    """
+    global _template_module_directory
+    _template_module_directory = directory
+    _template_lookups.clear()
+
+def get_template(template_dir, template_file):
+    """
+    @param template_dir:  template directory (inside the bosco module)
+    @param template_file: file name of the template
+    @return:              compiled Mako template, every template is only
+                          compiled once per process
+    """
+    lookup = _template_lookups.get(template_dir)
+    if lookup is None:
+        lookup = TemplateLookup(directories=[pkg_resources.resource_filename('bosco', template_dir)],
+                                module_directory=_template_module_directory)
+        _template_lookups[template_dir] = lookup
+    return lookup.get_template(template_file)
+
+def _find_all(store, cls, ids):
+    """
+    @return: list of the objects of class cls with the given ids, loaded with
+             one query
+    """
+    ids = list({i for i in ids if i is not None})
+    if len(ids) == 0:
+        return []
+    return list(store.find(cls, In(cls.id, ids)))
+
+def prefetch_runs(entries):
+    """Load the objects the formatters access for every run in entries
+    (SI card, runner, team, punches, SI stations and controls) with one
+    query per class. Storm resolves references to loaded objects without
+    further queries.
+    @param entries: ranking entries of runs
+    @return:        list of the loaded objects. Storm only keeps weak
+                    references to most objects, keep a reference to this
+                    list while formatting the entries.
+    """
+    runs = [e['item'] for e in entries if isinstance(e['item'], Run)]
+    if len(runs) == 0:
+        return []
+    store = Store.of(runs[0])
+
+    punchlists = []
+    for e in entries:
+        validation = e.get('validation') or {}
+        punchlists.append(validation.get('reordered_punchlist')
+                          or validation.get('punchlist') or [])
+    PunchList.resolve(punchlists)
+    punches = [p for punchlist in punchlists for status, p in punchlist
+               if isinstance(p, (Punch, ShiftedPunch))]
+
+    sistations = _find_all(store, SIStation, [p._sistation_id for p in punches])
+    controls = _find_all(store, Control, [s._control_id for s in sistations])
+    sicards = _find_all(store, SICard, [r._sicard_id for r in runs])
+    runners = _find_all(store, Runner, [c._runner_id for c in sicards])
+    teams = _find_all(store, Team, [r._team_id for r in runners])
+    return [punchlists, sistations, controls, sicards, runners, teams]
+
 class AbstractFormatterMeta(type):
 
     # This can't be a static variable as the gettext infrastructure might not
@@ -62,7 +139,8 @@ class AbstractFormatter(metaclass=AbstractFormatterMeta):
 
 
 class AbstractRankingFormatter(AbstractFormatter):
-    """Formats a ranking. str(rankingRormatter) returns the formatted ranking."""
+    """Formats a ranking. str(rankingRormatter) returns the formatted ranking,
+    write_to writes it to a file object."""
 
     def __init__(self, rankings):
         """
@@ -78,10 +156,17 @@ class AbstractRankingFormatter(AbstractFormatter):
         """
         pass
 
+    def write_to(self, f):
+        """Write the formatted ranking to f. Subclasses write the output
+        while formatting instead of building the whole output in memory.
+        @param f: file object opened in text mode
+        """
+        f.write(str(self))
+
 class MakoRankingFormatter(AbstractRankingFormatter):
     """Uses the Mako Templating Engine to format a ranking as HTML."""
 
-    def __init__(self, rankings, header, template_file, template_dir):
+    def __init__(self, rankings, header, template_file, template_dir, limit=None, now=None):
         """
         @type rankings:        list of dicts with keys 'ranking' and 'info'
                               the value of the 'ranking' key is an object of
@@ -90,18 +175,34 @@ class MakoRankingFormatter(AbstractRankingFormatter):
         @param template_dir:  template directory (inside the bosco module)
         @param header:        gerneral information for the ranking header
         @type header:         dict
+        @param limit:         only show the first limit entries of each
+                              ranking, None shows complete rankings
+        @param now:           time of the update shown in the ranking,
+                              defaults to the current time
+        @type now:            str
         """
         super(type(self), self).__init__(rankings)
-        lookup = TemplateLookup(directories=[pkg_resources.resource_filename('bosco', template_dir)])
-        self._template = lookup.get_template(template_file)
+        self._template = get_template(template_dir, template_file)
         self._header = header
+        self._limit = limit
+        self._now = now
+
+    def _template_args(self):
+        if self._limit is None:
+            rankings = self.rankings
+        else:
+            rankings = [PartialRanking(r, self._limit) for r in self.rankings]
+
+        return {'header':           self._header,
+                'validation_codes': type(self).validation_codes,
+                'now':              self._now if self._now is not None else datetime.now().strftime('%c'),
+                'rankings':         rankings}
 
     def __str__(self):
+        return self._template.render_unicode(**self._template_args())
 
-        return self._template.render_unicode(header = self._header,
-                                             validation_codes = type(self).validation_codes,
-                                             now = datetime.now().strftime('%c'),
-                                             rankings = self.rankings)
+    def write_to(self, f):
+        self._template.render_context(Context(f, **self._template_args()))
 
 class AbstractSOLVRankingFormatterMeta(AbstractFormatterMeta):
 
@@ -144,15 +245,15 @@ class AbstractSOLVRankingFormatter(AbstractRankingFormatter,
         except KeyError:
             return control.code
 
-    def _writer(self):
-        self._outstr = StringIO()
-        return writer(self._outstr, delimiter=';',
-                      lineterminator=self._lineterminator)
-
-    def _output(self):
-        return self._outstr.getvalue()
+    def _writer(self, f):
+        return writer(f, delimiter=';', lineterminator=self._lineterminator)
 
     def __str__(self):
+        output = StringIO()
+        self.write_to(output)
+        return output.getvalue()
+
+    def write_to(self, f):
         raise SOLVRankingFormatterException('Use a subclass and overrwrite this method.')
 
 
@@ -161,16 +262,19 @@ class CourseSOLVRankingFormatter(AbstractSOLVRankingFormatter):
     Formatting a course ranking to be uploaded to the SOLV website
     Format: Rank;Name;Firstname;YearOfBirth;SexMF;FedNr;Zip;Town;Club;NationIOF;Start Nr;eCardNr;RunTime;StartTime;FinishTime;CtrlCode;SplitTime
     """
-    def __str__(self):
+    def write_to(self, f):
 
-        output = self._writer()
+        output = self._writer(f)
         for ranking in self.rankings:
             output.writerow([str(ranking.rankable),
                              ranking.rankable.length,
                              ranking.rankable.climb,
                              ranking.rankable.controlcount()
                              ])
-            for r in ranking:
+            entries = list(ranking)
+            # keep the prefetched objects alive while formatting the entries
+            prefetched = prefetch_runs(entries)
+            for r in entries:
                 line = [r['rank'] or '',
                         r['item'].sicard.runner.surname,
                         r['item'].sicard.runner.given_name,
@@ -217,13 +321,11 @@ class CourseSOLVRankingFormatter(AbstractSOLVRankingFormatter):
 
                 output.writerow(line)
 
-        return self._output()
-
 class CategorySOLVRankingFormatter(AbstractSOLVRankingFormatter):
     
-    def __str__(self):
+    def write_to(self, f):
 
-        output = self._writer()
+        output = self._writer(f)
 
         for ranking in self.rankings:
             output.writerow([str(ranking.rankable)])
@@ -236,21 +338,23 @@ class CategorySOLVRankingFormatter(AbstractSOLVRankingFormatter):
                     
                 output.writerow(line)
 
-        return self._output()
-
 class RelayCategorySOLVRankingFormatter(AbstractSOLVRankingFormatter):
     """
     As there is no real documenation for the SOLV ranking format this is modeled
     after the file for "Osterstaffel 2012" made with ORWare.
     """
 
-    def __str__(self):
+    def write_to(self, f):
 
-        output = self._writer()
+        output = self._writer(f)
         for ranking in self.rankings:
             output.writerow([str(ranking.rankable)])
 
-            for r in ranking:
+            entries = list(ranking)
+            # keep the prefetched objects alive while formatting the entries
+            prefetched = prefetch_runs([l for r in entries for l in r['runs']
+                                        if l is not None])
+            for r in entries:
                 line = [r['rank'] or '',
                         r['item'].number,
                         r['item'],
@@ -284,13 +388,11 @@ class RelayCategorySOLVRankingFormatter(AbstractSOLVRankingFormatter):
                                  ])
                 output.writerow(line)
 
-        return self._output()
-
 class RoundCountRankingFormatter(AbstractSOLVRankingFormatter):
     
-    def __str__(self):
+    def write_to(self, f):
 
-        output = self._writer()
+        output = self._writer(f)
 
         for ranking in self.rankings:
             lines = []
@@ -317,21 +419,22 @@ class RoundCountRankingFormatter(AbstractSOLVRankingFormatter):
             output.writerow([str(ranking.rankable)])
             output.writerows(lines)
 
-        return self._output()
-
 
 class OlanaRankingFormatter(AbstractSOLVRankingFormatter):
 
-    def __str__(self):
+    def write_to(self, f):
         results = {
             'name': '',
             'map': '',
             'date': '',
             'startTime': str(self._reftime),
-            'categories': [],
         }
 
-        for ranking in self.rankings:
+        # same output as json.dumps with a 'categories' key, but each
+        # category is written as soon as it is formatted
+        f.write(json.dumps(results)[:-1])
+        f.write(', "categories": [')
+        for i, ranking in enumerate(self.rankings):
             cat = {
                 'name':     str(ranking.rankable),
                 'distance': ranking.rankable.length,
@@ -340,7 +443,10 @@ class OlanaRankingFormatter(AbstractSOLVRankingFormatter):
                 'runners':   [],
             }
 
-            for r in ranking:
+            entries = list(ranking)
+            # keep the prefetched objects alive while formatting the entries
+            prefetched = prefetch_runs(entries)
+            for r in entries:
                 run_dict = {
                     'fullName':    '%s %s' % (r['item'].sicard.runner.given_name, r['item'].sicard.runner.surname),
                     'yearOfBirth': r['item'].sicard.runner.dateofbirth and r['item'].sicard.runner.dateofbirth.strftime('%y') or '',
@@ -382,9 +488,10 @@ class OlanaRankingFormatter(AbstractSOLVRankingFormatter):
 
                 cat['runners'].append(run_dict)
 
-            results['categories'].append(cat)
-
-        return json.dumps(results)
+            if i > 0:
+                f.write(', ')
+            f.write(json.dumps(cat))
+        f.write(']}')
 
 
 class AbstractRunFormatter(AbstractFormatter):
@@ -407,6 +514,12 @@ class AbstractRunFormatter(AbstractFormatter):
         """
         pass
 
+    def write_to(self, f):
+        """Write the formatted run to f.
+        @param f: file object opened in text mode
+        """
+        f.write(str(self))
+
     def _raw_punchlist(self):
         try:
             punchlist = self._event.validate(self._run)['punchlist']
@@ -584,7 +697,8 @@ class MakoRunFormatter(AbstractRunFormatter):
     Format runs using the Mako templating engine
     """
 
-    def __init__(self, run, header, event, template_file, template_dir):
+    def __init__(self, run, header, event, template_file, template_dir,
+                 splits=None):
         """
         @param run            Run to format
         @type run             Run
@@ -593,12 +707,14 @@ class MakoRunFormatter(AbstractRunFormatter):
         @param event          Event object
         @param template_file: File name for the template
         @param template_dir:  template directory (inside the bosco module)
+        @param splits:        split time analysis of this run or None
+        @type splits:         dict as returned by SplitTimes.info
         """
         super().__init__(run, header, event)
-        lookup = TemplateLookup(directories=[pkg_resources.resource_filename('bosco', template_dir)])
-        self._template = lookup.get_template(template_file)
+        self._template = get_template(template_dir, template_file)
+        self._splits = splits
 
-    def __str__(self):
+    def _template_args(self):
 
         try:
             validation = self._event.validate(self._run)
@@ -617,11 +733,18 @@ class MakoRunFormatter(AbstractRunFormatter):
         else:
             result = f'<b>Validation error: {validation_error.message}</b>'
 
-        return self._template.render_unicode(
-            header=self._header,
-            run=self._run,
-            runner=self._run.sicard.runner,
-            result=result,
-            score=score,
-            punchlist=self._punchlist(with_finish=True),
-        )
+        return {
+            'header': self._header,
+            'run': self._run,
+            'runner': self._run.sicard.runner,
+            'result': result,
+            'score': score,
+            'punchlist': self._punchlist(with_finish=True),
+            'splits': self._splits,
+        }
+
+    def __str__(self):
+        return self._template.render_unicode(**self._template_args())
+
+    def write_to(self, f):
+        self._template.render_context(Context(f, **self._template_args()))
@@ -21,6 +21,8 @@ from bosco.editor import RunFinder
 from bosco.editor import TeamEditor
 from bosco.editor import TeamFinder
 from bosco.gui import wxglade
+from bosco.journal import Journal
+from bosco.metrics import start_metrics
 from bosco.util import load_config
 
 conf = load_config()
@@ -645,6 +647,7 @@ class RunPanel(wxglade.RunPanel):
                 if (
                     self.GetGrandParent().notebook.GetCurrentPage() == self
                     and self.registration.GetValue()
+                    and not observable.readout_running
                     and observable.sicard is not None
                 ):
                     observable.new_from_reader()
@@ -710,6 +713,7 @@ class ReadoutRunPanel(wxglade.ReadoutRunPanel):
             elif type(observable) == RunEditor and event == 'reader':
                 if (
                     self.GetGrandParent().notebook.GetCurrentPage() == self
+                    and not observable.readout_running
                     and observable.sicard is not None
                 ):
 
@@ -731,6 +735,18 @@ class ReadoutRunPanel(wxglade.ReadoutRunPanel):
                             # complete
                             observable.print_run()
 
+            elif type(observable) == RunEditor and event == 'readout':
+                # run stored by the background readout, message is the run id
+                if self.GetGrandParent().notebook.GetCurrentPage() == self:
+                    observable.load(message)
+                    if (
+                        self.print_checkbox.GetValue()
+                        and self.GetParent().GetCurrentPage() == self
+                    ):
+                        # the current page might change if the run is not
+                        # complete
+                        observable.print_run()
+
             elif type(observable) == RunEditor and event == 'progress':
                 p = observable.progress
                 self.progress_bar.SetValue(p[0])
@@ -784,6 +800,11 @@ class RunEditorFrame(wxglade.RunEditorFrame):
 
         # Connect RunEditor instance
         self.editor = RunEditor(conf.store, conf.event)
+        if getattr(conf, 'readout_journal', None) is not None:
+            self.editor.set_journal(Journal(conf.readout_journal))
+        self._stop_metrics = start_metrics(getattr(conf, 'metrics_file', None),
+                                           getattr(conf, 'metrics_port', None),
+                                           getattr(conf, 'profile_dir', None))
         self.editor.add_observer(self)
         self.update(self.editor, 'reader')
 
@@ -800,8 +821,10 @@ class RunEditorFrame(wxglade.RunEditorFrame):
         self.SetIcon(sicard.GetIcon())
 
     def OnWindowClose(self, event):
+        self.editor.stop_readout()
         self._timer.Stop()
         del self._timer
+        self._stop_metrics()
         self.Destroy()
 
     def OnTimer(self, event):
@@ -825,6 +848,8 @@ class RunEditorFrame(wxglade.RunEditorFrame):
     def ConnectReader(self, event):
         try:
             self.editor.connect_reader()
+            if getattr(conf, 'background_readout', False):
+                self.editor.start_readout()
         except RunEditorException as e:
             self.ErrorDialog(str(e), 'Error Connecting SI-Reader')
 
@@ -553,6 +553,24 @@ class SIRunImporter(Importer):
         else:
             raise RunImportException('Empty punchtime for station "%s".' % station)
 
+    def card_data(self):
+        """Card data of the runs in the file, e.g. to replay the readout of
+        the cards.
+        @return: list of dicts like returned by SIReaderReadout.read_sicard
+        """
+        cards = []
+        for line in self.__runs:
+            punches = []
+            for i in range(SIRunImporter.BASE, len(line) - 1, 2):
+                punches.append((int(line[i]), self.__datetime(line[i+1])))
+            cards.append({'card_number': int(line[SIRunImporter.CARDNR]),
+                          'start': self.__datetime(line[SIRunImporter.START]),
+                          'finish': self.__datetime(line[SIRunImporter.FINISH]),
+                          'check': self.__datetime(line[SIRunImporter.CHECK]),
+                          'clear': self.__datetime(line[SIRunImporter.CLEAR]),
+                          'punches': punches})
+        return cards
+
     def import_data(self, store):
 
         for line in self.__runs:
@@ -0,0 +1,328 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+ingest.py - Receive punches from SI stations in autosend mode (e.g. radio
+            controls) and store them in grouped commits.
+"""
+
+import asyncio
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from traceback import print_exc
+
+from serial import Serial, SerialException
+from sireader import SIReader, SIReaderException
+from storm.locals import In
+
+from .course import SIStation
+from .journal import TRANSIENT_ERRORS
+from .metrics import timer
+from .run import Run, Punch
+
+def encode_frame(command, station, data):
+    """Encode a frame of the SI extended protocol.
+    @param command: command byte
+    @param station: station code
+    @param data:    data of the frame without the station code
+    @return:        frame with STX, length, CRC and ETX
+    """
+    payload = command + bytes([len(data) + 2]) + SIReader._to_str(station, 2) + data
+    return SIReader.STX + payload + SIReader._crc(payload) + SIReader.ETX
+
+def decode_frames(data):
+    """Split data received from a station into frames of the SI extended
+    protocol. Bytes outside of frames (e.g. wakeup bytes) and frames with
+    an invalid CRC are skipped.
+    @param data: received bytes
+    @return:     tuple (frames, rest). frames is a list of (command, station,
+                 data) tuples, rest is the start of an incomplete frame.
+    """
+    frames = []
+    start = 0
+    while True:
+        start = data.find(SIReader.STX, start)
+        if start < 0:
+            return frames, b''
+        if len(data) < start + 3:
+            return frames, data[start:]
+        length = data[start+2]
+        end = start + 3 + length + 3
+        if len(data) < end:
+            return frames, data[start:]
+
+        payload = data[start+1:start+3+length]
+        if (data[end-1:end] != SIReader.ETX or length < 2
+            or not SIReader._crc_check(payload, data[end-3:end-1])):
+            # not a frame, resynchronize on the next STX
+            start += 1
+            continue
+
+        frames.append((payload[0:1], SIReader._to_int(payload[2:4]), payload[4:]))
+        start = end
+
+def decode_punch(data):
+    """Decode the data of a transmit record frame.
+    @return: tuple (card number, punchtime, backup memory offset)
+    """
+    return (SIReader._decode_cardnr(data[SIReader.T_CN:SIReader.T_CN+4]),
+            SIReader._decode_time(data[SIReader.T_TIME:SIReader.T_TIME+2]),
+            SIReader._to_int(data[SIReader.T_OFFSET:SIReader.T_OFFSET+3]))
+
+class StationReader:
+    """Receives the punches of an SI station in autosend mode. The serial
+    port is read by the asyncio event loop, no thread per station is
+    needed."""
+
+    def __init__(self, port, callback, baudrate=38400):
+        """
+        @param port:     serial port of the station
+        @param callback: function called with (station code, card number,
+                         punchtime) for every punch received
+        @param baudrate: baudrate of the station, stations in autosend mode
+                         can't be detected by sending commands
+        """
+        self.port = port
+        self._callback = callback
+        self._baudrate = baudrate
+        self._serial = None
+        self._loop = None
+        self._buffer = b''
+        self._next_offset = None
+
+    def open(self, loop):
+        try:
+            self._serial = Serial(self.port, baudrate=self._baudrate, timeout=0)
+        except (SerialException, OSError):
+            raise SIReaderException("Could not open port '%s'" % self.port)
+        loop.add_reader(self._serial.fileno(), self._read)
+        self._loop = loop
+
+    def close(self):
+        if self._serial is not None:
+            self._loop.remove_reader(self._serial.fileno())
+            self._serial.close()
+            self._serial = None
+
+    def _read(self):
+        try:
+            data = self._serial.read(max(self._serial.in_waiting, 1))
+        except (SerialException, OSError) as e:
+            print('Error reading from %s, closing the port: %s' % (self.port, e),
+                  file=sys.stderr)
+            self.close()
+            return
+
+        frames, self._buffer = decode_frames(self._buffer + data)
+        for command, station, data in frames:
+            if command != SIReader.C_TRANS_REC:
+                continue
+            try:
+                cardnr, punchtime, offset = decode_punch(data)
+            except SIReaderException as e:
+                print('Invalid punch from station %s: %s' % (station, e), file=sys.stderr)
+                continue
+
+            if self._next_offset is not None and offset > self._next_offset:
+                print('%d punches of station %s were lost, read them from the '
+                      'backup memory of the station'
+                      % ((offset - self._next_offset) // SIReader.REC_LEN, station),
+                      file=sys.stderr)
+            self._next_offset = offset + SIReader.REC_LEN
+
+            self._callback(station, cardnr, punchtime)
+
+class PunchIngester:
+    """Receives punches from any number of SI stations and stores them.
+
+    Punches are collected and stored every interval seconds (or as soon as
+    batch punches are waiting) in one transaction. The open runs of all
+    cards in a batch are looked up with one query. Runs are completed by
+    the readout in other programs, so open runs are not cached between
+    batches. The store is only used by a single worker thread, the event
+    loop is never blocked by the database.
+
+    With a journal every punch is written to the journal when it is
+    received. Punches not yet stored when the database is not reachable
+    are kept and stored in batches as soon as the database is available
+    again. Punches not stored when the program ended are stored after the
+    next start.
+    """
+
+    def __init__(self, store, ports=(), baudrate=38400, interval=0.5, batch=200,
+                 verbose=False, journal=None):
+        """
+        @param store:    Storm store, must not be used by other threads
+        @param ports:    serial ports of the stations
+        @param interval: maximum time in seconds a punch waits to be stored
+        @param batch:    store the punches as soon as this many are waiting,
+                         this is also the maximum number of punches stored in
+                         one transaction
+        @param verbose:  print every punch received
+        @param journal:  bosco.journal.Journal object or None
+        """
+        self._store = store
+        self._readers = [StationReader(p, self.add, baudrate) for p in ports]
+        self._interval = interval
+        self._batch = batch
+        self._verbose = verbose
+        self._journal = journal
+        self._pending = []
+        self._executor = ThreadPoolExecutor(1)
+        self._wakeup = None
+        self._running = False
+        self.stored = 0
+
+    def add(self, station, cardnr, punchtime):
+        """Add a punch to be stored with the next batch."""
+        if self._verbose:
+            print('Punch of card %s received from %s at %s' % (cardnr, station, punchtime),
+                  flush=True)
+        offset = None
+        if self._journal is not None:
+            offset = self._journal.append('punch', (station, cardnr, punchtime))
+        self._pending.append(((station, cardnr, punchtime), offset))
+        if len(self._pending) >= self._batch and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        """Receive and store punches until stop is called."""
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._running = True
+        if self._journal is not None:
+            # punches not stored before the last exit
+            self._pending[:0] = [(data, offset) for kind, data, offset
+                                 in self._journal.replay() if kind == 'punch']
+        for reader in self._readers:
+            reader.open(loop)
+        try:
+            while self._running:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+        finally:
+            for reader in self._readers:
+                reader.close()
+            await self.flush()
+
+    def stop(self):
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Store all waiting punches in batches. If the database is not
+        available, the punches are kept and stored with the next batch. If
+        a batch fails because of another error, its punches are stored one
+        at a time and punches which can not be stored are skipped. Skipped
+        punches are reported and remain in the journal file before the
+        checkpoint."""
+        loop = asyncio.get_running_loop()
+        while len(self._pending) > 0:
+            batch = self._pending[:self._batch]
+            try:
+                self.stored += await loop.run_in_executor(
+                    self._executor, self._store_batch, [p for p, o in batch])
+            except TRANSIENT_ERRORS as e:
+                self._unavailable(e)
+                return
+            except Exception:
+                print_exc(file=sys.stderr)
+                for punch, offset in batch:
+                    try:
+                        self.stored += await loop.run_in_executor(
+                            self._executor, self._store_batch, [punch])
+                    except TRANSIENT_ERRORS as e:
+                        self._unavailable(e)
+                        return
+                    except Exception as e:
+                        print('Punch of card %s at station %s at %s skipped: %s'
+                              % (punch[1], punch[0], punch[2], str(e).strip()),
+                              file=sys.stderr)
+                    self._remove(1)
+                continue
+            self._remove(len(batch))
+
+    def _unavailable(self, error):
+        print('Database not available, %d punches are waiting: %s'
+              % (len(self._pending), str(error).strip()), file=sys.stderr)
+
+    def _remove(self, count):
+        """Remove the first count waiting punches after they were stored."""
+        # punches received while storing were appended
+        offset = self._pending[count - 1][1]
+        del self._pending[:count]
+        if self._journal is not None:
+            self._journal.checkpoint(offset)
+
+    @timer('punch_store')
+    def _store_batch(self, punches):
+        if self._journal is not None:
+            # the punches are on the disk before the checkpoint is moved
+            self._journal.sync()
+        return self.store_punches(punches)
+
+    def store_punches(self, punches):
+        """Store punches in one transaction. New runs are created for cards
+        without an open run, punches already stored in any run of the card
+        (e.g. when the punches are replayed from the journal or read from the
+        card) are skipped.
+        @param punches: list of (station code, card number, punchtime) tuples
+        @return:        number of stored punches
+        """
+        store = self._store
+        try:
+            cards = list({c for s, c, t in punches})
+            runs = {}
+            for r in store.find(Run, In(Run._sicard_id, cards),
+                                Run.complete == False).order_by(Run.id):
+                # the last open run of a card is used
+                runs[r._sicard_id] = r
+
+            # (card number, station, punchtime) of the punches already stored
+            times = [t for s, c, t in punches]
+            existing = set(store.find(
+                (Run._sicard_id, Punch._sistation_id, Punch.card_punchtime),
+                Punch._run_id == Run.id,
+                In(Run._sicard_id, cards),
+                Punch.card_punchtime >= min(times),
+                Punch.card_punchtime <= max(times)))
+
+            stations = {s.id: s for s in store.find(SIStation,
+                                                    In(SIStation.id,
+                                                       list({s for s, c, t in punches})))}
+
+            count = 0
+            for station, cardnr, punchtime in punches:
+                if (cardnr, station, punchtime) in existing:
+                    continue
+                run = runs.get(cardnr)
+                if run is None:
+                    run = runs[cardnr] = store.add(Run(cardnr, store=store))
+                if station not in stations:
+                    stations[station] = SIStation(station)
+                run.punches.add(Punch(stations[station], punchtime))
+                existing.add((cardnr, station, punchtime))
+                count += 1
+            store.commit()
+        except:
+            store.rollback()
+            raise
+        return count
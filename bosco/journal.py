@@ -0,0 +1,158 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+journal.py - Local append-only journal of received punches and SI-Card
+             readouts. Data is written to the journal before it is stored
+             in the database, nothing is lost if the database is not
+             reachable.
+"""
+
+import json
+import os
+
+from datetime import datetime
+from threading import Lock
+
+from storm.exceptions import OperationalError, InterfaceError
+
+# Database errors after which storing the data is retried later
+# (e.g. database server not reachable).
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+def _datetime(value):
+    if value is None:
+        return None
+    return datetime.fromisoformat(value)
+
+def _encode(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError('Can not write %r to the journal' % obj)
+
+def _decode_punch(data):
+    station, cardnr, punchtime = data
+    return (station, cardnr, _datetime(punchtime))
+
+def _decode_card(data):
+    for key in ('start', 'finish', 'check', 'clear'):
+        data[key] = _datetime(data.get(key))
+    data['punches'] = [(s, _datetime(t)) for s, t in data['punches']]
+    return data
+
+class Journal:
+    """Append-only journal file. Every record is a line with the JSON list
+    [kind, data]. Known kinds are:
+      - 'punch': (station code, card number, punchtime) of a punch received
+                 from a station in autosend mode
+      - 'card':  card data as returned by SIReaderReadout.read_sicard
+
+    The offset of the records stored in the database is saved in a
+    checkpoint file (path + '.pos'). After a restart the records after the
+    checkpoint are returned by replay. Storing the records must be
+    idempotent: records stored just before the program crashed are stored
+    again.
+
+    Records can be appended by one thread while another thread writes the
+    checkpoint.
+    """
+
+    _decoders = {'punch': _decode_punch,
+                 'card': _decode_card}
+
+    def __init__(self, path):
+        """
+        @param path: path of the journal file, created if it does not exist
+        """
+        self.path = path
+        self._checkpoint_path = path + '.pos'
+        self._lock = Lock()
+        self._file = open(path, 'ab+')
+        self._truncate_incomplete()
+
+    def _truncate_incomplete(self):
+        """Remove the last record if it was not completely written (e.g.
+        because of a power failure)."""
+        size = self._file.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        self._file.seek(max(size - 4096, 0))
+        tail = self._file.read()
+        if tail.endswith(b'\n'):
+            return
+        end = tail.rfind(b'\n')
+        # records are much shorter than 4096 bytes
+        self._file.truncate(size - len(tail) + end + 1 if end >= 0 else 0)
+
+    def append(self, kind, data, sync=False):
+        """Append a record to the journal.
+        @param kind: kind of the record, see the class documentation
+        @param sync: write the record to the disk before returning, else
+                     the record is only passed to the operating system and
+                     survives a crash of the program but not of the computer
+                     (see sync)
+        @return:     offset after the record, use it as the checkpoint when
+                     the record is stored
+        """
+        line = json.dumps([kind, data], default=_encode).encode('utf-8') + b'\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+            return self._file.tell()
+
+    def sync(self):
+        """Write all appended records to the disk."""
+        with self._lock:
+            os.fsync(self._file.fileno())
+
+    def _read_checkpoint(self):
+        try:
+            with open(self._checkpoint_path, 'r') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def checkpoint(self, offset):
+        """Save the offset of the records stored in the database.
+        @param offset: offset returned by append or replay
+        """
+        tmp = self._checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._checkpoint_path)
+
+    def replay(self):
+        """
+        @return: list of (kind, data, offset) tuples of the records after the
+                 checkpoint, offset is the offset after the record
+        """
+        records = []
+        with open(self.path, 'rb') as f:
+            offset = f.seek(self._read_checkpoint())
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # currently written by another thread
+                    break
+                offset += len(line)
+                kind, data = json.loads(line.decode('utf-8'))
+                records.append((kind, self._decoders[kind](data), offset))
+        return records
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,154 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+jsonfeed.py - Machine readable ranking export. A JSON snapshot of every
+              ranking and an append only NDJSON file with the changes between
+              versions. See docs/json-export.txt for the schema.
+"""
+
+import json
+
+from datetime import timedelta, timezone
+
+from .ranking import Validator, Relay24hScore
+
+SCHEMA_VERSION = 1
+
+STATUS = {Validator.OK:               'ok',
+          Validator.NOT_COMPLETED:    'not_completed',
+          Validator.MISSING_CONTROLS: 'missing_controls',
+          Validator.DID_NOT_FINISH:   'did_not_finish',
+          Validator.DISQUALIFIED:     'disqualified',
+          Validator.DID_NOT_START:    'did_not_start',
+          }
+
+def encode_score(score):
+    """
+    @return: JSON representation of a score, time differences are encoded
+             as seconds
+    """
+    if score is None or type(score) in (int, float, bool):
+        return score
+    if isinstance(score, timedelta):
+        return score.total_seconds()
+    if isinstance(score, Relay24hScore):
+        return {'runs': score.runs, 'time': score.time.total_seconds()}
+    return str(score)
+
+def item_ref(item):
+    """
+    @return: reference to a ranked item: dict with the keys 'type' (lower
+             case class name) and 'id'
+    """
+    return {'type': type(item).__name__.lower(),
+            'id':   getattr(item, 'id', None)}
+
+def encode_entry(position, entry):
+    """
+    @param entry: ranking entry
+    @return:      dict for the snapshot
+    """
+    result = item_ref(entry['item'])
+    result.update({'name':     str(entry['item']),
+                   'number':   getattr(entry['item'], 'number', None),
+                   'position': position,
+                   'rank':     entry['rank'],
+                   'status':   STATUS.get(entry['validation']['status']),
+                   'score':    encode_score(entry['scoreing'].get('score')),
+                   'behind':   encode_score(entry['scoreing'].get('behind')),
+                   })
+    return result
+
+def encode_change(change):
+    """
+    @param change: change as returned by Ranking.changes_since
+    @return:       dict for a delta record
+    """
+    result = item_ref(change['item'])
+    for key in ('old', 'new'):
+        state = change[key]
+        if state is not None:
+            state = {'position': state['position'],
+                     'rank':     state['rank'],
+                     'score':    encode_score(state['score']),
+                     'status':   STATUS.get(state['status'])}
+        result[key] = state
+    return result
+
+def encode_time(time):
+    """
+    @param time: naive local time
+    @return:     ISO 8601 representation of the time in UTC
+    """
+    return time.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+class JSONFeed:
+    """Creates the JSON snapshot and the NDJSON delta record of rankings.
+    Remembers the last exported version of each ranking."""
+
+    def __init__(self):
+        self._versions = {}
+
+    def render(self, desc, ranking):
+        """
+        @param desc:    description of the ranking
+        @param ranking: ranking, is not updated if it is already initialized
+        @return:        tuple (snapshot, delta): the encoded snapshot and the
+                        encoded delta line (None if the ranking did not change
+                        since the last call)
+        """
+        # initializes the ranking if necessary
+        entries = ranking[:]
+        # time of the last change, snapshots of unchanged rankings are
+        # identical
+        changed = encode_time(ranking.changed)
+        snapshot = {'schema':   SCHEMA_VERSION,
+                    'ranking':  desc,
+                    'version':  ranking.version,
+                    'time':     changed,
+                    'completed': ranking.completed_count,
+                    'members':  ranking.member_count,
+                    'entries':  [encode_entry(i, e) for i, e in enumerate(entries)],
+                    }
+
+        delta = None
+        last = self._versions.get(desc)
+        if last is None or last != ranking.version:
+            delta = {'schema':  SCHEMA_VERSION,
+                     'ranking': desc,
+                     'from':    last,
+                     'version': ranking.version,
+                     'time':    changed}
+            changes = None
+            if last is not None:
+                try:
+                    changes = ranking.changes_since(last)
+                except KeyError:
+                    # too many updates since the last export
+                    pass
+            if changes is None:
+                # clients have to fetch the snapshot
+                delta['type'] = 'reset'
+            else:
+                delta['type'] = 'delta'
+                for key in ('inserted', 'removed', 'moved', 'changed'):
+                    delta[key] = [encode_change(c) for c in changes[key]]
+                leader = changes['leader']
+                delta['leader'] = leader is not None and item_ref(leader) or None
+            self._versions[desc] = ranking.version
+            delta = (json.dumps(delta, separators=(',', ':')) + '\n').encode('utf-8')
+
+        return (json.dumps(snapshot, separators=(',', ':')).encode('utf-8'), delta)
@@ -0,0 +1,133 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+latex.py - Build PDF documents with LaTeX. Documents are built concurrently
+           and cached by content hash.
+"""
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from shutil import copyfile, rmtree
+from subprocess import call, DEVNULL
+from tempfile import mkdtemp
+
+class LatexError(Exception):
+    pass
+
+class LatexBuilder:
+    """Builds LaTeX documents with pdflatex.
+
+    Every document is built in its own temporary directory, up to jobs
+    documents at the same time. The pdflatex processes do the work, so
+    threads are sufficient to run them concurrently. Built PDFs are stored
+    in the cache directory under the hash of their key and reused as long
+    as the key does not change.
+    """
+
+    def __init__(self, cache_dir=None, jobs=None,
+                 command=('pdflatex', '--interaction=batchmode')):
+        """
+        @param cache_dir: directory for cached PDFs, None disables the cache
+        @param jobs:      maximum number of concurrent builds, defaults to the
+                          number of CPUs
+        @param command:   LaTeX command, the name of the .tex file is appended
+        """
+        self._cache_dir = cache_dir
+        self._jobs = jobs or os.cpu_count() or 1
+        self._command = list(command)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, key):
+        if self._cache_dir is None:
+            return None
+        digest = sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self._cache_dir, digest + '.pdf')
+
+    def _build(self, tex, pdf):
+        """Build tex and store the result in pdf."""
+        tempdir = mkdtemp()
+        with open(os.path.join(tempdir, 'document.tex'), 'w', encoding='utf-8') as f:
+            f.write(tex)
+        call(self._command + ['document.tex'], cwd=tempdir,
+             stdin=DEVNULL, stdout=DEVNULL)
+        try:
+            copyfile(os.path.join(tempdir, 'document.pdf'), pdf)
+        except FileNotFoundError:
+            # keep the temporary directory with the LaTeX log for debugging
+            raise LatexError('LaTeX did not produce a PDF, see %s' %
+                             os.path.join(tempdir, 'document.log'))
+        rmtree(tempdir)
+
+    def build(self, documents, outdir):
+        """Build documents. Cache lookups and calls to tex functions happen in
+        the calling thread, only LaTeX runs concurrently.
+        @param documents: list of (name, key, tex) tuples. tex is the LaTeX
+                          source or a function returning it (only called if
+                          the document is not in the cache). key identifies
+                          the content of the document, e.g. the LaTeX source
+                          without timestamps.
+        @param outdir:    directory for PDFs not stored in the cache
+        @return:          list of (name, pdf, error) tuples in the order of
+                          documents, pdf is the path of the PDF or None if
+                          the build failed and error is the LatexError
+        """
+        def job(tex, target, cached):
+            self._build(tex, target)
+            if cached is not None:
+                # rename is atomic, concurrent readers see complete files
+                tmp = '%s.%d.tmp' % (cached, os.getpid())
+                copyfile(target, tmp)
+                os.replace(tmp, cached)
+            return target
+
+        results = []
+        with ThreadPoolExecutor(self._jobs) as executor:
+            for i, (name, key, tex) in enumerate(documents):
+                cached = self._cache_path(key)
+                if cached is not None and os.path.exists(cached):
+                    results.append((name, cached))
+                    continue
+                if callable(tex):
+                    tex = tex()
+                target = os.path.join(outdir, '%d.pdf' % i)
+                results.append((name, executor.submit(job, tex, target, cached)))
+
+        for i, (name, pdf) in enumerate(results):
+            if isinstance(pdf, str):
+                results[i] = (name, pdf, None)
+                continue
+            try:
+                results[i] = (name, pdf.result(), None)
+            except LatexError as e:
+                results[i] = (name, None, e)
+        return results
+
+    def merge(self, pdfs, output):
+        """Concatenate PDFs with the pdfpages LaTeX package.
+        @param pdfs:   list of paths of PDF files
+        @param output: path of the merged PDF
+        """
+        if len(pdfs) == 1:
+            copyfile(pdfs[0], output)
+            return
+        tex = ('\\documentclass{article}\n\\usepackage{pdfpages}\n'
+               '\\begin{document}\n%s\\end{document}\n'
+               % ''.join('\\includepdf[pages=-]{%s}\n' % os.path.abspath(p)
+                         for p in pdfs))
+        self._build(tex, output)
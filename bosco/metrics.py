@@ -0,0 +1,279 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+metrics.py - Timings of the hot paths of long running bosco programs in the
+             Prometheus text format and profiling on demand.
+"""
+
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import traceback
+
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread, current_thread, enumerate as threads
+from time import perf_counter
+
+class Metrics:
+    """Registry of timings. For every name the number of observations, the
+    total and the maximum time are recorded. Timings of nested operations
+    (e.g. the validation of the runs while a team is validated) are
+    included in the timing of the outer operation.
+
+    The timings are rendered in the Prometheus text format:
+
+        bosco_ranking_update_seconds_count 12
+        bosco_ranking_update_seconds_sum 3.2
+        bosco_ranking_update_seconds_max 0.8
+    """
+
+    def __init__(self, prefix='bosco'):
+        self._prefix = prefix
+        self._lock = Lock()
+        # name to [count, sum, max]
+        self._timings = {}
+
+    def observe(self, name, seconds, count=1):
+        """Record a timing.
+        @param name:    name of the timing, e.g. 'ranking_update'
+        @param seconds: time in seconds
+        @param count:   number of operations timed together
+        """
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = [0, 0.0, 0.0]
+            timing[0] += count
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+
+    @contextmanager
+    def timer(self, name):
+        """Time the block of a with statement. The time is also recorded if
+        the block raises an exception."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def get(self, name):
+        """
+        @return: tuple (count, sum, max) of a timing
+        """
+        with self._lock:
+            return tuple(self._timings.get(name, (0, 0.0, 0.0)))
+
+    def clear(self):
+        with self._lock:
+            self._timings.clear()
+
+    def render(self):
+        """
+        @return: all timings in the Prometheus text format
+        """
+        with self._lock:
+            timings = sorted((n, list(t)) for n, t in self._timings.items())
+        lines = []
+        for name, (count, total, maximum) in timings:
+            metric = '%s_%s_seconds' % (self._prefix, name)
+            lines.extend(['# TYPE %s summary' % metric,
+                          '%s_count %d' % (metric, count),
+                          '%s_sum %f' % (metric, total),
+                          '# TYPE %s_max gauge' % metric,
+                          '%s_max %f' % (metric, maximum)])
+        return ''.join(l + '\n' for l in lines)
+
+    def write(self, path):
+        """Write all timings to a file, e.g. for the textfile collector of
+        the Prometheus node exporter. The file is replaced atomically."""
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+# timings of this process
+metrics = Metrics()
+
+def timer(name):
+    """Time the block of a with statement or every call of a decorated
+    function in the metrics of this process.
+    @see: Metrics.timer
+    """
+    return metrics.timer(name)
+
+class MetricsWriter(Thread):
+    """Writes the metrics to a file every interval seconds."""
+
+    def __init__(self, path, interval=15, registry=metrics):
+        super().__init__(daemon=True)
+        self._path = path
+        self._interval = interval
+        self._registry = registry
+        self._stopped = Event()
+
+    def run(self):
+        self._write()
+        while not self._stopped.wait(self._interval):
+            self._write()
+        self._write()
+
+    def _write(self):
+        try:
+            self._registry.write(self._path)
+        except OSError as e:
+            print('Could not write the metrics to %s: %s' % (self._path, e),
+                  file=sys.stderr)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+def serve_metrics(port, host='localhost', registry=metrics):
+    """Serve the metrics on http://host:port/metrics in a background thread.
+    @return: HTTP server, call shutdown to stop it
+    """
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def format_stacks():
+    """
+    @return: the current stack of all threads
+    """
+    frames = sys._current_frames()
+    lines = []
+    for thread in threads():
+        frame = frames.get(thread.ident)
+        if frame is None:
+            continue
+        lines.append('Thread %s (%s):\n' % (thread.name, thread.ident))
+        lines.extend(traceback.format_stack(frame))
+        lines.append('\n')
+    return ''.join(lines)
+
+class Profiler:
+    """Profiling on demand of a running program. On every signal the stacks
+    of all threads are written to the directory and a cProfile window is
+    started or stopped. When the window is stopped, the profile is written
+    as a pstats file (.prof) and as a text report (.txt).
+
+    Signal handlers run in the main thread, only the main thread is
+    profiled (e.g. the GUI or the ranking export).
+    """
+
+    def __init__(self, directory, signum=signal.SIGUSR1):
+        """
+        @param directory: directory to write the stacks and profiles to
+        @param signum:    signal starting and stopping the profiler
+        """
+        self._directory = directory
+        self._signum = signum
+        self._profile = None
+        # number of signals, keeps the file names unique
+        self._count = 0
+
+    def install(self):
+        os.makedirs(self._directory, exist_ok=True)
+        signal.signal(self._signum, self._handle)
+
+    def _handle(self, signum, frame):
+        self.toggle()
+
+    def _path(self, name, ext):
+        return os.path.join(self._directory, '%s-%s-%d-%d.%s'
+                            % (name, datetime.now().strftime('%Y%m%d-%H%M%S'),
+                               os.getpid(), self._count, ext))
+
+    def toggle(self):
+        """Write the stacks of all threads and start or stop profiling.
+        @return: list of files written
+        """
+        self._count += 1
+        files = [self._path('stacks', 'txt')]
+        with open(files[0], 'w') as f:
+            f.write(format_stacks())
+
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            print('Profiling %s, send the signal again to stop.'
+                  % current_thread().name, file=sys.stderr)
+        else:
+            self._profile.disable()
+            files.append(self._path('profile', 'prof'))
+            self._profile.dump_stats(files[-1])
+            files.append(self._path('profile', 'txt'))
+            with open(files[-1], 'w') as f:
+                stats = pstats.Stats(self._profile, stream=f)
+                stats.sort_stats('cumulative').print_stats(50)
+            self._profile = None
+        print('Profiler wrote %s' % ', '.join(files), file=sys.stderr)
+        return files
+
+def add_metrics_options(opt):
+    """Add the metrics and profiling options to an OptionParser."""
+    opt.add_option('--metrics-file', action='store', default=None,
+                   help='Write timings of the hot paths in the Prometheus text '
+                        'format to this file every 15 seconds.')
+    opt.add_option('--metrics-port', action='store', type='int', default=None,
+                   help='Serve the timings on http://localhost:PORT/metrics.')
+    opt.add_option('--profile-dir', action='store', default=None,
+                   help='Write the stacks of all threads to this directory on '
+                        'SIGUSR1 and start profiling, the profile is written on '
+                        'the next SIGUSR1.')
+
+def start_metrics(metrics_file=None, metrics_port=None, profile_dir=None):
+    """Start writing and serving the metrics and install the profiler.
+    @return: function stopping the writer and server
+    """
+    writer = server = None
+    if metrics_file is not None:
+        writer = MetricsWriter(metrics_file)
+        writer.start()
+    if metrics_port is not None:
+        server = serve_metrics(metrics_port)
+    if profile_dir is not None:
+        Profiler(profile_dir).install()
+
+    def stop():
+        if writer is not None:
+            writer.stop()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return stop
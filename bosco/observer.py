@@ -21,6 +21,7 @@ from threading import Timer
 from storm.locals import *
 from datetime import datetime
 
+from .metrics import timer
 from .run import Punch, Run
 from .runner import Team
 
@@ -76,7 +77,8 @@ class EventObserver:
     
     def __init__(self, store, interval = 5, rollback = True):
         """
-        @param interval: Check interval
+        @param interval: Check interval, None to not check periodically.
+                         Call observe to check for changes in this case.
         @param rollback: Rollback store before checking for new objects?
                          This is necessary to get new objects added by other
                          connections but it resets all uncommited changes.
@@ -96,7 +98,7 @@ class EventObserver:
         self._running = False
         
     def _start_timer(self):
-        if self._running == True:
+        if self._running == True and self._interval is not None:
             t = Timer(self._interval, self.observe)
             t.start()
             
@@ -126,6 +128,7 @@ class EventObserver:
         if len(self._registry) == 0:
             self._running = False
         
+    @timer('observer_cycle')
     def observe(self):
         """Does the actual observation."""
 
@@ -171,7 +174,7 @@ class TriggerEventObserver(EventObserver):
 
     def __init__(self, store, interval = 5, rollback = True):
         """
-        @param interval: Check interval
+        @param interval: Check interval, None to not check periodically
         @param rollback: Rollback store before checking for new objects?
                          This is necessary to get new objects added by other
                          connections but it resets all uncommited changes.
@@ -179,6 +182,7 @@ class TriggerEventObserver(EventObserver):
         EventObserver.__init__(self, store, interval, rollback)
         self._last = datetime.utcnow()
         
+    @timer('observer_cycle')
     def observe(self):
         """Does the actual observation."""
 
@@ -0,0 +1,126 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+output.py - Output directory which only rewrites files with changed content.
+            Files are replaced atomically.
+"""
+
+import os
+
+from hashlib import sha1
+from tempfile import NamedTemporaryFile
+
+def atomic_write(path, content, mode=0o644):
+    """Replace the file at path with content. The content is written to a
+    temporary file in the same directory which is renamed to path.
+    @param content: bytes
+    @param mode:    permissions of the file
+    """
+    f = NamedTemporaryFile(dir=os.path.dirname(path) or '.',
+                           prefix='.%s.' % os.path.basename(path),
+                           delete=False)
+    try:
+        with f:
+            f.write(content)
+        os.chmod(f.name, mode)
+        os.replace(f.name, path)
+    except:
+        os.unlink(f.name)
+        raise
+
+class OutputDirectory:
+    """Directory of exported files.
+
+    The content hash of every written file is remembered and a file is only
+    written if its content changed. Files present in the directory before
+    the first write (e.g. from a previous run of the exporter) are hashed
+    when they are first written. New content is written to a temporary file
+    in the same directory which is then renamed, so readers (e.g. a web
+    server) never see a partially written file.
+
+    The paths of the files changed since the last call to changes are
+    collected for the sync step.
+    """
+
+    def __init__(self, directory):
+        """
+        @param directory: output directory, must exist
+        """
+        self._directory = directory
+        self._hashes = {}
+        self._changed = []
+
+        # NamedTemporaryFile creates files only readable by the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        self._mode = 0o666 & ~umask
+
+    def _path(self, filename):
+        return os.path.join(self._directory, filename)
+
+    def _digest(self, filename):
+        if filename in self._hashes:
+            return self._hashes[filename]
+        try:
+            with open(self._path(filename), 'rb') as f:
+                return sha1(f.read()).digest()
+        except FileNotFoundError:
+            return None
+
+    def write(self, filename, content):
+        """Write content to filename if it differs from the current content.
+        @param filename: file name relative to the output directory
+        @param content:  bytes
+        @return:         True if the file was written
+        """
+        digest = sha1(content).digest()
+        if self._digest(filename) == digest:
+            self._hashes[filename] = digest
+            return False
+
+        atomic_write(self._path(filename), content, self._mode)
+        self._hashes[filename] = digest
+        self._changed.append(filename)
+        return True
+
+    def append(self, filename, content):
+        """Append content to filename. Appended content is not hashed.
+        @param filename: file name relative to the output directory
+        @param content:  bytes
+        """
+        with open(self._path(filename), 'ab') as f:
+            f.write(content)
+        self._hashes.pop(filename, None)
+        if filename not in self._changed:
+            self._changed.append(filename)
+
+    def changes(self):
+        """
+        @return: list of file names written since the last call, in order of
+                 writing
+        """
+        changed, self._changed = self._changed, []
+        return changed
+
+    def write_manifest(self, filename, changed):
+        """Write a list of changed files, one path relative to the output
+        directory per line. The manifest itself is not listed in changes.
+        @param filename: file name of the manifest, relative to the current
+                         directory
+        @param changed:  list of changed file names as returned by changes
+        """
+        atomic_write(filename, ''.join('%s\n' % c for c in changed).encode('utf-8'),
+                     self._mode)
@@ -0,0 +1,125 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+querylog.py - Count and time the SQL statements of a store and attribute
+              them to the bosco functions executing them.
+"""
+
+import sys
+
+from threading import Lock, local
+from time import perf_counter
+
+from storm.tracer import install_tracer, remove_tracer
+
+def call_site(frame):
+    """Find the bosco function which caused a statement.
+    @param frame: frame of the storm function executing the statement
+    @return:      qualified name of the innermost bosco function on the
+                  stack (e.g. 'bosco.runner.Runner.run') or None if the
+                  statement was not executed from bosco
+    """
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('bosco.') and module != __name__:
+            # co_qualname is new in Python 3.11
+            code = frame.f_code
+            return '%s.%s' % (module, getattr(code, 'co_qualname', code.co_name))
+        frame = frame.f_back
+    return None
+
+class QueryLog:
+    """Storm tracer counting the statements executed by a store. Every
+    statement is attributed to the innermost bosco function on the stack,
+    lazy loads of references (e.g. run.course) are attributed to the
+    function accessing the reference.
+
+    Use it as a context manager:
+
+        with QueryLog(store) as log:
+            ranking.update()
+        print(log.count)
+        print(log.report())
+    """
+
+    def __init__(self, store=None):
+        """
+        @param store: only count the statements of this store, None to count
+                      the statements of all stores
+        """
+        self._store = store
+        self._lock = Lock()
+        self._local = local()
+        self.reset()
+
+    def reset(self):
+        """Clear the counters."""
+        with self._lock:
+            # number of statements and execution time in seconds
+            self.count = 0
+            self.time = 0.0
+            # call site to [count, time]
+            self.sites = {}
+
+    def start(self):
+        install_tracer(self)
+
+    def stop(self):
+        remove_tracer(self)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def _traced(self, connection):
+        # the connection of a store is created when the store is created
+        return self._store is None or connection is self._store._connection
+
+    def connection_raw_execute(self, connection, raw_cursor, statement, params):
+        if self._traced(connection):
+            self._local.start = perf_counter()
+
+    def connection_raw_execute_success(self, connection, raw_cursor, statement, params):
+        if self._traced(connection):
+            self._add(perf_counter() - self._local.start)
+
+    def connection_raw_execute_error(self, connection, raw_cursor, statement, params,
+                                     error):
+        self.connection_raw_execute_success(connection, raw_cursor, statement, params)
+
+    def _add(self, time):
+        site = call_site(sys._getframe(1))
+        with self._lock:
+            self.count += 1
+            self.time += time
+            counters = self.sites.setdefault(site, [0, 0.0])
+            counters[0] += 1
+            counters[1] += time
+
+    def report(self, limit=None):
+        """
+        @param limit: maximum number of call sites to report
+        @return:      report of the call sites with the most statements
+        """
+        with self._lock:
+            sites = sorted(self.sites.items(), key=lambda s: (-s[1][0], s[0] or ''))
+            lines = ['%d statements, %.3fs' % (self.count, self.time)]
+        for site, (count, time) in sites[:limit]:
+            lines.append('%7d %8.3fs  %s' % (count, time, site or '(not bosco)'))
+        return '\n'.join(lines)
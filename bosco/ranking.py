@@ -23,12 +23,17 @@ ranking.py - Classes to produce rankings of objects that implement
 from datetime import timedelta, datetime
 from copy import copy
 from functools import total_ordering
+from time import perf_counter
 from traceback import print_exc
-import sys, re
+import sys, re, heapq
 
 from storm.exceptions import NotOneError
 from storm.locals import *
 
+from .metrics import metrics, timer
+from .result import ValidationResult, ScoreingResult, RankingEntry, PunchList
+from .result import delta_to_us, us_to_delta
+
 class RankableItem:
     """Defines the interface for all rankable items (currently Runner, Team, Run).
     This interfaces specifies the methods to access information about the RankableItem
@@ -48,6 +53,38 @@ class RankableItem:
     def __str__(self):
         return 'override __str__ for a more meaningful value'
 
+def _score_key(scoreing):
+    """
+    @param scoreing: scoreing result
+    @return:         score used to sort rankings, integer microseconds for
+                     time scores
+    """
+    time = getattr(scoreing, 'time', None)
+    return time if time is not None else scoreing['score']
+
+@total_ordering
+class _Reversed:
+    """Wraps a score to reverse its sort order."""
+
+    __slots__ = ('score', )
+
+    def __init__(self, score):
+        self.score = score
+
+    def __eq__(self, other):
+        return self.score == other.score
+
+    def __lt__(self, other):
+        return other.score < self.score
+
+def _reversed_key(score):
+    """
+    @return: sort key for score in reverse rankings
+    """
+    if isinstance(score, (int, float)):
+        return -score
+    return _Reversed(score)
+
 class Ranking:
     """A Ranking objects combines a scoreing strategy, a validation strategy and a
     rankable object (course or category) and computes a ranking. The Ranking object
@@ -57,13 +94,19 @@ class Ranking:
     a subclass of AbstractScoreing compatible with the RankableItem objects of this Rankable.
     The ranking is generated in lowest first order. Reverse rankings are possible.
 
-    The iterator returns dictionaries with the keys 'rank', 'scoreing', 'validation',
-    'item'.
+    The iterator returns RankingEntry objects with the keys 'rank', 'scoreing',
+    'validation', 'item'. They can be used like dictionaries.
 
     Rankings are lazyly computed, but not updated unless you eihter call the update mehtod
     or iterate over them.
+
+    Every update which changes the ranking increases the version of the ranking.
+    Use changes_since to get the changes since an earlier version.
     """
 
+    # number of previous versions kept for changes_since
+    HISTORY = 16
+
     def __init__(self, rankable, event, scoreing_class = None, validator_class = None,
                  scoreing_args = None, validator_args = None, reverse = False):
         self.rankable = rankable
@@ -76,6 +119,14 @@ class Ranking:
         self._ranking_list = []
         self._ranking_dict = {}
 
+        # version of the ranking and snapshots of previous versions
+        self.version = 0
+        self._history = [(0, {})]
+        # time of the last change of the ranking
+        self.changed = datetime.now()
+        # store of the items in the snapshots
+        self._store = None
+
         # lazy initialization flag
         self._initialized = False
 
@@ -141,25 +192,37 @@ class Ranking:
             self.update()
         return self._completed_count
 
-    def _update_ranking_list(self):
-        # Create list of (score, member) tuples and sort by score
-        self._ranking_list = []
+    def _collect(self):
+        """Score and validate all members of the rankable and compute their
+        sort keys. This also updates member_count and completed_count.
+        @return: list of (key, score, entry) tuples in no particular order.
+                 key is a (status, score, number, index) tuple which defines
+                 the order of the ranking, score is the score used to compute
+                 behind times.
+        """
+        entries = []
         self._member_count = 0
         self._completed_count = 0
 
         # convert to a list for counting as it may either be
         # a strom result set or a real list
-        if not len(list(self.rankable.members)) > 0:
+        members = list(self.rankable.members)
+        if not len(members) > 0:
             # stop if rankable has no members
-            return
+            return []
 
-        for m in self.rankable.members:
+        scoreing_time = 0.0
+        validation_time = 0.0
+        for m in members:
+            start = perf_counter()
             try:
                 # copy arguments as they might get modified
                 args = None if self.scoreing_args is None else self.scoreing_args.copy()
                 score = self._event.score(m, self._scoreing_class, args)
             except UnscoreableException:
-                score = {'score': timedelta(0)}
+                score = ScoreingResult(score=timedelta(0))
+            scored = perf_counter()
+            scoreing_time += scored - start
 
             try:
                 # copy arguments as they might get modified
@@ -168,36 +231,180 @@ class Ranking:
             except ValidationError:
                 print_exc(file=sys.stderr)
                 continue
+            finally:
+                validation_time += perf_counter() - scored
 
             self._member_count += 1
             if valid['status'] != Validator.NOT_COMPLETED:
                 self._completed_count += 1
 
-            self._ranking_list.append({'scoreing': score,
-                                       'validation': valid,
-                                       'item': m})
+            entries.append(RankingEntry(scoreing=score,
+                                        validation=valid,
+                                        item=m))
 
-        # Sort by number first, then by score and finally by validation status
-        # x['item'] is either a Run, Runner or Team
-        from .run import Run
-        self._ranking_list.sort(key = lambda x: (isinstance(x['item'], Run)) and x['item'].sicard.runner and (x['item'].sicard.runner.number or '0') or x['item'].number or '0')
-        self._ranking_list.sort(key = lambda x: x['scoreing']['score'], reverse = self._reverse)
-        self._ranking_list.sort(key = lambda x: x['validation']['status'])
-
-        rank = 1
-        winner_score = self._ranking_list[0]['scoreing']['score']
-        for i, m in enumerate(self._ranking_list):
-            # Only increase the rank if the current item scores higher than the previous item
-            if (i > 0 and (self._ranking_list[i]['scoreing']['score']
-                           > self._ranking_list[i-1]['scoreing']['score'])
-                or (self._reverse and (self._ranking_list[i]['scoreing']['score']
-                                       < self._ranking_list[i-1]['scoreing']['score']))):
-                rank = i + 1
+        # time to score and validate all members of the ranking
+        metrics.observe('scoreing', scoreing_time)
+        metrics.observe('validation', validation_time)
+
+        if len(entries) == 0:
+            return []
+
+        # Sort by validation status, then by score and finally by number.
+        # The sort keys are computed once per item. The index makes keys
+        # unique, entries are never compared.
+        numbers = self._numbers([m['item'] for m in entries])
+        result = []
+        for i, m in enumerate(entries):
+            score = _score_key(m['scoreing'])
+            key = (m['validation']['status'],
+                   _reversed_key(score) if self._reverse else score,
+                   numbers[i],
+                   i)
+            result.append((key, score, m))
+        return result
+
+    def _rank_entries(self, ranked, start, rank, winner_score):
+        """Assign rank and behind to a consecutive part of the ranking in a
+        single pass.
+        @param ranked:       list of (key, score, entry) tuples in ranking order
+        @param start:        position of the first tuple in the complete ranking
+        @param rank:         rank of the first tuple
+        @param winner_score: score of the first item of the complete ranking
+        """
+        for i, (key, score, m) in enumerate(ranked):
+            # Only increase the rank if the current item scores different
+            # than the previous item
+            if i > 0 and key[1] != ranked[i-1][0][1]:
+                rank = start + i + 1
             # only assign rank if run is OK
-            m['rank'] = rank if m['validation']['status'] == Validator.OK else None
-            m['scoreing']['behind'] = ((m['scoreing']['score'] - winner_score) * (self._reverse and -1 or 1)
-                                       if m['validation']['status'] == Validator.OK
-                                       else None)
+            if m['validation']['status'] == Validator.OK:
+                m['rank'] = rank
+                behind = (score - winner_score) * (self._reverse and -1 or 1)
+                if getattr(m['scoreing'], 'time', None) is not None:
+                    m['scoreing'].behind_time = behind
+                else:
+                    m['scoreing']['behind'] = behind
+            else:
+                m['rank'] = None
+                m['scoreing']['behind'] = None
+
+    def _update_ranking_list(self):
+        ranked = sorted(self._collect())
+        if len(ranked) > 0:
+            self._rank_entries(ranked, 0, 1, ranked[0][1])
+        self._ranking_list = [m for key, score, m in ranked]
+
+    def top(self, n):
+        """
+        Return the first n entries of the ranking. The entries are computed
+        on every call like when iterating over the ranking, but only the
+        first n entries are selected and ranked instead of sorting the
+        complete ranking. The full ranking (iteration, info, rank, ...) is
+        not updated. member_count and completed_count are updated and exact.
+        @param n: number of entries
+        @return:  list of ranking entries (same as when iterating over the
+                  ranking)
+        """
+        ranked = heapq.nsmallest(n, self._collect())
+        if len(ranked) > 0:
+            self._rank_entries(ranked, 0, 1, ranked[0][1])
+        return [m for key, score, m in ranked]
+
+    @staticmethod
+    def _find(collected, item):
+        for c in collected:
+            if c[2]['item'] == item:
+                return c
+        raise KeyError('%s not in ranking.' % item)
+
+    @staticmethod
+    def _position(collected, key):
+        """
+        @return: tuple (position, rank) of key in the complete ranking
+        """
+        position = len([c for c in collected if c[0] < key])
+        rank = len([c for c in collected
+                    if c[0][0] == key[0] and c[0][1] < key[1]]) + 1
+        return position, rank
+
+    def around(self, item, k):
+        """
+        Return the entry of item with up to k entries before and after it.
+        Like top, the entries are computed on every call, but only these
+        entries are selected and ranked instead of sorting the complete
+        ranking.
+        @param item: Item ranked in this ranking
+        @param k:    number of entries before and after item
+        @return:     list of ranking entries
+        @raises:     KeyError if item is not in the ranking
+        """
+        collected = self._collect()
+        own = Ranking._find(collected, item)
+
+        key = own[0]
+        before = heapq.nlargest(k, [c for c in collected if c[0] < key])
+        before.reverse()
+        after = heapq.nsmallest(k, [c for c in collected if c[0] > key])
+        ranked = before + [own] + after
+
+        # position and rank of the first selected entry in the complete ranking
+        start, rank = Ranking._position(collected, ranked[0][0])
+        self._rank_entries(ranked, start, rank, min(collected)[1])
+        return [m for key, score, m in ranked]
+
+    def select(self, items):
+        """
+        Return the entries of some items with their rank and behind time in
+        the complete ranking. The entries are computed on every call, but
+        only the entries of items are ranked.
+        @param items: Items ranked in this ranking
+        @return:      dict with the items as keys and the ranking entries as
+                      values, items which are not in the ranking are missing
+        """
+        collected = self._collect()
+        if len(collected) == 0:
+            return {}
+        wanted = set(items)
+        winner_score = min(collected)[1]
+
+        selected = {}
+        for c in collected:
+            if c[2]['item'] in wanted:
+                start, rank = Ranking._position(collected, c[0])
+                self._rank_entries([c], start, rank, winner_score)
+                selected[c[2]['item']] = c[2]
+        return selected
+
+    def _numbers(self, items):
+        """Numbers of the ranked items used to order items with equal scores.
+        Runner numbers of runs are fetched with a single query instead of
+        following the sicard and runner references of every run.
+        @param items: list of Run, Runner or Team objects
+        @return:      list of numbers, '0' if an item has no number
+        """
+        from .run import Run
+        from .runner import Runner, SICard
+
+        run_ids = [i.id for i in items if isinstance(i, Run)]
+        run_numbers = {}
+        store = Store.of(items[0])
+        if len(run_ids) > 0 and store is not None:
+            run_numbers = dict(store.find((Run.id, Runner.number),
+                                          Run._sicard_id == SICard.id,
+                                          SICard._runner_id == Runner.id,
+                                          In(Run.id, run_ids)))
+
+        numbers = []
+        for i in items:
+            if isinstance(i, Run):
+                if store is not None:
+                    number = run_numbers.get(i.id)
+                else:
+                    number = i.sicard.runner and i.sicard.runner.number
+            else:
+                number = i.number
+            numbers.append(number or '0')
+        return numbers
 
     def _update_ranking_dict(self):
         # create dictionary with ranked objects as keys for random access
@@ -205,46 +412,256 @@ class Ranking:
         for obj in self._ranking_list:
             self._ranking_dict[obj['item']] = obj
 
+    def _snapshot(self):
+        """
+        @return: dict with the keys of the ranked items as keys and
+                 (position, rank, score, status) tuples as values
+        @see:    _item_key
+        """
+        return dict([(self._item_key(m['item']),
+                      (i, m['rank'], m['scoreing'].get('score'),
+                       m['validation']['status']))
+                     for i, m in enumerate(self._ranking_list)])
+
+    def _item_key(self, item):
+        """Key of an item in snapshots. Stored objects are referenced by
+        class and id to not keep them alive in the history. Other objects
+        are used as they are."""
+        store = Store.of(item)
+        ident = getattr(item, 'id', None)
+        if store is None or ident is None:
+            return item
+        self._store = store
+        return (type(item), ident)
+
+    def _key_item(self, key):
+        """Look up the item of a snapshot key.
+        @see: _item_key
+        """
+        if type(key) is tuple:
+            return self._store.get(*key)
+        return key
+
+    def _update_version(self):
+        """Increase the version if the ranking changed since the last update."""
+        snapshot = self._snapshot()
+        if snapshot != self._history[-1][1]:
+            self.version += 1
+            self.changed = datetime.now()
+            self._history.append((self.version, snapshot))
+            del self._history[:-type(self).HISTORY]
+
+    def changes_since(self, version):
+        """
+        Changes of the ranking since an earlier version. This does not update
+        the ranking.
+        @param version: earlier version of this ranking
+        @return:        dict with the following keys:
+                        * version:  current version
+                        * inserted: items not in the earlier version
+                        * removed:  items not in the current version
+                        * moved:    items with a different position
+                        * changed:  items at the same position with a different
+                                    rank, score or status
+                        * leader:   new winner (first item with rank 1) or None
+                                    if the winner did not change or there is
+                                    no winner
+                        inserted, removed, moved and changed are lists of dicts
+                        with the keys 'item', 'old' and 'new'. 'old' and 'new'
+                        are dicts with the keys 'position', 'rank', 'score'
+                        and 'status' or None.
+        @raises:        KeyError if the version is not known (anymore), all
+                        entries should be considered as changed in this case
+        """
+        for v, old in self._history:
+            if v == version:
+                break
+        else:
+            raise KeyError('Version %s of ranking not available.' % version)
+        new = self._history[-1][1]
+
+        def state(values):
+            if values is None:
+                return None
+            return dict(zip(('position', 'rank', 'score', 'status'), values))
+
+        def change(key):
+            return {'item': self._key_item(key),
+                    'old':  state(old.get(key)),
+                    'new':  state(new.get(key))}
+
+        def winner(snapshot):
+            for key, values in snapshot.items():
+                if values[0] == 0 and values[1] == 1 and values[3] == Validator.OK:
+                    return key
+            return None
+
+        changes = {'version':  self.version,
+                   'inserted': [],
+                   'removed':  [change(i) for i in old if i not in new],
+                   'moved':    [],
+                   'changed':  [],
+                   'leader':   None,
+                   }
+        for item, values in new.items():
+            if item not in old:
+                changes['inserted'].append(change(item))
+            elif old[item][0] != values[0]:
+                changes['moved'].append(change(item))
+            elif old[item] != values:
+                changes['changed'].append(change(item))
+        leader = winner(new)
+        if leader is not None and leader != winner(old):
+            changes['leader'] = self._key_item(leader)
+
+        for key in ('inserted', 'moved', 'changed'):
+            changes[key].sort(key=lambda c: c['new']['position'])
+        changes['removed'].sort(key=lambda c: c['old']['position'])
+        return changes
+
+    @timer('ranking_update')
     def update(self):
         """
         Update the ranking. Rankings are not updated automatically.
         """
         self._update_ranking_list()
         self._update_ranking_dict()
+        self._update_version()
         self._initialized = True
 
 class RelayRanking(Ranking):
 
-    def update(self):
-        self._update_ranking_list()
+    def _add_legs(self, entries, partial=False):
+        """Add leg results ('runs') and intermediate team results ('splits')
+        to ranking entries.
+        @param partial: only rank the runs and teams of entries in the leg
+                        and split rankings instead of computing these
+                        rankings completely
+        """
 
+        legs = self._event.list_legs(self.rankable)
         leg_rankings = {}
-        for leg in self._event.list_legs(self.rankable):
+        for leg in legs:
             r = self._event.ranking(leg)
             leg_rankings.update([(k, r) for k in leg.course_list])
 
         # Relay rankings for splittimes
         split_rankings = []
-        for i in range(len(self._event.list_legs(self.rankable))):
+        for i in range(len(legs)):
             # Don't use self._event.ranking here to avoid the infinite recursion this
             # would cause otherwise. Explicitly create a ranking without split rankings
             r = Ranking(self.rankable, self._event, scoreing_args = {'legs': i+1},
                         validator_args = {'legs': i+1})
             split_rankings.append(r)
 
-        for team in self._ranking_list:
+        if partial:
+            runs = {}
+            for team in entries:
+                for run in team['scoreing'].get('runs', []):
+                    if run:
+                        runs.setdefault(leg_rankings[run.course], []).append(run)
+            run_entries = {}
+            for r, leg_runs in runs.items():
+                run_entries.update(r.select(leg_runs))
+            teams = [team['item'] for team in entries]
+            split_entries = [r.select(teams) for r in split_rankings]
+
+            def run_info(run):
+                try:
+                    return run_entries[run]
+                except KeyError:
+                    raise KeyError('%s not in ranking.' % run)
+
+            def split_info(i, team):
+                try:
+                    return split_entries[i][team]
+                except KeyError:
+                    raise KeyError('%s not in ranking.' % team)
+        else:
+            def run_info(run):
+                return leg_rankings[run.course].info(run)
+
+            def split_info(i, team):
+                return split_rankings[i].info(team)
+
+        for team in entries:
             team['runs'] = []
             team['splits'] = []
-            for i, run in enumerate(team['scoreing']['runs']):
+            # unscoreable teams have no runs
+            for i, run in enumerate(team['scoreing'].get('runs', [])):
                 if run:
-                    team['runs'].append(leg_rankings[run.course].info(run))
+                    team['runs'].append(run_info(run))
                 else:
                     team['runs'].append(None)
-                team['splits'].append(split_rankings[i].info(team['item']))
+                team['splits'].append(split_info(i, team['item']))
 
+    @timer('ranking_update')
+    def update(self):
+        self._update_ranking_list()
+        self._add_legs(self._ranking_list)
         self._update_ranking_dict()
+        self._update_version()
         self._initialized = True
 
+    def top(self, n):
+        entries = Ranking.top(self, n)
+        self._add_legs(entries, partial=True)
+        return entries
+
+    def around(self, item, k):
+        entries = Ranking.around(self, item, k)
+        self._add_legs(entries, partial=True)
+        return entries
+
+    def select(self, items):
+        entries = Ranking.select(self, items)
+        self._add_legs(list(entries.values()), partial=True)
+        return entries
+
+class PartialRanking:
+    """View of the first n entries of a ranking for displays. It can be
+    used like a Ranking in formatters, but updating it only selects and ranks
+    the first n entries. Like a Ranking it is updated on every iteration.
+    @see: Ranking.top
+    """
+
+    def __init__(self, ranking, n):
+        """
+        @param ranking: ranking to show
+        @type ranking:  object of class Ranking
+        @param n:       number of entries to show
+        """
+        self.ranking = ranking
+        self._n = n
+        self._entries = None
+
+    def __getattr__(self, attr):
+        return getattr(self.ranking, attr)
+
+    def __iter__(self):
+        self.update()
+        return iter(self._entries)
+
+    def __getitem__(self, key):
+        if self._entries is None:
+            self.update()
+        return self._entries[key]
+
+    def update(self):
+        self._entries = self.ranking.top(self._n)
+
+    @property
+    def member_count(self):
+        if self._entries is None:
+            self.update()
+        return self.ranking._member_count
+
+    @property
+    def completed_count(self):
+        if self._entries is None:
+            self.update()
+        return self.ranking._completed_count
+
 class Rankable:
     """Defines the interface for rankable objects like courses and categories.
     The following attributes must be available in subclasses:
@@ -408,16 +825,16 @@ class TimeScoreing(AbstractScoreing):
         except KeyError:
             pass
 
-        result = {}
-        result['start'] = self._start(obj)
-        result['finish'] = obj.finish_time
+        result = ScoreingResult()
+        result.start = self._start(obj)
+        result.finish = obj.finish_time
         try:
-            result['score'] = result['finish'] - result['start']
+            result.time = delta_to_us(result.finish - result.start)
         except TypeError as e:
             raise UnscoreableException(
                 f'Scoreing Error, runtime could not be calculated: {e}',
             )
-        if result['score'] < timedelta(0):
+        if result.time < 0:
             raise UnscoreableException('Scoreing Error, negative runtime: %(finish)s - %(start)s = %(score)s'
                                        % result)
 
@@ -587,7 +1004,7 @@ class Validator(CachingObject):
     def validate(self, obj):
         """Returns OK for every object. Override in subclasses for more meaningfull
         validations."""
-        return {'status':Validator.OK}
+        return ValidationResult(status=Validator.OK)
 
 class CourseValidator(Validator):
     """Validation strategy for courses."""
@@ -606,7 +1023,7 @@ class CourseValidator(Validator):
         except KeyError:
             pass
 
-        result = {'override':False}
+        result = ValidationResult(override=False)
         if run.override is not None:
             if run.override == Validator.OK and run.complete == False:
                 # return not completed even if override is OK to avoid inconsistencies
@@ -622,8 +1039,9 @@ class CourseValidator(Validator):
             result['status'] = Validator.OK
 
         # add all punches to punchlist
-        result['punchlist'] = [ ('ok', p[0]) for p in run.punchlist() ]
-        result['punchlist'].extend([ ('ignored', p[0]) for p in run.punchlist(ignored=True) ])
+        punchlist = PunchList([ ('ok', p[0]) for p in run.punchlist() ])
+        punchlist.extend([ ('ignored', p[0]) for p in run.punchlist(ignored=True) ])
+        result['punchlist'] = punchlist
 
         self._to_cache(self.validate, run, result)
         return result
@@ -780,14 +1198,14 @@ class SequenceCourseValidator(CourseValidator):
             if 'missing' in dict(diff_list):
                 result['status'] = Validator.MISSING_CONTROLS
 
-        result['punchlist'] = diff_list
+        result['punchlist'] = PunchList(diff_list)
 
         if self._reorder:
 
             from .run import ShiftedPunch
 
             # remove any additional punches from the validated punchlist
-            orig_punchlist = [(status, punch) for status, punch in result['punchlist'] if status in ('ok', 'missing')]
+            orig_punchlist = [(status, punch) for status, punch in diff_list if status in ('ok', 'missing')]
             punchlist = []
             for i, control_pos in enumerate(self._reorder):
                 # i is zero based, control_pos is 1 based
@@ -799,12 +1217,12 @@ class SequenceCourseValidator(CourseValidator):
                     # the current punch plus the previous punch in the original
                     # punchlist and the previous punch in the reordered punchlist
                     # must be available for reordering to be possible
-                    orig_punch = orig_punchlist[control_pos][1]
-                    orig_punchtime = orig_punch.punchtime
-                    legtime = orig_punchtime - orig_punchlist[control_pos-1][1].punchtime
+                    # the leg time stays the same, so the punch is shifted by the
+                    # same amount as the previous punch in the reordered punchlist
                     # TODO: This fails if the first punch is reordered, would need starttime to fix this
-                    shifted_punchtime = punchlist[i-1][1].punchtime + legtime
-                    punchlist.append(('ok', ShiftedPunch(orig_punch, shifted_punchtime - orig_punchtime)))
+                    shift = delta_to_us(punchlist[i-1][1].punchtime
+                                        - orig_punchlist[control_pos-1][1].punchtime)
+                    punchlist.append(('ok', ShiftedPunch(orig_punchlist[control_pos][1], shift)))
                 elif orig_punchlist[control_pos][0] == 'missing':
                     # punch to be reordered is missing, after reordering it's still missing ;-)
                     punchlist.append(('missing', orig_punchlist[control_pos][1]))
@@ -812,7 +1230,7 @@ class SequenceCourseValidator(CourseValidator):
                     # reordering needed, but not possible due to missing previous punch
                     punchlist.append(('missing', orig_punchlist[control_pos][1].sistation.control))
 
-            result['reordered_punchlist'] = punchlist
+            result['reordered_punchlist'] = PunchList(punchlist)
 
         self._to_cache(self.validate, run, result)
         return result
@@ -930,7 +1348,7 @@ class RelayScoreing(AbstractRelayScoreing):
 
         from .runner import RunnerException
 
-        result = {'override':False}
+        result = ValidationResult(override=False)
         # check for override
         if team.override is not None:
             result['status'] = team.override
@@ -1071,8 +1489,7 @@ class RelayScoreing(AbstractRelayScoreing):
         # if not valid:
         #     time = timedelta(0)
 
-        result = {'score': time,
-                  'runs':  runs}
+        result = ScoreingResult(score=time, runs=runs)
 
         self._to_cache(self.score, team, result)
         return result
@@ -1211,9 +1628,9 @@ class Relay24hScoreing(AbstractRelayScoreing):
                 pool[i].remove(r['course'])
                 remaining_runs.remove(r)
             except ValueError:
-                return {'status': Validator.DISQUALIFIED,
-                        'unfinished pool': self.POOLNAMES[i],
-                        'run': r['course']}
+                return ValidationResult({'status': Validator.DISQUALIFIED,
+                                         'unfinished pool': self.POOLNAMES[i],
+                                         'run': r['course']})
 
 
         # check for proper order of finish courses
@@ -1224,11 +1641,11 @@ class Relay24hScoreing(AbstractRelayScoreing):
                 break
 
             if c != remaining_runs[i]['course']:
-                return {'status': Validator.DISQUALIFIED,
-                        'unfinished pool': self.POOLNAMES[3],
-                        'run': remaining_runs[i]['course']}
+                return ValidationResult({'status': Validator.DISQUALIFIED,
+                                         'unfinished pool': self.POOLNAMES[3],
+                                         'run': remaining_runs[i]['course']})
 
-        return {'status': Validator.OK}
+        return ValidationResult(status=Validator.OK)
 
     def validate(self, team):
         """Validate the runs of this team according to the rules
@@ -1251,7 +1668,7 @@ class Relay24hScoreing(AbstractRelayScoreing):
         except KeyError:
             pass
 
-        result = {'override':False}
+        result = ValidationResult(override=False)
         # check for override
         if team.override is not None:
             result['status'] = team.override
@@ -1333,11 +1750,11 @@ class Relay24hScoreing(AbstractRelayScoreing):
         else:
             raise UnscoreableException("Unknown scoreing method '%s'." % self._method)
 
-        ret = {'score': result,
-               'finishtime': finish_time,
-               'information': {'method': self._method,
-                               'blocks': self._blocks},
-               }
+        ret = ScoreingResult({'score': result,
+                              'finishtime': finish_time,
+                              'information': {'method': self._method,
+                                              'blocks': self._blocks},
+                              })
         self._to_cache(self.score, team, ret)
         return ret
 
@@ -1382,22 +1799,43 @@ class Relay12hScoreing(Relay24hScoreing):
 
 @total_ordering
 class Relay24hScore:
+    """Score of a 24h relay team. The time is stored as integer microseconds
+    and only converted to a timedelta object when accessed."""
+
+    __slots__ = ('runs', '_time')
 
     def __init__(self, runs, time):
+        """
+        @param runs: number of runs (or lkm or speed)
+        @param time: running time
+        @type time:  timedelta or integer microseconds
+        """
         self.runs = runs
-        self.time = time
+        self._time = time if type(time) is int else delta_to_us(time)
+
+    @property
+    def time(self):
+        return us_to_delta(self._time)
+
+    def __getstate__(self):
+        return {'runs': self.runs, 'time': self.time}
+
+    def __setstate__(self, state):
+        # also used for pickles of older versions without slots
+        self.runs = state['runs']
+        self._time = delta_to_us(state['time'])
 
     def __eq__(self, other):
         """compares two Relay24hScore objects for equality."""
 
-        return self.runs == other.runs and self.time == other.time
+        return self.runs == other.runs and self._time == other._time
 
     def __lt__(self, other):
         """compares two Relay24hScore objects for less than."""
 
         if self.runs < other.runs:
             return True
-        elif self.runs == other.runs and self.time > other.time:
+        elif self.runs == other.runs and self._time > other._time:
             return True
         else:
             return False
@@ -1405,13 +1843,13 @@ class Relay24hScore:
     def __sub__(self, other):
         """Subtracts Relay24hScore objects. This is mainly usefull to calculate
         differences between teams."""
-        return Relay24hScore(self.runs - other.runs, self.time - other.time)
+        return Relay24hScore(self.runs - other.runs, self._time - other._time)
 
     def __mul__(self, other):
         """Multiplication of Relay24hScore objects. This is to theoretically allow
         reverse Rankings (behind score multiplied by -1).
         """
-        return Relay24hScore(self.runs * other, self.time * other)
+        return Relay24hScore(self.runs * other, self._time * other)
 
     def __str__(self):
         return "Runs: %s, Time: %s" % (self.runs, self.time)
@@ -1454,7 +1892,7 @@ class ControlPunchtimeScoreing(AbstractScoreing, Validator):
                 result = Validator.OK
                 break
 
-        ret = {'status': result}
+        ret = ValidationResult(status=result)
         self._to_cache(self.validate, run, ret)
         return ret
 
@@ -1486,7 +1924,7 @@ class ControlPunchtimeScoreing(AbstractScoreing, Validator):
             # no punches in this run
             result = datetime.min
 
-        ret = {'score':result}
+        ret = ScoreingResult(score=result)
         self._to_cache(self.score, run, ret)
         return ret
 
@@ -1555,7 +1993,7 @@ class RoundCountScoreing(AbstractScoreing, CourseValidator):
                 result['score'] += 1
                 i = 0
 
-        result['punchlist'] = punchlist
+        result['punchlist'] = PunchList(punchlist)
         self._to_cache(self.validate, run, result)
         return result
 
@@ -0,0 +1,470 @@
+#
+#    Copyright (C) 2008  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+result.py - Compact result records for validation, scoreing and ranking
+            results. The records use __slots__ for the common keys and
+            support dict style access for backwards compatibility.
+            Punchlists are stored as arrays of object ids and integer
+            punch times and are only resolved to Storm objects on access.
+"""
+
+from array import array
+from datetime import datetime, timedelta
+
+from storm.locals import Store, In
+
+# Integer time representation used for time arithmetic in scoreing, rankings
+# and split time analysis. Microseconds keep conversions to and from timedelta
+# objects lossless.
+_MICROSECOND = timedelta(microseconds=1)
+
+def delta_to_us(delta):
+    """
+    @param delta: time difference
+    @type delta:  timedelta
+    @return:      delta in integer microseconds
+    """
+    return delta // _MICROSECOND
+
+def us_to_delta(us):
+    """
+    @param us: time difference in integer microseconds
+    @return:   timedelta object
+    """
+    return timedelta(microseconds=us)
+
+class Result:
+    """Base class for result records. Common keys are stored in slots,
+    all other keys in an additional dict which is only created when needed.
+
+    Records behave like dicts: result['status'], 'status' in result,
+    result.get('status'), iteration over keys and comparison with dicts
+    work as before. The common keys are also available as attributes.
+    """
+
+    __slots__ = ('_extra', )
+
+    # names of the keys stored in slots, set in subclasses
+    _fields = ()
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._fields:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self._fields:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Result, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    # unhashable like the dicts they replace
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self.items()))
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self._extra = None
+        self.update(state)
+
+    def keys(self):
+        keys = [k for k in self._fields if hasattr(self, k)]
+        if self._extra is not None:
+            keys.extend(self._extra)
+        return keys
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def copy(self):
+        return type(self)(self.items())
+
+class ValidationResult(Result):
+    """Result of a Validator.
+    Common keys: 'status', 'override', 'punchlist', 'reordered_punchlist'
+    """
+
+    __slots__ = ('status', 'override', 'punchlist', 'reordered_punchlist')
+    _fields = __slots__
+
+class ScoreingResult(Result):
+    """Result of a scoreing strategy.
+    Common keys: 'score', 'start', 'finish', 'behind'
+
+    Time scores (timedelta objects) are stored as integer microseconds in
+    the time and behind_time attributes. Rankings sort and compute behind
+    times on these integers. They are only converted back to timedelta
+    objects when 'score' or 'behind' is accessed. Other scores (e.g.
+    Relay24hScore objects) are stored as they are and time is None.
+    """
+
+    __slots__ = ('_score', 'time', '_behind', 'behind_time', 'start', 'finish')
+    _fields = ('score', 'start', 'finish', 'behind')
+
+    def __init__(self, *args, **kwargs):
+        self.time = None
+        self.behind_time = None
+        Result.__init__(self, *args, **kwargs)
+
+    def _get_score(self):
+        if self.time is not None:
+            return us_to_delta(self.time)
+        return self._score
+
+    def _set_score(self, score):
+        if type(score) is timedelta:
+            self.time = delta_to_us(score)
+            try:
+                del self._score
+            except AttributeError:
+                pass
+        else:
+            self.time = None
+            self._score = score
+    score = property(_get_score, _set_score)
+
+    def _get_behind(self):
+        if self.behind_time is not None:
+            return us_to_delta(self.behind_time)
+        return self._behind
+
+    def _set_behind(self, behind):
+        if type(behind) is timedelta:
+            self.behind_time = delta_to_us(behind)
+            try:
+                del self._behind
+            except AttributeError:
+                pass
+        else:
+            self.behind_time = None
+            self._behind = behind
+    behind = property(_get_behind, _set_behind)
+
+    def __setstate__(self, state):
+        self.time = None
+        self.behind_time = None
+        Result.__setstate__(self, state)
+
+class RankingEntry(Result):
+    """Entry of a Ranking.
+    Common keys: 'item', 'scoreing', 'validation', 'rank' and 'runs',
+    'splits' for relay rankings.
+    """
+
+    __slots__ = ('item', 'scoreing', 'validation', 'rank', 'runs', 'splits')
+    _fields = __slots__
+
+class PunchList:
+    """Compact list of (status, object) tuples as used in validation
+    results. The objects are punches, controls or SI stations (or
+    shifted punches for reordered courses).
+
+    Only the status, the class and id of each object and the punch time are
+    stored. All objects are looked up in the store with one query per class
+    when an entry is accessed for the first time and are kept from then on.
+    Objects which are not (yet) stored in a store are kept as they are.
+
+    The punch times are available without object lookups through the
+    punchtime method.
+    """
+
+    # Status codes of the punchlist entries
+    STATUS = ['ok', 'missing', 'ignored', 'additional']
+
+    # Classes of the objects in punchlists, extended as needed
+    _classes = []
+
+    # Marker for unknown punch times
+    MISSING = -1
+
+    # punch times are stored as microseconds since this reference time
+    _EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, punchlist=None):
+        """
+        @param punchlist: list of (status, object) tuples
+        """
+        self._store = None
+        self._status = array('b')
+        self._class = array('b')
+        self._ids = array('q')
+        self._times = array('q')
+        self._shifts = None
+        self._objects = None
+        # resolved objects, None until the first access
+        self._resolved = None
+        if punchlist is not None:
+            self.extend(punchlist)
+
+    @staticmethod
+    def _index(values, value):
+        try:
+            return values.index(value)
+        except ValueError:
+            values.append(value)
+            return len(values) - 1
+
+    def _encode(self, entry):
+        """Encode a (status, object) tuple.
+        @return: tuple (status, class, id, time, shift, object)
+                 object is None if it can be looked up in the store
+        """
+        from .run import ShiftedPunch
+
+        status, obj = entry
+        status = PunchList._index(PunchList.STATUS, status)
+
+        shift = 0
+        punch = obj
+        if isinstance(obj, ShiftedPunch):
+            punch = obj._punch
+            shift = obj.shift
+
+        time = getattr(obj, 'punchtime', None)
+        time = delta_to_us(time - PunchList._EPOCH) if time is not None else PunchList.MISSING
+
+        store = Store.of(punch)
+        if store is None or (self._store is not None and store is not self._store):
+            return (status, -1, -1, time, shift, obj)
+        self._store = store
+
+        ident = getattr(punch, 'id', None)
+        if ident is None:
+            return (status, -1, -1, time, shift, obj)
+
+        return (status, PunchList._index(PunchList._classes, type(punch)),
+                ident, time, shift, None)
+
+    def _set(self, i, values):
+        status, cls, ident, time, shift, obj = values
+        self._status[i] = status
+        self._class[i] = cls
+        self._ids[i] = ident
+        self._times[i] = time
+        if shift != 0:
+            if self._shifts is None:
+                self._shifts = {}
+            self._shifts[i] = shift
+        elif self._shifts is not None:
+            self._shifts.pop(i, None)
+        if obj is not None:
+            if self._objects is None:
+                self._objects = {}
+            self._objects[i] = obj
+        elif self._objects is not None:
+            self._objects.pop(i, None)
+
+    def _unresolved(self):
+        """
+        @return: dict of class index to list of ids of the entries which
+                 must be looked up in the store
+        """
+        ids = {}
+        for i in range(len(self)):
+            if self._objects is None or i not in self._objects:
+                ids.setdefault(self._class[i], []).append(self._ids[i])
+        return ids
+
+    def _fill(self, found):
+        """Set the resolved objects.
+        @param found: dict of (class, id) to object
+        """
+        from .run import ShiftedPunch
+
+        self._resolved = []
+        for i in range(len(self)):
+            if self._objects is not None and i in self._objects:
+                obj = self._objects[i]
+            else:
+                obj = found.get((PunchList._classes[self._class[i]], self._ids[i]))
+                if self._shifts is not None and i in self._shifts:
+                    obj = ShiftedPunch(obj, self._shifts[i])
+            self._resolved.append(obj)
+
+    @staticmethod
+    def _find(store, ids, found):
+        """Look up objects with one query per class.
+        @param ids:   dict of class index to ids
+        @param found: dict (class, id) -> object to add the objects to
+        """
+        for cls, cls_ids in ids.items():
+            cls = PunchList._classes[cls]
+            for obj in store.find(cls, In(cls.id, list(set(cls_ids)))):
+                found[(cls, obj.id)] = obj
+
+    def _resolve_all(self):
+        """Look up the objects of all entries with one query per class."""
+        found = {}
+        PunchList._find(self._store, self._unresolved(), found)
+        self._fill(found)
+
+    @staticmethod
+    def resolve(punchlists):
+        """Look up the objects of many punchlists (e.g. of all runs in a
+        ranking) with one query per class and store instead of one query
+        per class and punchlist.
+        @param punchlists: iterable of PunchList objects, other lists are
+                           ignored
+        """
+        stores = {}
+        for punchlist in punchlists:
+            if (isinstance(punchlist, PunchList) and punchlist._resolved is None
+                and punchlist._store is not None):
+                stores.setdefault(punchlist._store, []).append(punchlist)
+
+        for store, punchlists in stores.items():
+            ids = {}
+            for punchlist in punchlists:
+                for cls, cls_ids in punchlist._unresolved().items():
+                    ids.setdefault(cls, []).extend(cls_ids)
+            found = {}
+            PunchList._find(store, ids, found)
+            for punchlist in punchlists:
+                punchlist._fill(found)
+
+    def _resolve(self, i):
+        """Resolve entry i to a (status, object) tuple."""
+        if self._resolved is None:
+            self._resolve_all()
+        return (PunchList.STATUS[self._status[i]], self._resolved[i])
+
+    def __len__(self):
+        return len(self._status)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._resolve(i) for i in range(len(self))[key]]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('punchlist index out of range')
+        return self._resolve(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._resolve(i)
+
+    def __eq__(self, other):
+        if isinstance(other, (PunchList, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return 'PunchList(%r)' % list(self)
+
+    def append(self, entry):
+        i = len(self)
+        self._status.append(0)
+        self._class.append(0)
+        self._ids.append(0)
+        self._times.append(0)
+        self._set(i, self._encode(entry))
+        if self._resolved is not None:
+            self._resolved.append(entry[1])
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def status(self, i):
+        """
+        @return: status of entry i without looking up the object
+        """
+        return PunchList.STATUS[self._status[i]]
+
+    def punchtime(self, i):
+        """
+        @return: punch time of entry i without looking up the object or None
+                 if the entry has no punch time
+        """
+        time = self._times[i]
+        if time == PunchList.MISSING:
+            return None
+        return PunchList._EPOCH + timedelta(microseconds=time)
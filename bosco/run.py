@@ -23,6 +23,7 @@
 
 from copy import copy
 from datetime import datetime
+from hashlib import sha1
 from storm.locals import *
 from storm.exceptions import NoStoreError
 from storm.expr import Column, Func, LeftJoin
@@ -32,6 +33,7 @@ from .base import MyStorm
 from .course import SIStation, Course, Control
 from .runner import SICard
 from .ranking import RankableItem, ValidationError, UnscoreableException
+from .result import us_to_delta
 
 class Punch(Storm):
     __storm_table__ = 'punch'
@@ -68,13 +70,17 @@ class ShiftedPunch:
     part of a course wrapped by a ReorderedCourseWrapper.
     """
 
-    def __init__(self, punch, timeshift):
+    def __init__(self, punch, shift):
+        """
+        @param punch: wrapped punch
+        @param shift: time shift in integer microseconds
+        """
         self._punch = punch
-        self._shift = timeshift
+        self.shift = shift
 
     def __getattr__(self, attr):
         if attr == 'punchtime':
-            return self._punch.punchtime + self._shift
+            return self._punch.punchtime + us_to_delta(self.shift)
         else:
             return getattr(self._punch, attr)
 
@@ -104,6 +110,8 @@ class Run(MyStorm, RankableItem):
     check_time = DateTime()
     clear_time = DateTime()
     readout_time = DateTime()
+    # fingerprint of the card data this run was read from, see card_fingerprint
+    fingerprint = Unicode()
     punches = ReferenceSet(id, 'Punch._run_id')
 
     
@@ -160,6 +168,21 @@ class Run(MyStorm, RankableItem):
         
         self.add_punchlist(punches)
 
+    @staticmethod
+    def card_fingerprint(card_data):
+        """Compute the fingerprint of the data read from an SI-Card. Reading
+        the same card again results in the same fingerprint, so runs which
+        were already read can be found without loading their punches.
+        @param card_data: dict with the keys card_number, start, finish,
+                          check, clear and punches as returned by
+                          SIReaderReadout.read_sicard
+        @return:          hex digest of the card data
+        """
+        values = [card_data['card_number'], card_data['start'],
+                  card_data['finish'], card_data['check'], card_data['clear']]
+        values.extend(v for punch in card_data['punches'] for v in punch)
+        return sha1('|'.join(str(v) for v in values).encode('ascii')).hexdigest()
+
     def __str__(self):
         runner = self.sicard.runner
         if runner is not None:
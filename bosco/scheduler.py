@@ -0,0 +1,214 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+scheduler.py - Scheduling of ranking refreshes. Changed rankings are kept
+               in a dirty set and refreshed by priority while respecting
+               minimum and maximum refresh intervals.
+"""
+
+from threading import Condition
+from time import monotonic
+
+class _Entry:
+    """Scheduling state of one ranking."""
+
+    __slots__ = ('key', 'min_interval', 'max_interval', 'shown',
+                 'last_refresh', 'dirty_since', 'last_change')
+
+    def __init__(self, key, min_interval, max_interval, shown):
+        self.key = key
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.shown = shown
+        self.last_refresh = None
+        self.dirty_since = None
+        self.last_change = None
+
+class RefreshScheduler:
+    """Decides which rankings to refresh next.
+
+    Rankings are marked dirty when they change (usually by an observer
+    notification). A dirty ranking is due when its minimum refresh interval
+    has passed since its last refresh. A ranking which did not change is
+    due again after its maximum refresh interval (if set).
+
+    Due rankings are returned in order of priority: rankings currently
+    shown on displays first, then rankings by the time of their last
+    change (most recent first) and finally periodic refreshes of unchanged
+    rankings. If the number of rankings per refresh is limited, the
+    remaining rankings are deferred, but rankings which are dirty for more
+    than max_latency seconds are always returned. No change waits longer
+    than max_latency seconds.
+
+    Notifications may arrive from other threads (e.g. the observer timer
+    thread), all methods are thread safe.
+    """
+
+    def __init__(self, min_interval=10, max_interval=None, max_latency=60,
+                 batch=None, clock=monotonic):
+        """
+        @param min_interval: default minimum time in seconds between two
+                             refreshes of a ranking
+        @param max_interval: default maximum time in seconds between two
+                             refreshes of a ranking, None to only refresh
+                             changed rankings
+        @param max_latency:  maximum time in seconds between a change and
+                             the refresh of the ranking
+        @param batch:        maximum number of rankings returned by pop_due,
+                             None for no limit
+        @param clock:        function returning the current time in seconds
+        """
+        if min_interval > max_latency:
+            raise ValueError('Minimum refresh interval is greater than the maximum latency.')
+
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._max_latency = max_latency
+        self._batch = batch
+        self._clock = clock
+        self._entries = {}
+        self._condition = Condition()
+
+    def add(self, key, min_interval=None, max_interval=None, shown=False):
+        """Add a ranking. New rankings are dirty.
+        @param key:          key of the ranking, e.g. the description as
+                             returned by Event.list_rankings
+        @param min_interval: minimum refresh interval of this ranking,
+                             defaults to the scheduler's setting
+        @param max_interval: maximum refresh interval of this ranking,
+                             defaults to the scheduler's setting
+        @param shown:        is this ranking currently shown on a display?
+        """
+        if min_interval is None:
+            min_interval = self._min_interval
+        if max_interval is None:
+            max_interval = self._max_interval
+        if min_interval > self._max_latency:
+            raise ValueError('Minimum refresh interval is greater than the maximum latency.')
+
+        with self._condition:
+            self._entries[key] = _Entry(key, min_interval, max_interval, shown)
+            self._mark_dirty(self._entries[key], self._clock())
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    def _mark_dirty(self, entry, now):
+        if entry.dirty_since is None:
+            entry.dirty_since = now
+        entry.last_change = now
+        self._condition.notify_all()
+
+    def mark_dirty(self, key):
+        """Mark a ranking as changed.
+        @raises: KeyError if the ranking was not added
+        """
+        with self._condition:
+            self._mark_dirty(self._entries[key], self._clock())
+
+    def set_shown(self, key, shown=True):
+        """Set whether a ranking is currently shown on a display. Shown
+        rankings are refreshed first.
+        @raises: KeyError if the ranking was not added
+        """
+        with self._condition:
+            self._entries[key].shown = shown
+
+    def _due_at(self, entry):
+        """
+        @return: time when entry is due or None if it is never due
+        """
+        if entry.dirty_since is not None:
+            if entry.last_refresh is None:
+                return entry.dirty_since
+            return max(entry.last_refresh + entry.min_interval, entry.dirty_since)
+        if entry.max_interval is not None and entry.last_refresh is not None:
+            return entry.last_refresh + entry.max_interval
+        return None
+
+    def _priority(self, entry, now):
+        """
+        @return: sort key, lowest first
+        """
+        if entry.dirty_since is None:
+            # periodic refresh
+            return (3, 0, entry.last_refresh)
+        if entry.dirty_since + self._max_latency <= now:
+            # overdue, oldest change first
+            return (0, 0, entry.dirty_since)
+        return (entry.shown and 1 or 2, -entry.last_change, entry.dirty_since)
+
+    def pop_due(self, now=None):
+        """Return the rankings to refresh now. Their dirty state is cleared
+        and their refresh time is set to now. Changes which arrive while
+        the rankings are refreshed mark them dirty again.
+        @param now: current time, defaults to clock()
+        @return:    list of keys in order of priority
+        """
+        with self._condition:
+            if now is None:
+                now = self._clock()
+
+            due = []
+            for entry in self._entries.values():
+                due_at = self._due_at(entry)
+                if due_at is not None and due_at <= now:
+                    due.append((self._priority(entry, now), entry))
+            due.sort(key=lambda d: d[0])
+
+            if self._batch is not None:
+                # overdue rankings are never deferred
+                due = [d for i, d in enumerate(due)
+                       if i < self._batch or d[0][0] == 0]
+
+            for priority, entry in due:
+                entry.dirty_since = None
+                entry.last_refresh = now
+            return [entry.key for priority, entry in due]
+
+    def next_due(self, now=None):
+        """
+        @param now: current time, defaults to clock()
+        @return:    seconds until the next ranking is due, 0 if a ranking is
+                    due now or None if no ranking will be due without
+                    further changes
+        """
+        with self._condition:
+            if now is None:
+                now = self._clock()
+            times = [t for t in [self._due_at(e) for e in self._entries.values()]
+                     if t is not None]
+            if len(times) == 0:
+                return None
+            return max(min(times) - now, 0)
+
+    def wait(self, timeout=None):
+        """Wait until a ranking is due or until timeout seconds passed.
+        @return: True if a ranking is due
+        """
+        with self._condition:
+            while True:
+                delay = self.next_due()
+                if delay == 0:
+                    return True
+                if timeout is not None:
+                    if timeout <= 0:
+                        return False
+                    delay = delay is None and timeout or min(delay, timeout)
+                start = self._clock()
+                self._condition.wait(delay)
+                if timeout is not None:
+                    timeout -= self._clock() - start
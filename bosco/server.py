@@ -0,0 +1,242 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+server.py - Live results HTTP server. Rendered pages are served from memory,
+            the server never accesses the database.
+"""
+
+import asyncio
+import gzip
+import json
+
+from email.utils import formatdate
+from hashlib import sha1
+from mimetypes import guess_type
+
+def accepts_gzip(accept_encoding):
+    """
+    @param accept_encoding: value of the Accept-Encoding header
+    @return:                True if the client accepts gzip compressed content
+    """
+    qvalues = {}
+    for coding in accept_encoding.split(','):
+        name, *params = coding.split(';')
+        q = 1.0
+        for param in params:
+            key, sep, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[name.strip().lower()] = q
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qvalues:
+            return qvalues[name] > 0
+    return False
+
+class Page:
+    """Rendered page with precomputed ETag and gzip compressed content."""
+
+    __slots__ = ('content', 'gzip', 'etag', 'content_type')
+
+    def __init__(self, filename, content):
+        """
+        @param content: encoded content (bytes)
+        """
+        self.content = content
+        self.gzip = gzip.compress(content)
+        self.etag = '"%s"' % sha1(content).hexdigest()
+        self.content_type = guess_type(filename)[0] or 'application/octet-stream'
+
+class LiveServer:
+    """Minimal HTTP/1.1 server for live results.
+
+    Pages are published with publish (e.g. by a thread computing the
+    rankings) and kept in memory. Clients can revalidate pages with
+    If-None-Match and receive gzip compressed content if they accept it.
+    Clients connected to /events receive a server-sent event for every
+    published ranking. Only GET and HEAD requests are supported.
+    """
+
+    EVENTS = '/events'
+
+    # seconds between keep alive comments on event streams
+    keepalive = 15
+    # maximum number of pending events of a client, event streams of slow
+    # clients are closed (browsers reconnect automatically)
+    queue_size = 100
+
+    def __init__(self, host='localhost', port=8080, charset='utf-8'):
+        """
+        @param charset: charset of the published text pages
+        """
+        self._host = host
+        self._port = port
+        self._charset = charset
+        self._pages = {}
+        self._listeners = set()
+        self._loop = None
+        self._server = None
+
+    @property
+    def port(self):
+        """Port of the running server (useful if started on port 0)."""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self._host,
+                                                  self._port)
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    def close(self):
+        self._server.close()
+
+    def publish(self, files, ranking=None):
+        """Publish pages. This method may be called from any thread after the
+        server was started.
+        @param files:   list of (file name, encoded content) tuples as
+                        returned by bosco.export.render_ranking
+        @param ranking: description of the ranking to announce to event
+                        stream clients, None to not send an event
+        """
+        pages = [(filename, Page(filename, content))
+                 for filename, content in files]
+        self._loop.call_soon_threadsafe(self._publish, pages, ranking)
+
+    def _publish(self, pages, ranking):
+        changed = []
+        for filename, page in pages:
+            old = self._pages.get(filename)
+            if old is None or old.etag != page.etag:
+                self._pages[filename] = page
+                changed.append(filename)
+        if ranking is not None and len(changed) > 0:
+            data = json.dumps({'ranking': ranking, 'files': changed})
+            for queue in self._listeners:
+                try:
+                    queue.put_nowait(data)
+                except asyncio.QueueFull:
+                    # the client does not read its events, close the stream
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, sep, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = request.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, close=True)
+                    break
+                close = (headers.get('connection', '').lower() == 'close'
+                         or version == 'HTTP/1.0')
+                path = target.split('?', 1)[0]
+
+                if method not in ('GET', 'HEAD'):
+                    await self._respond(writer, 405, close=close,
+                                        headers=[('Allow', 'GET, HEAD')])
+                elif path == self.EVENTS and method == 'GET':
+                    await self._events(writer)
+                    break
+                else:
+                    await self._page(writer, path, headers, method == 'HEAD',
+                                     close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, headers=(), body=b'',
+                       head=False, close=False):
+        reasons = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request',
+                   404: 'Not Found', 405: 'Method Not Allowed'}
+        lines = ['HTTP/1.1 %d %s' % (status, reasons[status]),
+                 'Date: %s' % formatdate(usegmt=True),
+                 'Content-Length: %d' % len(body)]
+        lines.extend('%s: %s' % h for h in headers)
+        if close:
+            lines.append('Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def _page(self, writer, path, headers, head, close):
+        filename = path.lstrip('/') or 'index.html'
+        page = self._pages.get(filename)
+        if page is None:
+            await self._respond(writer, 404, head=head, close=close)
+            return
+
+        response = [('ETag', page.etag),
+                    ('Cache-Control', 'no-cache'),
+                    ('Vary', 'Accept-Encoding')]
+        etags = [e.strip() for e in headers.get('if-none-match', '').split(',')]
+        if page.etag in etags or '*' in etags:
+            await self._respond(writer, 304, response, close=close)
+            return
+
+        content_type = page.content_type
+        if content_type.startswith('text/'):
+            content_type += '; charset=%s' % self._charset
+        response.append(('Content-Type', content_type))
+        if accepts_gzip(headers.get('accept-encoding', '')):
+            response.append(('Content-Encoding', 'gzip'))
+            body = page.gzip
+        else:
+            body = page.content
+        await self._respond(writer, 200, response, body, head, close)
+
+    async def _events(self, writer):
+        """Send a server-sent event for every published ranking until the
+        client disconnects or falls behind by more than queue_size events."""
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
+        await writer.drain()
+        queue = asyncio.Queue(self.queue_size)
+        self._listeners.add(queue)
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(queue.get(), self.keepalive)
+                    if data is None:
+                        break
+                    writer.write(('event: ranking\ndata: %s\n\n' % data).encode('utf-8'))
+                except asyncio.TimeoutError:
+                    writer.write(b': keepalive\n\n')
+                await writer.drain()
+        finally:
+            self._listeners.discard(queue)
@@ -0,0 +1,271 @@
+#
+#    Copyright (C) 2008  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+splits.py - Split time analysis for course rankings. The split times of all
+            runs of a course ranking are collected into a runs x controls
+            matrix of integer times. Split ranks, best splits and time loss
+            estimates are computed column by column on this matrix. The
+            matrix uses stdlib arrays and plain Python loops, there is no
+            dependency on an array library like numpy.
+"""
+
+from array import array
+
+from .ranking import delta_to_us, us_to_delta
+from .result import PunchList
+
+class SplitTimes:
+    """Split time matrix for a ranking of a Course or CombinedCourse.
+
+    Every row corresponds to a run in ranking order. The columns are the
+    controls of the course followed by the finish. All times are integer
+    microseconds. Times of missing punches are set to SplitTimes.MISSING.
+
+    For combined courses (e.g. relay legs with forkings) the controls of
+    the same column may differ between runs. Splits are only compared
+    between runs which ran the same leg (same previous and same current
+    control).
+
+    Like rankings split times are lazily computed, but not updated unless
+    you either call the update method or iterate over them. The split times
+    use the current entries of the ranking, the ranking itself is only
+    computed if it is not yet initialized. Update the ranking first to get
+    split times of the latest results.
+    """
+
+    MISSING = -1
+    FINISH = 'finish'
+    START = 'start'
+
+    def __init__(self, ranking):
+        """
+        @param ranking: ranking of a Course or CombinedCourse
+        @type ranking:  object of class Ranking
+        """
+        self._ranking = ranking
+        self._initialized = False
+
+    def __iter__(self):
+        self.update()
+        return (self._row(i) for i in range(len(self.runs)))
+
+    def __len__(self):
+        if not self._initialized:
+            self.update()
+        return len(self.runs)
+
+    def info(self, item):
+        """
+        @param item: run in the ranking
+        @return:     split information for this run
+        @see:        _row
+        """
+        if not self._initialized:
+            self.update()
+
+        try:
+            return self._row(self._index[item])
+        except KeyError:
+            raise KeyError('%s not in split times.' % item)
+
+    def update(self):
+        """Recompute the split time matrix from the entries of the ranking."""
+
+        self.runs = []
+        self.legs = []
+        self.cumulative = []
+        self._courses = {}
+
+        # slicing does not update an initialized ranking
+        for entry in self._ranking[:]:
+            codes, cumulative = self._row_times(entry)
+            self.runs.append(entry)
+            self.legs.append(list(zip([SplitTimes.START] + codes[:-1], codes)))
+            self.cumulative.append(cumulative)
+
+        self.columns = max([len(c) for c in self.cumulative] or [0])
+        for i, row in enumerate(self.cumulative):
+            if len(row) < self.columns:
+                # pad shorter variants, the finish stays in the last column
+                padding = self.columns - len(row)
+                self.cumulative[i] = (row[:-1] + array('q', [SplitTimes.MISSING]) * padding
+                                      + row[-1:])
+                self.legs[i] = (self.legs[i][:-1] + [None] * padding
+                                + self.legs[i][-1:])
+
+        self.split = [self._splits(row) for row in self.cumulative]
+        self._column_groups = [self._groups(j) for j in range(self.columns)]
+        self.split_rank, self.best = self._rank_columns(self.split)
+        self.cumulative_rank, dummy = self._rank_columns(self.cumulative)
+        self.time_lost = self._time_lost()
+
+        self._index = dict([(entry['item'], i) for i, entry in enumerate(self.runs)])
+        self._initialized = True
+
+    def _controls(self, course):
+        """Control codes of a course. Cached per course as computing the
+        control list needs several database queries."""
+        if course not in self._courses:
+            self._courses[course] = [c.code for c in course.controllist()]
+        return self._courses[course]
+
+    def _row_times(self, entry):
+        """Compute the cumulative times of a ranking entry.
+        @return: (list of column codes, array of cumulative times)
+        """
+        validation = entry['validation']
+        scoreing = entry['scoreing']
+
+        try:
+            punchlist = validation['reordered_punchlist']
+            reordered = True
+        except KeyError:
+            punchlist = validation.get('punchlist', [])
+            reordered = False
+
+        if not isinstance(punchlist, PunchList):
+            punchlist = PunchList(punchlist)
+
+        # status and punch times are available without object lookups
+        controls = [i for i in range(len(punchlist))
+                    if punchlist.status(i) in ('ok', 'missing')]
+
+        course = getattr(entry['item'], 'course', None)
+        if not reordered and course is not None and len(self._controls(course)) == len(controls):
+            codes = list(self._controls(course))
+        else:
+            codes = [status == 'missing' and p.code or p.sistation.control.code
+                     for status, p in [punchlist[i] for i in controls]]
+        codes.append(SplitTimes.FINISH)
+
+        start = scoreing.get('start', None)
+        finish = scoreing.get('finish', None)
+        times = [punchlist.status(i) == 'ok' and punchlist.punchtime(i) or None
+                 for i in controls]
+        times.append(finish)
+
+        cumulative = array('q', [SplitTimes.MISSING]) * len(times)
+        if start is not None:
+            for i, t in enumerate(times):
+                if t is not None and t >= start:
+                    cumulative[i] = delta_to_us(t - start)
+
+        return codes, cumulative
+
+    @staticmethod
+    def _splits(cumulative):
+        """Compute split times from cumulative times. A split is only known
+        if both adjacent punches are known."""
+        previous = array('q', [0]) + cumulative[:-1]
+        return array('q', [c - p if c >= 0 and p >= 0 else SplitTimes.MISSING
+                           for c, p in zip(cumulative, previous)])
+
+    def _groups(self, column):
+        """Group the rows of a column by the leg run."""
+        groups = {}
+        for i, legs in enumerate(self.legs):
+            groups.setdefault(legs[column], []).append(i)
+        return groups
+
+    def _rank_columns(self, matrix):
+        """Rank all columns of a matrix. Equal times get the same rank.
+        @return: (list of rank arrays, dict of best times keyed by
+                 (column, leg))
+        """
+        ranks = [array('l', [0]) * self.columns for row in matrix]
+        best = {}
+        for j in range(self.columns):
+            for leg, rows in self._column_groups[j].items():
+                if leg is None:
+                    continue
+                column = sorted([(matrix[i][j], i) for i in rows
+                                 if matrix[i][j] != SplitTimes.MISSING])
+                if len(column) == 0:
+                    continue
+                best[(j, leg)] = column[0][0]
+                rank = 1
+                for k, (time, i) in enumerate(column):
+                    if k > 0 and time > column[k-1][0]:
+                        rank = k + 1
+                    ranks[i][j] = rank
+        return ranks, best
+
+    def _time_lost(self):
+        """Estimate the time lost on each split. The expected split time of
+        a run is the best split scaled by the median ratio between the
+        splits of this run and the best splits."""
+        lost = []
+        for i, row in enumerate(self.split):
+            best = [self.best.get((j, self.legs[i][j]), 0) for j in range(self.columns)]
+            ratios = sorted([s / b for s, b in zip(row, best)
+                             if s != SplitTimes.MISSING and b > 0])
+            lost_row = array('q', [SplitTimes.MISSING]) * self.columns
+            if len(ratios) > 0:
+                index = ratios[len(ratios) // 2]
+                for j, (s, b) in enumerate(zip(row, best)):
+                    if s != SplitTimes.MISSING:
+                        lost_row[j] = max(0, s - int(round(b * index)))
+            lost.append(lost_row)
+        return lost
+
+    def best_split(self, row, column):
+        """
+        @return: best split time for the leg of this row at this column or
+                 None if unknown
+        """
+        if not self._initialized:
+            self.update()
+
+        try:
+            return us_to_delta(self.best[(column, self.legs[row][column])])
+        except KeyError:
+            return None
+
+    def _row(self, i):
+        """
+        @return: dict with the following keys:
+                 * item:   the run
+                 * entry:  the ranking entry of the run
+                 * splits: list of dicts for each column with the keys 'code',
+                   'cumulative', 'cumulative_rank', 'split', 'split_rank',
+                   'behind' (behind the best split) and 'lost'. Times are
+                   timedelta objects or None if unknown, ranks are None if
+                   unknown.
+        """
+
+        def delta(us):
+            return us_to_delta(us) if us != SplitTimes.MISSING else None
+
+        splits = []
+        for j in range(self.columns):
+            leg = self.legs[i][j]
+            split = self.split[i][j]
+            best = self.best.get((j, leg), None)
+            splits.append({
+                'code':            leg and leg[1] or None,
+                'cumulative':      delta(self.cumulative[i][j]),
+                'cumulative_rank': self.cumulative_rank[i][j] or None,
+                'split':           delta(split),
+                'split_rank':      self.split_rank[i][j] or None,
+                'behind':          (us_to_delta(split - best)
+                                    if split != SplitTimes.MISSING and best is not None
+                                    else None),
+                'lost':            delta(self.time_lost[i][j]),
+            })
+
+        return {'item':   self.runs[i]['item'],
+                'entry':  self.runs[i],
+                'splits': splits}
@@ -0,0 +1,168 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+fakestation.py - Fake SI stations for tests and benchmarks without
+                 SportIdent hardware. Stations in autosend mode are
+                 connected to pseudo terminals, readout stations replace
+                 sireader.SIReaderReadout.
+"""
+
+import os
+import pty
+import tty
+
+from copy import deepcopy
+from datetime import datetime, timedelta
+from random import Random
+
+from sireader import SIReader
+
+from bosco.course import Course
+from bosco.ingest import encode_frame
+
+def encode_cardnr(cardnr):
+    """Encode a card number like SI stations (see SIReader._decode_cardnr)."""
+    if cardnr < 500000:
+        # SI5 card: series and number within the series
+        return b'\x00' + bytes([cardnr // 100000]) + SIReader._to_str(cardnr % 100000, 2)
+    return b'\x00' + SIReader._to_str(cardnr, 3)
+
+def encode_time(punchtime):
+    """Encode the 12 hour time of punchtime like SI stations."""
+    return SIReader._to_str((punchtime.hour % 12) * 3600 + punchtime.minute * 60
+                            + punchtime.second, 2)
+
+class FakeStation:
+    """SI station in autosend mode. The station is connected to a pseudo
+    terminal, programs read the punches from the serial port port."""
+
+    def __init__(self, code):
+        """
+        @param code: station code
+        """
+        self.code = code
+        self._master, self._slave = pty.openpty()
+        # no line discipline, ETX is ^C
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._offset = 0
+
+    def punch(self, cardnr, punchtime, lost=0):
+        """Send a punch.
+        @param lost: number of punches lost before this punch, the backup
+                     memory offset is increased accordingly
+        """
+        self._offset += lost * SIReader.REC_LEN
+        record = (encode_cardnr(cardnr) + b'\x00' + encode_time(punchtime)
+                  + b'\x00' + SIReader._to_str(self._offset, 3))
+        self._offset += SIReader.REC_LEN
+        self.send(encode_frame(SIReader.C_TRANS_REC, self.code, record))
+
+    def send(self, data):
+        """Send raw bytes to the serial port."""
+        os.write(self._master, data)
+
+    def close(self):
+        os.close(self._master)
+        os.close(self._slave)
+
+class FakeReadout:
+    """SI station in readout mode with the interface of
+    sireader.SIReaderReadout used by bosco. The cards are inserted one
+    after the other, a card is removed as soon as it is acknowledged.
+    Reading a card takes no time.
+    """
+
+    def __init__(self, cards, port='fake'):
+        """
+        @param cards: iterable of card data dicts like returned by
+                      SIReaderReadout.read_sicard, e.g. from
+                      SIRunImporter.card_data or synthetic_cards
+        """
+        self._cards = iter(cards)
+        self._card = None
+        self.port = port
+        self.baudrate = 38400
+        self.proto_config = {'ext_proto': True, 'auto_send': False,
+                             'handshake': True, 'pw_access': False,
+                             'punch_read': False, 'mode': SIReader.M_READOUT}
+        self.sicard = None
+        self._acked = False
+        # card numbers of the acknowledged cards
+        self.acked = []
+        # True when all cards were read
+        self.empty = False
+
+    def poll_sicard(self):
+        """
+        @return: True if a card was inserted or removed
+        """
+        if self._card is not None:
+            if self._acked:
+                self._card = None
+                self.sicard = None
+                return True
+            return False
+
+        try:
+            self._card = next(self._cards)
+        except StopIteration:
+            self.empty = True
+            return False
+        self.sicard = self._card['card_number']
+        self._acked = False
+        return True
+
+    def read_sicard(self, reftime=None):
+        # the caller may change the card data (e.g. sort the punches)
+        return deepcopy(self._card)
+
+    def ack_sicard(self):
+        self._acked = True
+        self.acked.append(self.sicard)
+
+    def reconnect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+def synthetic_cards(store, count, first_card=900000,
+                    start=datetime(2008, 4, 14, 19, 0), seed=0):
+    """Generate the card data of runs on the courses in store. Every card
+    has a different card number, courses are used in turn. The runs start
+    every 30 seconds and take 1 to 5 minutes per control.
+    @param count:      number of cards
+    @param first_card: card number of the first card
+    @return:           generator of card data dicts
+    """
+    random = Random(seed)
+    courses = [[c.sistations.any().id for c in course.controllist()]
+               for course in store.find(Course).order_by(Course.code)]
+    courses = [c for c in courses if c]
+    for i in range(count):
+        punchtime = start + timedelta(seconds=30 * i)
+        card = {'card_number': first_card + i,
+                'start': punchtime,
+                'check': None,
+                'clear': None,
+                'punches': []}
+        for station in courses[i % len(courses)]:
+            punchtime += timedelta(seconds=random.randint(60, 300))
+            card['punches'].append((station, punchtime))
+        card['finish'] = punchtime + timedelta(seconds=random.randint(10, 60))
+        yield card
@@ -0,0 +1,295 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+generator.py - Generate synthetic relay events of any size for scaling
+               tests and benchmarks.
+"""
+
+from datetime import datetime, timedelta
+from random import Random
+
+from bosco.course import Control, ControlSequence, Course
+from bosco.run import Run
+from bosco.runner import Category
+
+# tables filled by the generator, in the order they are cleared
+TABLES = ('punch', 'run', 'sicard', 'runner', 'team', 'category',
+          'controlsequence', 'course', 'sistation', 'control')
+
+def clear(store):
+    """Remove all event data from the database and commit."""
+    store.rollback()
+    for table in TABLES:
+        store.execute('TRUNCATE %s CASCADE' % table)
+    store.commit()
+
+class EventGenerator:
+    """Generates a relay event. Every category has the same number of teams
+    and legs, every leg has several variants (forkings) of the same length.
+    The teams run the legs one after the other, each runner with its own
+    SI-Card. With rounds > 1 the teams run the legs several times with the
+    same runners (like in a 24h relay).
+
+    Runs are complete and have their course set like after the readout.
+    Errors are added with the given probability per run:
+      - missing:    a control of the course is not punched
+      - additional: a control of another course is punched
+      - dnf:        the runner gives up after half of the controls and does
+                    not punch the finish
+      - reused:     the runner uses the SI-Card of the previous runner of the
+                    team and has no SI-Card of their own
+
+    Categories and courses are created with the Storm objects, teams,
+    runners, SI-Cards, runs and punches are inserted with bulk SQL. The
+    database must be PostgreSQL.
+    """
+
+    def __init__(self, store, categories=2, teams=50, legs=3, variants=2,
+                 controls=12, pool=100, rounds=1, missing=0.02,
+                 additional=0.05, dnf=0.01, reused=0.01,
+                 starttime=datetime(2014, 6, 1, 9, 0), seed=0):
+        """
+        @param categories: number of categories
+        @param teams:      number of teams per category
+        @param legs:       number of legs per team
+        @param variants:   number of variants per leg
+        @param controls:   number of controls per course
+        @param pool:       number of controls (SI station codes 31 and up)
+        @param rounds:     number of times the teams run all legs, a runner
+                           runs every variant of the leg at most once, so
+                           rounds must not be bigger than variants.
+                           RelayEvent can only score teams with one
+                           round.
+        @param missing, additional, dnf, reused: probability of errors per
+                           run, see the class documentation
+        @param starttime:  mass start of the first leg
+        @param seed:       seed of the random generator, the same arguments
+                           generate the same event
+        """
+        if rounds > variants:
+            raise ValueError('A runner can run a course only once, rounds '
+                             'must not be bigger than variants.')
+        self._store = store
+        self._categories = categories
+        self._teams = teams
+        self._legs = legs
+        self._variants = variants
+        self._controls = controls
+        self._pool = pool
+        self._rounds = rounds
+        self._missing = missing
+        self._additional = additional
+        self._dnf = dnf
+        self._reused = reused
+        self._starttime = starttime
+        self._random = Random(seed)
+        self._courses = {}
+
+    @staticmethod
+    def course_code(category, leg, variant):
+        return '%s%d%s' % (category, leg + 1, chr(ord('A') + variant))
+
+    def category_names(self):
+        return ['C%02d' % (i + 1) for i in range(self._categories)]
+
+    def legs(self):
+        """
+        @return: relay category definitions for RelayEvent
+        """
+        # leg rankings are listed once per leg name, the names must be
+        # unique over all categories
+        return {cat: [{'name': '%s%d' % (cat, leg + 1),
+                       'variants': tuple(self.course_code(cat, leg, v)
+                                         for v in range(self._variants)),
+                       'starttime': self._starttime,
+                       'defaulttime': None}
+                      for leg in range(self._legs)]
+                for cat in self.category_names()}
+
+    def _create_courses(self):
+        """Create the courses. The variants of a leg share the first and
+        the last third of the controls, the middle part is forked.
+        """
+        store = self._store
+        random = self._random
+        controls = [Control(str(31 + i), store=store) for i in range(self._pool)]
+        for c in controls:
+            store.add(c)
+
+        fork = range(self._controls // 3, self._controls - self._controls // 3)
+        for cat in self.category_names():
+            for leg in range(self._legs):
+                common = random.sample(controls, self._controls)
+                for variant in range(self._variants):
+                    sequence = list(common)
+                    forked = random.sample([c for c in controls if c not in common],
+                                           len(fork))
+                    for i, control in zip(fork, forked):
+                        sequence[i] = control
+                    course = store.add(Course(self.course_code(cat, leg, variant),
+                                              length=len(sequence) * 400,
+                                              climb=len(sequence) * 10))
+                    for i, control in enumerate(sequence):
+                        course.sequence.add(ControlSequence(control, i + 1))
+                    self._courses[course.code] = (course, [int(c.code) for c in sequence])
+
+    def _create_teams(self):
+        """Create the teams and runners with bulk SQL.
+        @return: list of (category, list of card numbers of the legs) tuples
+        """
+        store = self._store
+        random = self._random
+        categories = {}
+        for cat_name in self.category_names():
+            categories[cat_name] = store.add(Category(cat_name))
+        store.flush()
+
+        count = len(categories) * self._teams
+        team_ids = self._ids('team', count)
+        runner_ids = self._ids('runner', count * self._legs)
+        teams = []
+        team_rows = []
+        runner_rows = []
+        card_rows = []
+        cardnr = 1000000
+        for cat_name, category in categories.items():
+            for t in range(self._teams):
+                team_id = team_ids[len(team_rows)]
+                number = '%s%03d' % (cat_name, t + 1)
+                name = 'Team %s %d' % (cat_name, t + 1)
+                team_rows.append((team_id, number, name, category.id, True))
+                cards = []
+                for leg in range(self._legs):
+                    runner_id = runner_ids[len(runner_rows)]
+                    # relay runners are members of the team, not of the
+                    # category
+                    runner_rows.append((runner_id, '%s-%d' % (number, leg + 1),
+                                        name, 'Runner %d' % (leg + 1), team_id))
+                    if leg > 0 and random.random() < self._reused:
+                        cards.append(cards[-1])
+                    else:
+                        cardnr += 1
+                        card_rows.append((cardnr, runner_id))
+                        cards.append(cardnr)
+                teams.append((cat_name, cards))
+
+        self._insert('team', ('id', 'number', 'name', 'category', 'official'),
+                     team_rows)
+        self._insert('runner', ('id', 'number', 'given_name', 'surname', 'team'),
+                     runner_rows)
+        self._insert('sicard', ('id', 'runner'), card_rows)
+        return teams
+
+    def _run(self, code, cardnr, start):
+        """Generate the data of a run.
+        @return: tuple (card data dict, time the runner finished or gave up)
+        """
+        random = self._random
+        stations = list(self._courses[code][1])
+        if random.random() < self._missing:
+            del stations[random.randrange(len(stations))]
+        if random.random() < self._additional:
+            other = random.choice(list(self._courses.values()))[1]
+            stations.insert(random.randrange(len(stations) + 1),
+                            random.choice(other))
+        dnf = random.random() < self._dnf
+        if dnf:
+            stations = stations[:len(stations) // 2]
+
+        punchtime = start
+        punches = []
+        for station in stations:
+            punchtime += timedelta(seconds=random.randint(60, 300))
+            punches.append((station, punchtime))
+        finish = None
+        if not dnf:
+            finish = punchtime + timedelta(seconds=random.randint(10, 60))
+        return ({'card_number': cardnr, 'start': start, 'finish': finish,
+                 'check': None, 'clear': None, 'punches': punches},
+                finish or punchtime)
+
+    def generate(self):
+        """Generate the event and commit it to the database.
+        @return: dict with the number of courses, teams, runners, runs and
+                 punches generated
+        """
+        store = self._store
+        self._create_courses()
+        teams = self._create_teams()
+        course_ids = {code: c.id for code, (c, s) in self._courses.items()}
+
+        count = 0
+        punches = 0
+        runs = []
+        for t, (cat, cards) in enumerate(teams):
+            start = self._starttime
+            for r in range(self._rounds):
+                for leg, cardnr in enumerate(cards):
+                    # the teams run the variants in different orders
+                    variant = (t + leg + r) % self._variants
+                    code = self.course_code(cat, leg, variant)
+                    card_data, start = self._run(code, cardnr, start)
+                    runs.append((course_ids[code], card_data))
+            if len(runs) >= 5000 or t == len(teams) - 1:
+                # insert in parts to limit the memory used for large events
+                punches += self._insert_runs(runs)
+                count += len(runs)
+                runs = []
+
+        store.commit()
+        return {'courses': len(self._courses), 'teams': len(teams),
+                'runners': len(teams) * self._legs, 'runs': count,
+                'punches': punches}
+
+    def _ids(self, table, count):
+        """Allocate count ids of table."""
+        return [row[0] for row in self._store.execute(
+            "SELECT nextval('%s_id_seq') FROM generate_series(1, ?)" % table,
+            (count, ))]
+
+    def _insert_runs(self, runs):
+        """Insert runs and their punches with bulk SQL.
+        @param runs: list of (course id, card data) tuples
+        @return:     number of punches inserted
+        """
+        ids = self._ids('run', len(runs))
+
+        rows = []
+        punches = []
+        for run_id, (course_id, card) in zip(ids, runs):
+            rows.append((run_id, card['card_number'], course_id, True,
+                         card['finish'] or card['punches'][-1][1],
+                         card['start'], card['finish'],
+                         Run.card_fingerprint(card)))
+            for i, (station, punchtime) in enumerate(card['punches']):
+                punches.append((run_id, station, punchtime, i + 1))
+
+        self._insert('run', ('id', 'sicard', 'course', 'complete', 'readout_time',
+                             'card_start_time', 'card_finish_time', 'fingerprint'),
+                     rows)
+        self._insert('punch', ('run', 'sistation', 'card_punchtime', 'sequence'),
+                     punches)
+        return len(punches)
+
+    def _insert(self, table, columns, rows, chunk=1000):
+        """Insert rows with multi row INSERT statements."""
+        row = '(%s)' % ', '.join('?' * len(columns))
+        for i in range(0, len(rows), chunk):
+            part = rows[i:i+chunk]
+            self._store.execute('INSERT INTO %s (%s) VALUES %s'
+                                % (table, ', '.join(columns), ', '.join([row] * len(part))),
+                                [v for r in part for v in r], noresult=True)
@@ -659,7 +659,8 @@ CREATE TABLE run (
     manual_finish_time timestamp without time zone,
     manual_start_time timestamp without time zone,
     card_start_time timestamp without time zone,
-    card_finish_time timestamp without time zone
+    card_finish_time timestamp without time zone,
+    fingerprint character varying(40)
 );
 
 
@@ -3361,6 +3362,13 @@ CREATE UNIQUE INDEX idx_code3_country ON country USING btree (code3);
 CREATE UNIQUE INDEX idx_code_course ON course USING btree (code);
 
 
+--
+-- Name: idx_fingerprint_run; Type: INDEX; Schema: public; Owner: gaudenz; Tablespace: 
+--
+
+CREATE INDEX idx_fingerprint_run ON run USING btree (fingerprint);
+
+
 --
 -- Name: idx_name_category; Type: INDEX; Schema: public; Owner: gaudenz; Tablespace: 
 --
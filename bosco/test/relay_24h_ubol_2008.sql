@@ -41,6 +41,7 @@ DROP INDEX public.idx_number_runner;
 DROP INDEX public.idx_name_team;
 DROP INDEX public.idx_name_club;
 DROP INDEX public.idx_name_category;
+DROP INDEX public.idx_fingerprint_run;
 DROP INDEX public.idx_code_course;
 DROP INDEX public.idx_code3_country;
 DROP INDEX public.idx_code2_country;
@@ -666,7 +667,8 @@ CREATE TABLE run (
     card_start_time timestamp without time zone,
     manual_finish_time timestamp without time zone,
     check_time timestamp without time zone,
-    clear_time timestamp without time zone
+    clear_time timestamp without time zone,
+    fingerprint character varying(40)
 );
 
 
@@ -87838,6 +87840,13 @@ CREATE UNIQUE INDEX idx_code3_country ON country USING btree (code3);
 CREATE UNIQUE INDEX idx_code_course ON course USING btree (code);
 
 
+--
+-- Name: idx_fingerprint_run; Type: INDEX; Schema: public; Owner: gaudenz; Tablespace: 
+--
+
+CREATE INDEX idx_fingerprint_run ON run USING btree (fingerprint);
+
+
 --
 -- Name: idx_name_category; Type: INDEX; Schema: public; Owner: gaudenz; Tablespace: 
 --
@@ -23,9 +23,17 @@ import os
 import sys
 
 from imp import find_module, load_module
+from importlib.util import module_from_spec, spec_from_file_location
 from optparse import OptionParser
 
-def load_config(name='conf'):
+def load_config(name='conf', new=False):
+    """Load the configuration module from the current directory.
+    @param name: name of the configuration module
+    @param new:  load a new instance of the module instead of (re)loading the
+                 module in sys.modules, e.g. for a thread which needs its own
+                 store and event
+    @return:     the configuration module
+    """
     # Install gettext functions, do this first so that it's available to
     # modules imported from config
     gettext.install('bosco', 'locale')
@@ -38,6 +46,11 @@ def load_config(name='conf'):
         sys.path = oldpath
 
     try:
+        if new:
+            spec = spec_from_file_location(name, pathname)
+            module = module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
         return load_module(name, fp, pathname, description)
     finally:
         if fp:
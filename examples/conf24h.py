@@ -34,6 +34,20 @@ store = Store(create_database(db_uri))
 # Directory with templates
 template_dir = 'templates'
 
+# read SI-Cards in background threads in the run editor, the next card can
+# be read while the previous run is stored
+background_readout = True
+
+# write the data of all SI-Cards read to this file before storing it in the
+# database, SI-Cards can be read while the database is not available
+readout_journal = 'readout.journal'
+
+# timings of the run editor in the Prometheus text format and profiling on
+# SIGUSR1, see bosco.metrics
+metrics_file = None
+metrics_port = None
+profile_dir = None
+
 # create cache (but don't connect to an observer)
 cache = Cache()
 
@@ -0,0 +1,5 @@
+-- Upgrade databases created before runs stored the fingerprint of their
+-- SI-Card data (bosco.run.Run.fingerprint). Run it once on the event
+-- database, e.g. with psql -d <database> -f upgrade_fingerprint.sql
+ALTER TABLE run ADD COLUMN IF NOT EXISTS fingerprint character varying(40);
+CREATE INDEX IF NOT EXISTS idx_fingerprint_run ON run USING btree (fingerprint);
@@ -11,6 +11,7 @@ setup(
     scripts=['bin/autoreader',
              'bin/bosco',
              'bin/import',
+             'bin/live_server',
              'bin/print',
              'bin/ranking_viewer',
              'bin/ranking_export',
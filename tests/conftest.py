@@ -17,6 +17,7 @@ from bosco.event import Relay24hEvent
 from bosco.importer import OCADXMLCourseImporter
 from bosco.importer import SIRunImporter
 from bosco.importer import Team24hImporter
+from bosco.querylog import QueryLog
 from bosco.ranking import Cache
 from bosco.run import Punch
 from bosco.run import Run
@@ -389,3 +390,10 @@ def eventtest(store):
 
     with EventTest(store) as eventtest:
         yield eventtest
+
+
+@pytest.fixture
+def querylog(store):
+
+    with QueryLog(store) as querylog:
+        yield querylog
@@ -0,0 +1,69 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the course index
+"""
+
+from itertools import permutations
+
+import pytest
+
+from bosco.course import Course, CourseIndex
+
+def codes(courses):
+    return [c.code for c in courses]
+
+@pytest.fixture
+def forkings(store):
+    """Courses F0 to F5 with the controls 31, 32 and 33 in all orders."""
+    for i, controls in enumerate(permutations(['31', '32', '33'])):
+        store.add(Course('F%d' % i, length=1000, climb=10)).extend(controls)
+    return store
+
+def test_course_index(testevent):
+    index = CourseIndex(testevent._store)
+
+    # 201 is the second sistation of control 200
+    assert codes(index.candidates([131, 132, 201, 132])) == ['A', 'B', 'C',
+                                                              'D', 'E']
+    ranked = index.rank([131, 132, 201, 132])
+    assert [(m, a, u) for m, a, u, c in ranked] == [(0, 0, 0), (0, 0, 0), (0, 0, 0),
+                                                    (0, 2, 0), (0, 3, 0)]
+
+    # unknown sistations and controls not in any course are ignored,
+    # 131 is missing
+    ranked = index.rank([133, 132, 200, 134, 132])
+    assert ([(m, a, u, testevent._store.get(Course, c).code) for m, a, u, c in ranked]
+            == [(0, 2, 0, 'E'), (1, 0, 1, 'A'), (1, 0, 1, 'B'), (1, 0, 1, 'C'),
+                (1, 2, 1, 'D')])
+
+    assert codes(index.candidates([], limit=2)) == ['E', 'D']
+
+def test_course_index_override(testevent):
+    testevent._c131.override = True
+    index = CourseIndex(testevent._store)
+    assert index.rank([132, 200, 132])[0][:3] == (0, 0, 0)
+
+def test_course_index_order(forkings):
+    """Test that courses with the same controls are ranked by their order."""
+    index = CourseIndex(forkings)
+    assert codes(index.candidates([33, 32, 31], limit=1)) == ['F5']
+    assert codes(index.candidates([31, 32, 33], limit=1)) == ['F0']
+    ranked = index.rank([32, 31, 33])
+    assert [(m, a, u) for m, a, u, c in ranked[:6]] == [(0, 0, 0), (0, 0, 1), (0, 0, 1),
+                                                        (0, 0, 1), (0, 0, 1), (0, 0, 2)]
+    assert forkings.get(Course, ranked[0][3]).code == 'F2'
@@ -19,6 +19,22 @@
 import pytest
 from storm.locals import *
 
+from datetime import datetime
+from itertools import permutations
+from os.path import join, dirname
+from time import sleep
+
+from sireader import SIReaderException
+
+from bosco.course import Course
+from bosco.editor import ReadoutWorker, RunLoader
+from bosco.event import Event
+from bosco.importer import SIRunImporter
+from bosco.journal import Journal
+from bosco.ranking import Cache
+from bosco.run import Run
+from bosco.test.fakestation import FakeReadout
+
 @pytest.mark.parametrize('what', ['id',
                                   'course',
                                   'sicard.id',
@@ -145,3 +161,194 @@ def test_teamfinder(testevent, what):
     testevent._team_finder.set_search_term(str(getattr(t, what)))
     assert (testevent._team_finder._format_result(t)
              in list(testevent._team_finder.get_results()))
+
+def card_data(number, punches):
+    return {'card_number': number,
+            'start': datetime(2008, 3, 19, 8, 20, 32),
+            'finish': datetime(2008, 3, 19, 8, 25, 40),
+            'check': None,
+            'clear': None,
+            'punches': [(s, datetime(2008, 3, 19, 8, 21, i)) for i, s in enumerate(punches)]}
+
+def test_runloader_existing(testevent):
+    """Test that reading a card again loads the existing run"""
+    run = testevent._runs[1]
+    data = {'card_number': 765477,
+            'start': run.card_start_time,
+            'finish': run.card_finish_time,
+            'check': None,
+            'clear': None,
+            'punches': [(p.sistation.id, p.card_punchtime)
+                        for p in run.punches.order_by('card_punchtime')]}
+    loader = RunLoader(testevent._store, Event({}, cache=Cache(), store=testevent._store))
+
+    # the run has no fingerprint yet, the punches are compared
+    assert run.fingerprint is None
+    assert loader.load(data) is run
+    assert run.fingerprint == Run.card_fingerprint(data)
+    assert loader.load(data) is run
+
+def test_runloader_new(testevent):
+    """Test that new runs get the matching course"""
+    loader = RunLoader(testevent._store, Event({}, cache=Cache(), store=testevent._store))
+    run = loader.load(card_data(424242, [131, 132, 201, 132]))
+    assert run.complete
+    assert run.sicard.id == 424242
+    assert run.course.code == 'A'
+    assert run.punches.count() == 4
+
+def test_runloader_forking(testevent):
+    """Test that the course with the punched order is found among courses
+    with the same controls"""
+    for i, controls in enumerate(permutations(['31', '32', '33'])):
+        testevent._store.add(Course('F%d' % i, length=1000, climb=10)).extend(controls)
+    loader = RunLoader(testevent._store, Event({}, cache=Cache(), store=testevent._store))
+    run = loader.load(card_data(424242, [33, 32, 31]))
+    assert run.course.code == 'F5'
+
+CONFIG = """
+from storm.locals import Store, create_database
+from bosco.event import Event
+from bosco.ranking import Cache
+store = Store(create_database('postgres:bosco_test'))
+event = Event({}, cache=Cache(), store=store)
+"""
+
+def test_readout_worker(tmp_path, monkeypatch):
+    """Test that the readout worker stores the runs of all cards read"""
+    (tmp_path / 'readout_conf.py').write_text(CONFIG)
+    monkeypatch.chdir(tmp_path)
+
+    reader = FakeReadout([card_data(1001, [31, 32]), card_data(1002, [31, 33]),
+                         card_data(1001, [31, 32])])
+    worker = ReadoutWorker(reader, 'readout_conf', interval=0.01)
+    store = Store(create_database('postgres:bosco_test'))
+    try:
+        worker.start()
+        runs = []
+        for i in range(500):
+            runs.extend(r[1] for r in worker.results() if r[0] == 'run')
+            if len(runs) == 3:
+                break
+            sleep(0.01)
+        worker.stop()
+
+        assert reader.acked == [1001, 1002, 1001]
+        # the third card is the first card read again
+        assert len(runs) == 3 and runs[0] == runs[2]
+        assert sorted(store.find(Run).values(Run._sicard_id)) == [1001, 1002]
+    finally:
+        worker.stop()
+        for table in ('run', 'punch', 'sicard', 'sistation'):
+            store.execute('TRUNCATE %s CASCADE' % table)
+        store.commit()
+
+def test_readout_worker_journal(tmp_path, monkeypatch):
+    """Test that cards in the journal are stored when the worker starts"""
+    (tmp_path / 'readout_conf.py').write_text(CONFIG)
+    monkeypatch.chdir(tmp_path)
+
+    journal = Journal(str(tmp_path / 'journal'))
+    journal.append('card', card_data(1001, [31, 32]))
+    reader = FakeReadout([card_data(1002, [31, 33])])
+    worker = ReadoutWorker(reader, 'readout_conf', interval=0.01, journal=journal)
+    store = Store(create_database('postgres:bosco_test'))
+    try:
+        worker.start()
+        runs = []
+        for i in range(500):
+            runs.extend(r[1] for r in worker.results() if r[0] == 'run')
+            if len(runs) == 2:
+                break
+            sleep(0.01)
+        worker.stop()
+
+        assert reader.acked == [1002]
+        assert sorted(store.find(Run).values(Run._sicard_id)) == [1001, 1002]
+        assert journal.replay() == []
+    finally:
+        worker.stop()
+        for table in ('run', 'punch', 'sicard', 'sistation'):
+            store.execute('TRUNCATE %s CASCADE' % table)
+        store.commit()
+
+def test_readout_worker_failed(tmp_path, monkeypatch):
+    """Test that a card which could not be stored stays in the journal until
+    the error is acknowledged"""
+    (tmp_path / 'readout_conf.py').write_text(CONFIG)
+    monkeypatch.chdir(tmp_path)
+
+    load = RunLoader.load
+    def failing_load(self, card_data):
+        if card_data['card_number'] == 1001:
+            raise ValueError('broken card')
+        return load(self, card_data)
+    monkeypatch.setattr(RunLoader, 'load', failing_load)
+
+    journal = Journal(str(tmp_path / 'journal'))
+    reader = FakeReadout([card_data(1001, [31, 32]), card_data(1002, [31, 33])])
+    worker = ReadoutWorker(reader, 'readout_conf', interval=0.01, journal=journal)
+    store = Store(create_database('postgres:bosco_test'))
+    try:
+        worker.start()
+        results = []
+        for i in range(500):
+            results.extend(r[0] for r in worker.results())
+            if 'run' in results:
+                break
+            sleep(0.01)
+        worker.stop()
+
+        assert 'failed' in results
+        assert list(store.find(Run).values(Run._sicard_id)) == [1002]
+        assert [d['card_number'] for k, d, o in journal.replay()] == [1001, 1002]
+        worker.acknowledge()
+        assert journal.replay() == []
+    finally:
+        worker.stop()
+        for table in ('run', 'punch', 'sicard', 'sistation'):
+            store.execute('TRUNCATE %s CASCADE' % table)
+        store.commit()
+
+def test_readout_worker_reconnect(tmp_path, monkeypatch):
+    """Test that the worker reports when it stops reading cards"""
+    (tmp_path / 'readout_conf.py').write_text(CONFIG)
+    monkeypatch.chdir(tmp_path)
+
+    reader = FakeReadout([])
+    def broken(*args):
+        raise SIReaderException('disconnected')
+    reader.poll_sicard = broken
+    reader.reconnect = broken
+    worker = ReadoutWorker(reader, 'readout_conf', interval=0.01)
+    try:
+        worker.start()
+        results = []
+        for i in range(500):
+            results.extend(worker.results())
+            if ('stopped', None) in results:
+                break
+            sleep(0.01)
+        assert [r[0] for r in results] == ['error', 'error', 'stopped']
+    finally:
+        worker.stop()
+
+def test_fake_readout():
+    """Test that the fake readout station inserts the cards of a backup file
+    one after the other"""
+    cards = SIRunImporter(join(dirname(__file__), 'import_24h_run.csv')).card_data()
+    assert len(cards) == 286
+    assert cards[0]['card_number'] == 43142
+    assert cards[0]['finish'] == datetime(2008, 4, 14, 19, 6)
+    assert cards[0]['punches'][0] == (131, datetime(2008, 4, 14, 19, 1))
+
+    reader = FakeReadout(cards[:2])
+    assert reader.poll_sicard() and reader.sicard == 43142
+    assert not reader.poll_sicard()
+    assert reader.read_sicard() == cards[0]
+    reader.ack_sicard()
+    assert reader.poll_sicard() and reader.sicard is None
+    assert reader.poll_sicard() and reader.sicard == cards[1]['card_number']
+    reader.ack_sicard()
+    assert reader.poll_sicard() and not reader.poll_sicard()
+    assert reader.empty
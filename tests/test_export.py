@@ -0,0 +1,89 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the ranking export
+"""
+
+import gettext
+import json
+
+from bosco.event import Event
+from bosco.export import render_ranking, ranking_winner, new_leader, render_feed
+from bosco.jsonfeed import JSONFeed
+from bosco.ranking import Validator
+
+def test_render_ranking(testevent):
+    """Test that a course ranking is rendered with all run pages."""
+    # the formatters need the gettext functions installed by load_config
+    gettext.install('bosco', 'locale')
+    header = {'event': 'Test', 'rankings': ['A'], 'organiser': 'OLG',
+              'map': 'Map', 'place': 'Place', 'date': 'today'}
+    event = Event(header, template_dir='bootstrap_templates',
+                  html_template='ranking.html', store=testevent._store)
+    ranking = event.ranking(testevent._course)
+    files, completed = render_ranking(event, 'A', ranking, 'utf-8')
+    assert files[0][0] == 'a.html'
+    assert sorted([f for f, c in files[1:]]) == sorted(['%s.html' % r['item'].id for r in ranking])
+    assert all(isinstance(c, bytes) for f, c in files)
+    assert completed == (ranking.completed_count, ranking.member_count)
+    assert ranking_winner(ranking) is ranking[0]['item']
+    assert ranking.changed.strftime('%c').encode('utf-8') in files[0][1]
+
+    # unchanged rankings are rendered to identical files
+    assert render_ranking(event, 'A', ranking, 'utf-8') == (files, completed)
+
+def test_new_leader(testevent):
+    """Test that the winner of the first export is not reported as new."""
+    ranking = Event({}, store=testevent._store).ranking(testevent._course)
+    versions = {}
+    assert new_leader('A', ranking, versions) is None
+    assert versions == {'A': ranking.version}
+    assert new_leader('A', ranking, versions) is None
+    # unknown version
+    versions['A'] = -1
+    assert new_leader('A', ranking, versions) is None
+    assert versions == {'A': ranking.version}
+
+def test_json_feed(testevent):
+    """Test the JSON snapshot and the NDJSON deltas of a ranking."""
+    ranking = Event({}, store=testevent._store).ranking(testevent._course)
+    feed = JSONFeed()
+    files, appends = render_feed(feed, 'A', ranking)
+    assert [f for f, c in files] == ['a.json']
+    snapshot = json.loads(files[0][1].decode('utf-8'))
+    assert snapshot['version'] == ranking.version
+    assert ([(e['id'], e['rank']) for e in snapshot['entries']]
+            == [(r['item'].id, r['rank']) for r in ranking])
+    assert snapshot['entries'][0]['status'] == 'ok'
+    assert [json.loads(c.decode('utf-8'))['type'] for f, c in appends] == ['reset']
+
+    # unchanged ranking
+    snapshot = files
+    files, appends = render_feed(feed, 'A', ranking)
+    assert files == snapshot
+    assert appends == []
+
+    winner = ranking[0]['item']
+    winner.override = Validator.DISQUALIFIED
+    ranking.update()
+    files, appends = render_feed(feed, 'A', ranking)
+    assert [f for f, c in appends] == ['a.ndjson']
+    delta = json.loads(appends[0][1].decode('utf-8'))
+    assert delta['type'] == 'delta'
+    assert delta['version'] == ranking.version
+    assert winner.id in [c['id'] for c in delta['moved']]
+    assert delta['leader'] == {'type': 'run', 'id': ranking[0]['item'].id}
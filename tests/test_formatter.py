@@ -0,0 +1,66 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the formatters
+"""
+
+import gettext
+import json
+
+from datetime import datetime
+from io import StringIO
+
+import pytest
+
+from bosco.event import Event
+from bosco.formatter import CourseSOLVRankingFormatter, OlanaRankingFormatter
+
+@pytest.fixture
+def ranking(testevent):
+    return Event({}, store=testevent._store).ranking(testevent._course)
+
+def written(formatter):
+    f = StringIO()
+    formatter.write_to(f)
+    return f.getvalue()
+
+@pytest.mark.parametrize('formatter_class', [CourseSOLVRankingFormatter,
+                                             OlanaRankingFormatter])
+def test_solv_write_to(ranking, formatter_class):
+    """Test that streamed and string output are the same."""
+    formatter = formatter_class([ranking, ranking], datetime(2008, 4, 14, 19))
+    output = written(formatter)
+    assert output == str(formatter)
+    assert len(output) > 0
+
+def test_olana_json(ranking):
+    output = written(OlanaRankingFormatter([ranking, ranking],
+                                           datetime(2008, 4, 14, 19)))
+    results = json.loads(output)
+    assert len(results['categories']) == 2
+    assert (len(results['categories'][0]['runners'])
+            == ranking.member_count)
+
+def test_run_write_to(testevent):
+    # the formatters need the gettext functions installed by load_config
+    gettext.install('bosco', 'locale')
+    header = {'event': 'Test', 'rankings': ['A'], 'organiser': 'OLG',
+              'map': 'Map', 'place': 'Place', 'date': 'today'}
+    event = Event(header, template_dir='bootstrap_templates',
+                  store=testevent._store)
+    formatter = event.format_run(testevent._runs[0])
+    assert written(formatter) == str(formatter)
@@ -0,0 +1,105 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the synthetic event generator
+"""
+
+import pytest
+
+from bosco.event import RelayEvent
+from bosco.ranking import Cache, RelayRanking, Validator
+from bosco.run import Run
+from bosco.runner import Team
+from bosco.test.generator import EventGenerator, clear
+
+@pytest.fixture
+def generated(store):
+    yield store
+    clear(store)
+
+def test_generator(generated):
+    generator = EventGenerator(generated, categories=2, teams=5, legs=3,
+                               variants=2, controls=9, rounds=2, missing=0,
+                               additional=0, dnf=0, reused=0)
+    assert generator.generate() == {'courses': 12, 'teams': 10, 'runners': 30,
+                                    'runs': 60, 'punches': 540}
+
+    event = RelayEvent(generator.legs(), cache=Cache(), store=generated)
+    for run in generated.find(Run):
+        assert event.validate(run)['status'] == Validator.OK
+        # no errors, every control is punched once
+        assert run.punches.count() == 9
+
+    team = generated.find(Team, Team.number == 'C01001').one()
+    assert team.members.count() == 3
+    assert len(team.runs) == 6
+
+def test_generator_rankings(generated):
+    generator = EventGenerator(generated, categories=2, teams=5, legs=3,
+                               missing=0, additional=0, dnf=0, reused=0)
+    generator.generate()
+
+    # a leg ranking per leg and a team ranking after every leg
+    event = RelayEvent(generator.legs(), cache=Cache(), store=generated)
+    rankings = event.list_rankings()
+    assert len(rankings) == 2 * 3 * 2
+    for desc, ranking in rankings:
+        ranking.update()
+        assert ranking.member_count == 5
+        assert ranking.completed_count == 5
+        if isinstance(ranking, RelayRanking):
+            assert [e['rank'] for e in ranking] == [1, 2, 3, 4, 5]
+
+def test_generator_errors(generated):
+    generator = EventGenerator(generated, categories=1, teams=10, legs=2,
+                               missing=0, additional=0, dnf=1, reused=1)
+    result = generator.generate()
+    assert result['runs'] == 20
+    assert result['punches'] == 20 * 6
+
+    event = RelayEvent(generator.legs(), cache=Cache(), store=generated)
+    for run in generated.find(Run):
+        assert run.card_finish_time is None
+        assert event.validate(run)['status'] != Validator.OK
+
+    # the second runner uses the card of the first runner
+    team = generated.find(Team, Team.number == 'C01001').one()
+    assert [r.sicards.count() for r in team.members.order_by('number')] == [1, 0]
+
+def test_generator_reused_rankings(generated):
+    generator = EventGenerator(generated, categories=1, teams=3, legs=3,
+                               missing=0, additional=0, dnf=0, reused=0)
+    generator.generate()
+
+    # the second runner of the first team uses the card of the first runner
+    team = generated.find(Team, Team.number == 'C01001').one()
+    first, second, third = [r.sicards.one() for r in team.members.order_by('number')]
+    generated.execute('UPDATE run SET sicard = ? WHERE sicard = ?', (first.id, second.id))
+    generated.remove(second)
+    generated.commit()
+
+    # the start of the third leg is unknown, the team can't be scored
+    event = RelayEvent(generator.legs(), cache=Cache(), store=generated)
+    ranking = event.ranking(team.category)
+    ranking.update()
+    assert ranking.member_count == 3
+    assert [e['item'] for e in ranking][-1] is team
+    assert ranking.info(team)['runs'] == []
+
+def test_generator_rounds(store):
+    with pytest.raises(ValueError):
+        EventGenerator(store, variants=2, rounds=3)
@@ -0,0 +1,129 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the punch ingestion service
+"""
+
+import asyncio
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from sireader import SIReader
+from storm.locals import *
+
+from bosco.ingest import PunchIngester, decode_frames, decode_punch, encode_frame
+from bosco.journal import Journal
+from bosco.run import Run, Punch
+from bosco.test.fakestation import FakeStation, encode_cardnr, encode_time
+
+@pytest.fixture
+def stations():
+    stations = [FakeStation(31), FakeStation(32)]
+    yield stations
+    for s in stations:
+        s.close()
+
+@pytest.fixture
+def empty_store():
+    """Store which is committed to, the tables are truncated afterwards."""
+    store = Store(create_database('postgres:bosco_test'))
+    yield store
+    store.rollback()
+    for table in ('run', 'punch', 'sicard', 'sistation'):
+        store.execute('TRUNCATE %s CASCADE' % table)
+    store.commit()
+
+def test_decode_frames():
+    now = datetime.now().replace(microsecond=0)
+    record = (encode_cardnr(500123) + b'\x00' + encode_time(now) + b'\x00'
+              + SIReader._to_str(16, 3))
+    frame = encode_frame(SIReader.C_TRANS_REC, 31, record)
+
+    # garbage before the frame, a broken frame and an incomplete frame
+    broken = frame[:-3] + b'\x00\x00' + frame[-1:]
+    frames, rest = decode_frames(b'\xff' + frame + broken + frame + frame[:5])
+    assert frames == [(SIReader.C_TRANS_REC, 31, record)] * 2
+    assert rest == frame[:5]
+    assert decode_punch(record) == (500123, now, 16)
+
+    # SI5 cards
+    assert decode_punch(encode_cardnr(312345) + record[4:])[0] == 312345
+
+def test_ingest(stations, empty_store):
+    now = datetime.now().replace(microsecond=0)
+
+    async def ingest():
+        ingester = PunchIngester(empty_store, [s.port for s in stations],
+                                 interval=0.01)
+        task = asyncio.ensure_future(ingester.run())
+        await asyncio.sleep(0.05)
+
+        stations[0].punch(500001, now - timedelta(minutes=2))
+        stations[1].punch(500001, now - timedelta(minutes=1))
+        stations[0].punch(500002, now - timedelta(minutes=1))
+        # punches sent again (e.g. by a second radio receiver) are ignored
+        stations[0].punch(500001, now - timedelta(minutes=2))
+
+        for i in range(200):
+            if ingester.stored == 3:
+                break
+            await asyncio.sleep(0.01)
+        ingester.stop()
+        await task
+        return ingester.stored
+
+    assert asyncio.run(ingest()) == 3
+
+    empty_store.rollback()
+    runs = {r.sicard.id: r for r in empty_store.find(Run)}
+    assert sorted(runs) == [500001, 500002]
+    assert not runs[500001].complete
+    assert ([(p.sistation.id, p.card_punchtime)
+             for p in runs[500001].punches.order_by(Punch.card_punchtime)]
+            == [(31, now - timedelta(minutes=2)), (32, now - timedelta(minutes=1))])
+
+def test_ingest_open_run(empty_store):
+    """Test that punches are added to the open run of a card"""
+    now = datetime.now().replace(microsecond=0)
+    complete = empty_store.add(Run(500001, store=empty_store))
+    complete.complete = True
+    run = empty_store.add(Run(500001, store=empty_store))
+    empty_store.commit()
+
+    ingester = PunchIngester(empty_store)
+    assert ingester.store_punches([(31, 500001, now)]) == 1
+    assert ingester.store_punches([(31, 500001, now), (32, 500001, now)]) == 1
+    assert run.punches.count() == 2
+    assert complete.punches.count() == 0
+
+def test_ingest_bad_punch(empty_store, tmp_path):
+    """Test that a punch which can not be stored does not block the punches
+    received after it"""
+    now = datetime.now().replace(microsecond=0)
+    journal = Journal(str(tmp_path / 'journal'))
+    ingester = PunchIngester(empty_store, journal=journal)
+    # the station code is out of the range of the database column
+    ingester.add(2**40, 500001, now)
+    ingester.add(31, 500001, now)
+    ingester.add(32, 500002, now)
+
+    asyncio.run(ingester.flush())
+    assert ingester.stored == 2
+    assert sorted(empty_store.find(Run).values(Run._sicard_id)) == [500001, 500002]
+    assert journal.replay() == []
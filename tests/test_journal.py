@@ -0,0 +1,106 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the punch journal
+"""
+
+import asyncio
+import os
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from storm.exceptions import DisconnectionError
+from storm.locals import *
+
+from bosco.ingest import PunchIngester
+from bosco.journal import Journal
+from bosco.run import Run
+
+@pytest.fixture
+def empty_store():
+    """Store which is committed to, the tables are truncated afterwards."""
+    store = Store(create_database('postgres:bosco_test'))
+    yield store
+    store.rollback()
+    for table in ('run', 'punch', 'sicard', 'sistation'):
+        store.execute('TRUNCATE %s CASCADE' % table)
+    store.commit()
+
+def test_journal(tmp_path):
+    path = str(tmp_path / 'journal')
+    now = datetime.now()
+    card = {'card_number': 500001, 'start': now, 'finish': None,
+            'check': None, 'clear': now, 'punches': [(31, now)]}
+
+    journal = Journal(path)
+    first = journal.append('punch', (31, 500001, now))
+    journal.append('card', card, sync=True)
+    assert journal.replay() == [('punch', (31, 500001, now), first),
+                                ('card', card, os.path.getsize(path))]
+
+    journal.checkpoint(first)
+    journal.close()
+
+    # incomplete records are removed when the journal is opened
+    with open(path, 'ab') as f:
+        f.write(b'["punch", [32, 5000')
+    journal = Journal(path)
+    assert [r[1] for r in journal.replay()] == [card]
+    journal.append('punch', (32, 500001, now))
+    assert len(journal.replay()) == 2
+
+def test_ingest_journal(tmp_path, empty_store):
+    """Test that punches received while the database is not available are
+    stored afterwards"""
+    path = str(tmp_path / 'journal')
+    now = datetime.now().replace(microsecond=0)
+    punches = [(31, 500001, now - timedelta(minutes=2)),
+               (32, 500001, now - timedelta(minutes=1)),
+               (31, 500002, now)]
+
+    def unavailable(punches):
+        raise DisconnectionError('database not available')
+
+    ingester = PunchIngester(empty_store, batch=2, journal=Journal(path))
+    ingester.store_punches = unavailable
+    for p in punches:
+        ingester.add(*p)
+    asyncio.run(ingester.flush())
+    assert ingester.stored == 0
+
+    # the punches are stored after a restart
+    async def restart():
+        ingester = PunchIngester(empty_store, batch=2, interval=0.01,
+                                 journal=Journal(path))
+        task = asyncio.ensure_future(ingester.run())
+        await asyncio.sleep(0.05)
+        ingester.stop()
+        await task
+        return ingester.stored
+    assert asyncio.run(restart()) == 3
+    assert Journal(path).replay() == []
+    assert empty_store.find(Run).count() == 2
+
+    # replaying the punches again does not store them again, even if the run
+    # was completed in the meantime
+    empty_store.find(Run, Run._sicard_id == 500001).one().complete = True
+    empty_store.commit()
+    os.remove(path + '.pos')
+    assert asyncio.run(restart()) == 0
+    assert empty_store.find(Run).count() == 2
@@ -0,0 +1,65 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the LaTeX builder
+"""
+
+import sys
+
+import pytest
+
+from bosco.latex import LatexBuilder, LatexError
+
+# Fake LaTeX: copies the source to the PDF, fails if the source contains FAIL
+FAKE_LATEX = """
+import sys
+tex = open(sys.argv[1]).read()
+if 'FAIL' not in tex:
+    open(sys.argv[1][:-4] + '.pdf', 'w').write(tex)
+"""
+
+@pytest.fixture
+def builder(tmp_path):
+    fake = tmp_path / 'fake_latex.py'
+    fake.write_text(FAKE_LATEX)
+    return LatexBuilder(str(tmp_path / 'cache'), jobs=2,
+                        command=(sys.executable, str(fake)))
+
+def test_build(builder, tmp_path):
+    calls = []
+    def tex(text):
+        def render():
+            calls.append(text)
+            return text
+        return render
+
+    documents = [('A', 'a', tex('A')), ('B', 'b', 'FAIL'), ('C', 'c', tex('C'))]
+    results = builder.build(documents, str(tmp_path))
+    assert [(n, e is None) for n, pdf, e in results] == [('A', True), ('B', False),
+                                                         ('C', True)]
+    assert isinstance(results[1][2], LatexError)
+    assert open(results[0][1]).read() == 'A'
+    assert open(results[2][1]).read() == 'C'
+
+    # unchanged documents are taken from the cache without rendering them
+    results = builder.build(documents, str(tmp_path))
+    assert calls == ['A', 'C']
+    assert open(results[2][1]).read() == 'C'
+
+    builder.merge([results[0][1], results[2][1]], str(tmp_path / 'all.pdf'))
+    merged = (tmp_path / 'all.pdf').read_text()
+    assert merged.index(results[0][1]) < merged.index(results[2][1])
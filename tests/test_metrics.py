@@ -0,0 +1,100 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the metrics registry and the profiler
+"""
+
+import pytest
+
+from os import listdir
+from urllib.request import urlopen
+
+from bosco.course import Course
+from bosco.event import RelayEvent
+from bosco.metrics import Metrics, Profiler, metrics, serve_metrics
+from bosco.ranking import Cache
+from bosco.test.generator import EventGenerator, clear
+
+def test_metrics():
+    registry = Metrics()
+    registry.observe('validation', 0.5, 10)
+    with registry.timer('ranking_update'):
+        pass
+    with pytest.raises(ValueError):
+        with registry.timer('ranking_update'):
+            raise ValueError()
+
+    @registry.timer('render')
+    def render():
+        pass
+    render()
+    render()
+
+    assert registry.get('validation') == (10, 0.5, 0.5)
+    assert registry.get('ranking_update')[0] == 2
+    assert registry.get('render')[0] == 2
+    assert registry.get('unknown') == (0, 0.0, 0.0)
+    assert registry.render().splitlines()[-5:] == [
+        '# TYPE bosco_validation_seconds summary',
+        'bosco_validation_seconds_count 10',
+        'bosco_validation_seconds_sum 0.500000',
+        '# TYPE bosco_validation_seconds_max gauge',
+        'bosco_validation_seconds_max 0.500000',
+        ]
+
+def test_metrics_file_and_server(tmp_path):
+    registry = Metrics()
+    registry.observe('observer_cycle', 0.25)
+    registry.write(str(tmp_path / 'bosco.prom'))
+    assert (tmp_path / 'bosco.prom').read_text() == registry.render()
+
+    server = serve_metrics(0, registry=registry)
+    try:
+        url = 'http://localhost:%d/metrics' % server.server_address[1]
+        with urlopen(url) as response:
+            assert response.read().decode('utf-8') == registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_profiler(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    started = profiler.toggle()
+    assert len(started) == 1
+    assert 'test_profiler' in open(started[0]).read()
+
+    sum(range(1000))
+    stopped = profiler.toggle()
+    assert [f.rsplit('.', 1)[1] for f in stopped] == ['txt', 'prof', 'txt']
+    assert len(listdir(str(tmp_path))) == 4
+
+def test_ranking_metrics(store):
+    generator = EventGenerator(store, categories=1, teams=10, legs=1,
+                               variants=1)
+    generator.generate()
+    try:
+        event = RelayEvent(generator.legs(), cache=Cache(), store=store)
+        ranking = event.ranking(store.find(Course).one())
+        before = {name: metrics.get(name)[0]
+                  for name in ('ranking_update', 'scoreing', 'validation')}
+        ranking.update()
+        assert metrics.get('ranking_update')[0] == before['ranking_update'] + 1
+        # observed once per ranking
+        assert metrics.get('scoreing')[0] == before['scoreing'] + 1
+        assert metrics.get('validation')[0] == before['validation'] + 1
+    finally:
+        clear(store)
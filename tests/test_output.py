@@ -0,0 +1,54 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the output directory
+"""
+
+import os
+
+from bosco.output import OutputDirectory
+
+def test_only_changed_files(tmp_path):
+    output = OutputDirectory(str(tmp_path))
+    assert output.write('a.html', b'a') == True
+    assert output.write('b.html', b'b') == True
+    assert output.changes() == ['a.html', 'b.html']
+
+    assert output.write('a.html', b'a') == False
+    assert output.write('b.html', b'B') == True
+    assert output.changes() == ['b.html']
+    assert (tmp_path / 'b.html').read_bytes() == b'B'
+
+    # no temporary files are left behind
+    assert sorted(os.listdir(str(tmp_path))) == ['a.html', 'b.html']
+
+def test_existing_files(tmp_path):
+    """Files from a previous run are not rewritten."""
+    (tmp_path / 'a.html').write_bytes(b'a')
+    mtime = os.stat(str(tmp_path / 'a.html')).st_mtime_ns
+    output = OutputDirectory(str(tmp_path))
+    assert output.write('a.html', b'a') == False
+    assert os.stat(str(tmp_path / 'a.html')).st_mtime_ns == mtime
+    assert output.changes() == []
+
+def test_manifest(tmp_path):
+    output = OutputDirectory(str(tmp_path))
+    output.write('a.html', b'a')
+    output.write('b.html', b'b')
+    manifest = str(tmp_path / 'manifest')
+    output.write_manifest(manifest, output.changes())
+    assert open(manifest).read() == 'a.html\nb.html\n'
@@ -0,0 +1,102 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the query log and query budgets of the hot paths
+"""
+
+import pytest
+
+from storm.locals import Store
+
+from bosco.course import Course
+from bosco.event import RelayEvent
+from bosco.querylog import QueryLog
+from bosco.ranking import Cache
+from bosco.runner import Runner
+from bosco.test.generator import EventGenerator, clear
+
+@pytest.fixture
+def course_event(store):
+    """Relay event with a single leg: one course with 100 runs."""
+    generator = EventGenerator(store, categories=1, teams=100, legs=1,
+                               variants=1, controls=12)
+    generator.generate()
+    yield RelayEvent(generator.legs(), cache=Cache(), store=store)
+    clear(store)
+
+def test_querylog(testevent, store, querylog):
+    runner = store.find(Runner, Runner.number == '101').one()
+    querylog.reset()
+    runner.run
+    assert querylog.count == 2
+    assert querylog.sites.keys() == {'bosco.runner.Runner._get_run'}
+    assert querylog.time > 0
+
+    store.find(Runner).count()
+    assert querylog.count == 3
+    assert querylog.sites[None][0] == 1
+    assert querylog.report().splitlines()[1:] == [
+        '      2    %.3fs  bosco.runner.Runner._get_run' % querylog.sites['bosco.runner.Runner._get_run'][1],
+        '      1    %.3fs  (not bosco)' % querylog.sites[None][1],
+        ]
+
+def test_querylog_store(store):
+    other = Store(store.get_database())
+    try:
+        with QueryLog(store) as log:
+            other.find(Runner).count()
+            assert log.count == 0
+            store.find(Runner).count()
+            assert log.count == 1
+        store.find(Runner).count()
+        assert log.count == 1
+    finally:
+        other.close()
+
+# Known N+1 baseline: the punchlist and the start time (the finish time of
+# the previous leg) are still loaded for every run. Only these call sites
+# may grow with the number of runs, lower their budgets when they are fixed.
+PER_RUN_SITES = {'bosco.run.Run.punchlist',
+                 'bosco.ranking.RelayStarttime._prev_finish_ordered'}
+
+def budget(querylog):
+    """
+    @return: tuple (per run, per ranking): the maximum number of statements
+             of a call site in PER_RUN_SITES and the number of statements of
+             all other call sites
+    """
+    per_run = [c for site, (c, t) in querylog.sites.items() if site in PER_RUN_SITES]
+    return (max(per_run, default=0),
+            sum(c for site, (c, t) in querylog.sites.items() if site not in PER_RUN_SITES))
+
+def test_course_ranking_budget(course_event, store, querylog):
+    ranking = course_event.ranking(store.find(Course).one())
+
+    querylog.reset()
+    ranking.update()
+    assert ranking.member_count == 100
+    per_run, per_ranking = budget(querylog)
+    assert per_run <= 4 * 100
+    # independent of the number of runs
+    assert per_ranking <= 10
+
+    # validation and scoreing results are cached
+    querylog.reset()
+    ranking.update()
+    per_run, per_ranking = budget(querylog)
+    assert per_run <= 1 * 100
+    assert per_ranking <= 5
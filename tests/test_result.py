@@ -0,0 +1,134 @@
+#
+#    Copyright (C) 2008  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the compact result records
+"""
+
+import pytest
+
+from datetime import timedelta
+
+from bosco.ranking import SequenceCourseValidator, Validator
+from bosco.result import ValidationResult, ScoreingResult, PunchList
+from bosco.run import Punch
+
+def test_result_dict_access():
+    """Test that result records behave like dicts."""
+    result = ValidationResult(status=Validator.OK)
+    assert result['status'] == Validator.OK
+    assert result.status == Validator.OK
+    assert 'status' in result
+    assert 'override' not in result
+    assert result.get('override') is None
+    with pytest.raises(KeyError):
+        result['override']
+
+    # keys without slots
+    result['information'] = {'blocks': 'finish'}
+    assert result['information'] == {'blocks': 'finish'}
+    assert result == {'status': Validator.OK,
+                      'information': {'blocks': 'finish'}}
+    assert sorted(result.keys()) == ['information', 'status']
+
+    del result['status']
+    assert 'status' not in result
+    assert ScoreingResult(score=1) != ScoreingResult(score=2)
+
+def test_punchlist_compact(testevent):
+    """Test that validated punchlists only store ids and times."""
+    validator = SequenceCourseValidator(testevent._course)
+    punchlist = validator.validate(testevent._runs[2])['punchlist']
+    assert isinstance(punchlist, PunchList)
+    assert punchlist._objects is None
+
+    punches = list(punchlist)
+    assert [s for s, p in punches] == ['ok', 'ok', 'ignored', 'ok',
+                                       'additional', 'ok']
+    assert all(isinstance(p, Punch) for s, p in punches)
+    assert ([punchlist.punchtime(i) for i in range(len(punchlist))]
+            == [p.punchtime for s, p in punches])
+    assert punchlist[-1] == punches[-1]
+
+def test_punchlist_missing(testevent):
+    """Test punchlists with missing controls."""
+    validator = SequenceCourseValidator(testevent._course)
+    punchlist = validator.validate(testevent._runs[3])['punchlist']
+    assert punchlist.status(0) == 'missing'
+    assert punchlist.punchtime(0) is None
+    assert punchlist[0][1].code == '131'
+
+def test_scoreing_result_time():
+    """Test that time scores are stored as integer microseconds."""
+    result = ScoreingResult(score=timedelta(minutes=5))
+    assert result.time == 5 * 60 * 10**6
+    assert result['score'] == timedelta(minutes=5)
+    assert 'behind' not in result
+
+    result.behind_time = 1500000
+    assert result['behind'] == timedelta(seconds=1, microseconds=500000)
+
+    # other scores are stored as they are
+    result['score'] = 3
+    assert result.time is None
+    assert result['score'] == 3
+
+def test_punchlist_bulk_resolve(testevent, monkeypatch):
+    """Test that punchlist objects are looked up with one query per class."""
+    validator = SequenceCourseValidator(testevent._course)
+    punchlist = validator.validate(testevent._runs[3])['punchlist']
+    store = punchlist._store
+
+    queries = []
+    find = store.find
+    def counting_find(cls, *args, **kwargs):
+        queries.append(cls)
+        return find(cls, *args, **kwargs)
+    monkeypatch.setattr(store, 'find', counting_find)
+
+    first = list(punchlist)
+    assert list(punchlist) == first
+    assert sorted([c.__name__ for c in queries]) == sorted(set([type(p).__name__
+                                                                for s, p in first]))
+
+def test_punchlist_resolve_many(testevent, monkeypatch):
+    """Test that many punchlists are resolved with one query per class."""
+    validator = SequenceCourseValidator(testevent._course)
+    punchlists = [validator.validate(r)['punchlist'] for r in testevent._runs[2:4]]
+    expected = [list(validator.validate(r)['punchlist'])
+                for r in testevent._runs[2:4]]
+    store = punchlists[0]._store
+
+    queries = []
+    find = store.find
+    def counting_find(cls, *args, **kwargs):
+        queries.append(cls)
+        return find(cls, *args, **kwargs)
+    monkeypatch.setattr(store, 'find', counting_find)
+
+    PunchList.resolve(punchlists + [[]])
+    assert len(queries) == len(set(queries))
+    assert [list(p) for p in punchlists] == expected
+
+def test_result_list_behaviour(testevent):
+    """Test that results behave like the dicts and lists they replace."""
+    with pytest.raises(TypeError):
+        hash(ValidationResult(status=Validator.OK))
+
+    validator = SequenceCourseValidator(testevent._course)
+    punchlist = validator.validate(testevent._runs[2])['punchlist']
+    assert [] + punchlist == list(punchlist)
+    assert punchlist + [] == list(punchlist)
@@ -30,6 +30,7 @@ from bosco.run import Punch
 from bosco.run import Run
 from bosco.runner import SICard
 from bosco.ranking import MassstartStarttime
+from bosco.ranking import PartialRanking
 from bosco.ranking import RelayMassstartStarttime
 from bosco.ranking import RelayStarttime
 from bosco.ranking import RoundCountScoreing
@@ -237,6 +238,120 @@ def test_ranking_random_access(testevent):
     with pytest.raises(KeyError):
         ranking.rank(testevent._runs[6])
 
+def test_ranking_top(testevent):
+    """Test partial rankings with the first n entries."""
+
+    ranking = Event({}, store=testevent._store).ranking(testevent._course)
+
+    top = ranking.top(3)
+    assert [r['rank'] for r in top] == [1, 1, 3]
+    assert top[2]['item'] == testevent._runs[4]
+    assert top[2]['scoreing']['behind'] == timedelta(seconds=8)
+
+    # counts are exact, but the ranking is not sorted completely
+    counts = (ranking._member_count, ranking._completed_count)
+    assert not ranking._initialized
+
+    assert ranking.top(2) == list(ranking)[:2]
+    assert counts == (ranking.member_count, ranking.completed_count)
+
+def test_ranking_top_refresh(testevent):
+    """Test that partial rankings are recomputed on every call."""
+
+    ranking = Event({}, store=testevent._store).ranking(testevent._course)
+    leader = ranking[0]['item']
+    partial = PartialRanking(ranking, 2)
+    assert [r['item'] for r in partial][0] == leader
+
+    leader.override = Validator.DISQUALIFIED
+    assert ranking.top(1)[0]['item'] != leader
+    assert [r['item'] for r in partial][0] != leader
+    assert [r['item'] for r in partial] == [r['item'] for r in list(ranking)[:2]]
+
+def test_relay_ranking_top(testevent):
+    """Test that partial relay rankings have the same leg results."""
+
+    event = testevent._prepare_relay()
+    ranking = event.ranking(testevent._team.category)
+    top = ranking.top(1)[0]
+    full = list(ranking)[0]
+    assert top['item'] == full['item']
+    assert ([r and (r['item'], r['rank']) for r in top['runs']]
+            == [r and (r['item'], r['rank']) for r in full['runs']])
+    assert ([s['rank'] for s in top['splits']]
+            == [s['rank'] for s in full['splits']])
+
+def test_ranking_around(testevent):
+    """Test partial rankings around one item."""
+
+    ranking = Event({}, store=testevent._store).ranking(testevent._course)
+
+    around = ranking.around(testevent._runs[1], 1)
+    assert [r['item'] for r in around] == [testevent._runs[4],
+                                           testevent._runs[1],
+                                           testevent._runs[3]]
+    assert [r['rank'] for r in around] == [3, 4, None]
+
+    assert len(ranking.around(list(ranking)[0]['item'], 2)) == 3
+    assert ranking.around(testevent._runs[1], 1) == around
+
+    with pytest.raises(KeyError):
+        ranking.around(testevent._runs[6], 1)
+
+def test_ranking_changes(testevent):
+    """Test the changes of a ranking between two versions."""
+
+    ranking = Event({}, store=testevent._store).ranking(testevent._course)
+    ranking.update()
+    version = ranking.version
+    assert version == 1
+
+    # updates without changes keep the version
+    ranking.update()
+    assert ranking.version == version
+    changes = ranking.changes_since(version)
+    assert changes['moved'] == changes['inserted'] == changes['removed'] == []
+
+    # disqualify the run on rank 3
+    testevent._runs[4].override = Validator.DISQUALIFIED
+    ranking.update()
+    assert ranking.version == version + 1
+
+    changes = ranking.changes_since(version)
+    assert changes['leader'] is None
+    moved = dict([(c['item'], c) for c in changes['moved']])
+    assert moved[testevent._runs[4]]['old']['rank'] == 3
+    assert moved[testevent._runs[4]]['new']['rank'] is None
+    assert moved[testevent._runs[4]]['new']['status'] == Validator.DISQUALIFIED
+    assert moved[testevent._runs[1]]['new']['rank'] == 3
+
+    # all items are new since version 0
+    assert len(ranking.changes_since(0)['inserted']) == 6
+
+    with pytest.raises(KeyError):
+        ranking.changes_since(version + 2)
+
+def test_ranking_changes_leader(testevent):
+    """Test that only valid winners are reported as new leaders."""
+
+    ranking = Event({}, store=testevent._store).ranking(testevent._course)
+    ranking.update()
+    version = ranking.version
+
+    # snapshots do not reference the ranked objects
+    assert all(type(k) is tuple for k in ranking._history[-1][1])
+
+    # nobody has a valid run anymore
+    for run in testevent._runs:
+        run.override = Validator.DISQUALIFIED
+    ranking.update()
+    assert ranking.changes_since(version)['leader'] is None
+
+    winner = testevent._runs[1]
+    winner.override = Validator.OK
+    ranking.update()
+    assert ranking.changes_since(version)['leader'] is winner
+
 def test_overrride_control(testevent):
     """Test override for a control."""
     # Add override for control 131
@@ -553,3 +668,21 @@ def test_roundcount_missing(testevent):
     course = testevent._store.find(Course, Course.code == 'D').one()
     scoreing = RoundCountScoreing(course)
     assert scoreing.score(testevent._runs[9])['score'] == 2
+
+def test_card_fingerprint(testevent):
+    """Test that runs are found by the fingerprint of their card data"""
+    card_data = {'card_number': 655465,
+                 'start': datetime(2008, 3, 19, 8, 20, 32),
+                 'finish': datetime(2008, 3, 19, 8, 25, 37),
+                 'check': None,
+                 'clear': None,
+                 'punches': [(131, datetime(2008, 3, 19, 8, 22, 39)),
+                             (132, datetime(2008, 3, 19, 8, 23, 35))]}
+    fingerprint = Run.card_fingerprint(card_data)
+    assert fingerprint == Run.card_fingerprint(dict(card_data))
+    assert fingerprint != Run.card_fingerprint(dict(card_data, clear=card_data['start']))
+    assert fingerprint != Run.card_fingerprint(dict(card_data,
+                                                    punches=card_data['punches'][:1]))
+
+    testevent._runs[0].fingerprint = fingerprint
+    assert testevent._store.find(Run, Run.fingerprint == fingerprint).one() is testevent._runs[0]
@@ -0,0 +1,123 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the ranking refresh scheduler
+"""
+
+import pytest
+
+from bosco.scheduler import RefreshScheduler
+
+class Clock:
+    """Fake clock, advanced manually."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+def scheduler(clock, keys, **kwargs):
+    s = RefreshScheduler(clock=clock, **kwargs)
+    for k in keys:
+        s.add(k)
+    return s
+
+def test_new_rankings_are_due(clock):
+    s = scheduler(clock, ['A', 'B'])
+    assert sorted(s.pop_due()) == ['A', 'B']
+    assert s.pop_due() == []
+    assert s.next_due() is None
+
+def test_min_interval(clock):
+    s = scheduler(clock, ['A'], min_interval=10)
+    s.pop_due()
+
+    clock.now = 3
+    s.mark_dirty('A')
+    assert s.pop_due() == []
+    assert s.next_due() == 7
+
+    clock.now = 10
+    assert s.pop_due() == ['A']
+
+def test_change_during_refresh(clock):
+    """Changes arriving while a ranking is refreshed are not lost."""
+    s = scheduler(clock, ['A'], min_interval=10)
+    assert s.pop_due() == ['A']
+    s.mark_dirty('A')
+    clock.now = 10
+    assert s.pop_due() == ['A']
+
+def test_priority(clock):
+    s = scheduler(clock, ['A', 'B', 'C'], min_interval=0)
+    s.set_shown('C')
+    s.pop_due()
+
+    clock.now = 1
+    s.mark_dirty('A')
+    clock.now = 2
+    s.mark_dirty('B')
+    s.mark_dirty('C')
+    # shown first, then most recently changed
+    assert s.pop_due() == ['C', 'B', 'A']
+
+def test_batch_and_latency(clock):
+    s = scheduler(clock, ['A', 'B', 'C'], min_interval=0, max_latency=30,
+                  batch=1)
+    s.set_shown('C')
+    assert s.pop_due() == ['C']
+
+    clock.now = 10
+    s.mark_dirty('C')
+    assert s.pop_due() == ['C']
+
+    # A and B are overdue and are returned regardless of the batch limit
+    clock.now = 30
+    s.mark_dirty('C')
+    assert s.pop_due() == ['A', 'B']
+    assert s.pop_due() == ['C']
+
+def test_max_interval(clock):
+    s = scheduler(clock, ['A', 'B'], max_interval=60)
+    s.add('C', max_interval=120)
+    s.pop_due()
+    assert s.next_due() == 60
+
+    clock.now = 60
+    assert sorted(s.pop_due()) == ['A', 'B']
+    clock.now = 120
+    assert sorted(s.pop_due()) == ['A', 'B', 'C']
+
+def test_wait(clock):
+    s = scheduler(clock, ['A'])
+    assert s.wait(0) == True
+    s.pop_due()
+    assert s.wait(0) == False
+
+def test_invalid_settings(clock):
+    with pytest.raises(ValueError):
+        RefreshScheduler(min_interval=60, max_latency=30)
+    s = scheduler(clock, [])
+    with pytest.raises(ValueError):
+        s.add('A', min_interval=120)
+    with pytest.raises(KeyError):
+        s.mark_dirty('A')
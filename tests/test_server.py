@@ -0,0 +1,126 @@
+#
+#    Copyright (C) 2014  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the live results server
+"""
+
+import asyncio
+import gzip
+import json
+
+from bosco.server import LiveServer, Page, accepts_gzip
+
+async def request(port, path, headers=()):
+    """Send a GET request.
+    @return: tuple (status, headers, body)
+    """
+    reader, writer = await asyncio.open_connection('localhost', port)
+    lines = ['GET %s HTTP/1.1' % path, 'Host: localhost', 'Connection: close']
+    lines.extend('%s: %s' % h for h in headers)
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b'\r\n\r\n', 1)
+    head = head.decode('latin-1').split('\r\n')
+    status = int(head[0].split()[1])
+    headers = dict((n.lower(), v.strip()) for n, v in
+                   (l.split(':', 1) for l in head[1:]))
+    return status, headers, body
+
+def run(test):
+    """Run test(server) with a started server."""
+    async def main():
+        server = LiveServer(port=0)
+        await server.start()
+        try:
+            await test(server)
+        finally:
+            server.close()
+    asyncio.run(main())
+
+def test_pages():
+    async def test(server):
+        server.publish([('a.html', b'<p>A</p>')], 'A')
+        await asyncio.sleep(0)
+
+        status, headers, body = await request(server.port, '/a.html')
+        assert status == 200
+        assert body == b'<p>A</p>'
+        assert headers['content-type'] == 'text/html; charset=utf-8'
+
+        status, headers2, body = await request(server.port, '/a.html',
+                                               [('If-None-Match', headers['etag'])])
+        assert status == 304
+        assert body == b''
+
+        status, headers, body = await request(server.port, '/a.html',
+                                              [('Accept-Encoding', 'gzip')])
+        assert headers['content-encoding'] == 'gzip'
+        assert gzip.decompress(body) == b'<p>A</p>'
+
+        status, headers, body = await request(server.port, '/a.html',
+                                              [('Accept-Encoding', 'gzip;q=0, deflate')])
+        assert 'content-encoding' not in headers
+        assert body == b'<p>A</p>'
+
+        status, headers, body = await request(server.port, '/b.html')
+        assert status == 404
+    run(test)
+
+def test_accepts_gzip():
+    assert accepts_gzip('gzip')
+    assert accepts_gzip('deflate, gzip;q=0.5')
+    assert accepts_gzip('*')
+    assert not accepts_gzip('')
+    assert not accepts_gzip('identity')
+    assert not accepts_gzip('gzip;q=0')
+    assert not accepts_gzip('gzip; q=0.0, *')
+    assert not accepts_gzip('*;q=0')
+
+def test_events():
+    async def test(server):
+        reader, writer = await asyncio.open_connection('localhost', server.port)
+        writer.write(b'GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        head = await reader.readuntil(b'\r\n\r\n')
+        assert b'text/event-stream' in head
+
+        server.publish([('a.html', b'<p>A</p>')], 'A')
+        # unchanged pages are not announced
+        server.publish([('a.html', b'<p>A</p>')], 'A')
+        server.publish([('b.html', b'<p>B</p>')], 'B')
+        events = []
+        for i in range(2):
+            event = await asyncio.wait_for(reader.readuntil(b'\n\n'), 5)
+            events.append(json.loads(event.decode('utf-8').split('data: ')[1]))
+        assert events == [{'ranking': 'A', 'files': ['a.html']},
+                          {'ranking': 'B', 'files': ['b.html']}]
+        writer.close()
+    run(test)
+
+def test_slow_events_client():
+    async def test(server):
+        server.queue_size = 2
+        reader, writer = await asyncio.open_connection('localhost', server.port)
+        writer.write(b'GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        await reader.readuntil(b'\r\n\r\n')
+
+        # events are queued faster than the client reads them
+        for i in range(3):
+            server._publish([('a.html', Page('a.html', b'%d' % i))], 'A')
+        assert await asyncio.wait_for(reader.read(), 5) == b''
+        writer.close()
+    run(test)
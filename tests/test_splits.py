@@ -0,0 +1,86 @@
+#
+#    Copyright (C) 2008  Gaudenz Steinlin <gaudenz@soziologie.ch>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the split time analysis
+"""
+
+import pytest
+
+from datetime import timedelta
+
+from bosco.event import Event
+from bosco.splits import SplitTimes
+
+@pytest.fixture
+def splits(testevent):
+    ranking = Event({}, store=testevent._store).ranking(testevent._course)
+    return SplitTimes(ranking)
+
+def test_split_columns(testevent, splits):
+    """Test that every control and the finish get a column."""
+    info = splits.info(testevent._runs[0])
+    assert ([s['code'] for s in info['splits']]
+            == ['131', '132', '200', '132', SplitTimes.FINISH])
+    assert ([s['cumulative'] for s in info['splits']]
+            == [timedelta(minutes=2, seconds=4),
+                timedelta(minutes=3),
+                timedelta(minutes=4),
+                timedelta(minutes=4, seconds=25),
+                timedelta(minutes=5)])
+
+def test_split_ranks(testevent, splits):
+    """Test split ranks, best splits and behind times."""
+    assert splits.best_split(0, 0) == timedelta(minutes=1, seconds=49)
+
+    first = splits.info(testevent._runs[0])['splits'][0]
+    assert first['split_rank'] == 2
+    assert first['behind'] == timedelta(seconds=15)
+
+    # equal splits get the same rank
+    assert splits.info(testevent._runs[2])['splits'][4]['split_rank'] == 1
+    assert splits.info(testevent._runs[3])['splits'][4]['split_rank'] == 1
+    assert splits.info(testevent._runs[0])['splits'][4]['split_rank'] == 3
+
+def test_split_missing(testevent, splits):
+    """Test that splits next to missing punches are unknown."""
+    info = splits.info(testevent._runs[3])
+    assert info['splits'][0]['split'] is None
+    assert info['splits'][1]['split'] is None
+    assert info['splits'][1]['cumulative'] == timedelta(minutes=2, seconds=14)
+    assert info['splits'][2]['split'] == timedelta(minutes=1, seconds=56)
+
+    # run without start time
+    info = splits.info(testevent._runs[5])
+    assert [s['split'] for s in info['splits']] == [None] * 5
+
+def test_time_lost(testevent, splits):
+    """Test that time lost is estimated relative to the best splits."""
+    info = splits.info(testevent._runs[1])
+    assert info['splits'][1]['lost'] == timedelta(0)
+    assert info['splits'][4]['lost'] > timedelta(seconds=40)
+
+def test_splits_use_ranking_entries(testevent, splits, monkeypatch):
+    """Test that split times do not compute an initialized ranking again."""
+    ranking = splits._ranking
+    ranking.update()
+
+    def update():
+        raise AssertionError('ranking updated again')
+    monkeypatch.setattr(ranking, 'update', update)
+
+    assert len(splits) == len(ranking._ranking_list)
+    assert [s['item'] for s in splits] == [m['item'] for m in ranking._ranking_list]